@@ -1,5 +1,6 @@
 """Python Decorator Templated"""
 from functools import wraps, partial
+from types import MethodType
 
 __all__ = [
     'base_decorator_func',
@@ -203,6 +204,16 @@ class BaseDecorator(object):
 
         return wrapper(*args, **kwargs)
 
+    def __get__(self, instance, owner=None):
+        """Bind the decorated method to the instance it is accessed from.
+
+        Without it the decorator, stored on the class, would be called
+        without ``self``.
+        """
+        if instance is None:
+            return self
+        return MethodType(self, instance)
+
     def __getattr__(self, name):
         return self.decorated.__getattribute__(name)
 
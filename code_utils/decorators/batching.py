@@ -0,0 +1,214 @@
+import asyncio
+import concurrent.futures
+import os
+import threading
+import time
+import weakref
+from functools import partial, wraps
+
+__all__ = [
+    'batched',
+]
+
+
+def _resolve(futures, results=None, error=None):
+    """Sets the result or the exception of the future of each item."""
+    if error is None and len(results) != len(futures):
+        error = ValueError('{} results returned for {} items'.format(len(results), len(futures)))
+    for index, future in enumerate(futures):
+        # cancelled by its caller, the futures of _Batcher are already
+        # running so only the asyncio ones can be
+        if future.done():
+            continue
+        result = results[index] if error is None else error
+        if isinstance(result, BaseException):
+            future.set_exception(result)
+        else:
+            future.set_result(result)
+
+
+class _Batcher(object):
+    """Collects the items of the calls from all the threads and calls function
+    with lists of them, from a thread of its own.
+    """
+    def __init__(self, function, max_size, max_wait):
+        self.function = function
+        self.max_size = max_size
+        self.max_wait = max_wait
+        self._items = []
+        self._futures = []
+        self._condition = threading.Condition()
+        self._thread = None
+        self._pid = None
+
+    def submit(self, item):
+        future = concurrent.futures.Future()
+        with self._condition:
+            # A thread inherited from the parent process does not run
+            if self._thread is None or self._pid != os.getpid():
+                self._items, self._futures = [], []
+                self._thread = threading.Thread(target=self._run, daemon=True,
+                                                name='batched-' + self.function.__name__)
+                self._pid = os.getpid()
+                self._thread.start()
+            self._items.append(item)
+            self._futures.append(future)
+            # Only the first item and a full batch need to wake the thread up
+            if len(self._items) in (1, self.max_size):
+                self._condition.notify()
+        return future
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while not self._items:
+                    self._condition.wait()
+                deadline = time.monotonic() + self.max_wait
+                while len(self._items) < self.max_size:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._condition.wait(remaining)
+                items, futures = self._items[:self.max_size], self._futures[:self.max_size]
+                del self._items[:self.max_size], self._futures[:self.max_size]
+            # The items cancelled by their caller are dropped, the others can't
+            # be cancelled anymore
+            running = [future.set_running_or_notify_cancel() for future in futures]
+            if not all(running):
+                items = [item for item, keep in zip(items, running) if keep]
+                futures = [future for future, keep in zip(futures, running) if keep]
+                if not futures:
+                    continue
+            try:
+                results = list(self.function(items))
+            except BaseException as exc:
+                # The thread has to keep running for the next batches
+                _resolve(futures, error=exc)
+            else:
+                _resolve(futures, results)
+
+
+class _AsyncBatch(object):
+    __slots__ = ('items', 'futures', 'handle')
+
+    def __init__(self):
+        self.items = []
+        self.futures = []
+        self.handle = None
+
+
+class _AsyncBatcher(object):
+    """Collects the items of the calls of each event loop and awaits function
+    with lists of them, in a task.
+    """
+    def __init__(self, function, max_size, max_wait):
+        self.function = function
+        self.max_size = max_size
+        self.max_wait = max_wait
+        self._batches = weakref.WeakKeyDictionary()
+        # References to the running tasks, which the event loop does not keep
+        self._tasks = set()
+
+    async def call(self, item):
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        batch = self._batches.get(loop)
+        if batch is None:
+            batch = self._batches[loop] = _AsyncBatch()
+            batch.handle = loop.call_later(self.max_wait, self._flush, loop, batch)
+        batch.items.append(item)
+        batch.futures.append(future)
+        if len(batch.items) >= self.max_size:
+            batch.handle.cancel()
+            self._flush(loop, batch)
+        return await future
+
+    def _flush(self, loop, batch):
+        if self._batches.get(loop) is batch:
+            del self._batches[loop]
+        task = loop.create_task(self._run(batch))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, batch):
+        try:
+            results = list(await self.function(batch.items))
+        except Exception as exc:
+            _resolve(batch.futures, error=exc)
+        except BaseException as exc:
+            # Raised by the task too, the calls are resolved first so they don't wait forever
+            if isinstance(exc, asyncio.CancelledError):
+                for future in batch.futures:
+                    future.cancel()
+            else:
+                _resolve(batch.futures, error=exc)
+            raise
+        else:
+            _resolve(batch.futures, results)
+
+
+def batched(function=None, max_size=100, max_wait_ms=5):
+    """
+    Turn a function processing a list of items into a function processing a
+    single item, the items of the calls made at about the same time being
+    processed together by a single call of the function.
+
+    The first item of a batch waits at most max_wait_ms milliseconds for
+    other ones, then the function is called with the list of the items
+    collected, at most max_size, and each call returns the result of its item
+    or raises its exception.
+
+    Functions are called from a thread of the decorator, one batch at a time,
+    and the calls from all the threads are batched together. The wrapper has
+    a submit method returning a concurrent.futures.Future instead of waiting
+    for the result. Coroutine functions are awaited in a task of the event
+    loop of the calls, the calls of each event loop being batched together.
+
+    Parameters
+    ----------
+    function : function
+        The function which shall be wrapper. It takes a list of items and
+        returns the list of their results in the same order. An exception
+        instance in place of a result is raised by the call of its item, an
+        exception raised by the function is raised by all the calls.
+
+    max_size : int, optional
+        maximum number of items of a batch, by default 100
+
+    max_wait_ms : float, optional
+        maximum time the first item of a batch waits for other ones,
+        in milliseconds, by default 5
+
+    Returns
+    -------
+    function
+        The wrapper function
+
+    Example
+    -------
+    >>> @batched(max_size=500, max_wait_ms=2)
+    ... def get_users(user_ids):
+    ...     rows = database.select_users(user_ids)
+    ...     return [rows.get(user_id, KeyError(user_id)) for user_id in user_ids]
+    >>> users = threaded(get_users)(user_ids)
+    """
+    if function is None:
+        return partial(batched, max_size=max_size, max_wait_ms=max_wait_ms)
+    if max_size < 1:
+        raise ValueError('max_size must be at least 1, not {!r}'.format(max_size))
+
+    if asyncio.iscoroutinefunction(function):
+        batcher = _AsyncBatcher(function, max_size, max_wait_ms / 1000)
+
+        @wraps(function)  # maintain all the info about the function
+        async def async_wrapper(item):
+            return await batcher.call(item)
+        return async_wrapper
+
+    batcher = _Batcher(function, max_size, max_wait_ms / 1000)
+
+    @wraps(function)  # maintain all the info about the function
+    def wrapper(item):
+        return batcher.submit(item).result()
+    wrapper.submit = batcher.submit
+    return wrapper
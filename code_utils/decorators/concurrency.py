@@ -1,27 +1,69 @@
-from threading import Thread
+import asyncio
+import atexit
 import concurrent.futures
-from multiprocessing import Pool, Process
-from functools import partial
+import contextvars
+import importlib
+import os
+import pickle
+import queue
+import sys
+import threading
+import time
+import warnings
+import weakref
+from collections import deque
+from itertools import count, islice
+from multiprocessing import Pool
+try:
+    from multiprocessing import resource_tracker
+    from multiprocessing.shared_memory import SharedMemory
+except ImportError:  # Python < 3.8
+    SharedMemory = None
+from functools import partial, wraps
+
+from code_utils.logger import get_log_sink, set_log_sink
 
 __all__ = [
     'run_in_thread',
     'threaded',
     'run_in_process',
     'parallel',
+    'auto_parallel',
+    'scheduled',
+    'to_thread',
+    'to_process',
+    'async_gather_map',
+    'SharedPool',
+    'get_shared_pool',
+    'get_shared_thread_pool',
+    'shutdown_pools',
 ]
 
-def run_in_thread(function, daemon=True):
+def run_in_thread(function=None, daemon=None, max_workers=None, max_concurrency=None):
     """
     Run function in another thread.
-    Caller with no longer be blocked by this function, but also will not
-    be able to catch exception or get results from function.
+    Caller with no longer be blocked by this function, the calls return a
+    concurrent.futures.Future giving the result or the exception of the
+    function, so they can be waited for with concurrent.futures.wait or
+    as_completed. The threads are the ones of a pool shared by the functions
+    decorated by run_in_thread and to_thread.
+
     Parameters
     ----------
     function : function
         The function which shall be wrapper
 
     daemon: bool
-        Set the thread to be daemon, by default True.
+        Deprecated and ignored, the threads of the pool are shared
+
+    max_workers : int, optional
+        number of threads of the shared pool, by default None (see
+        concurrent.futures.ThreadPoolExecutor)
+
+    max_concurrency : int, optional
+        maximum number of calls of this function submitted and not done yet,
+        the next calls wait for one of them to be done, by default None
+        (no limit)
 
     Returns
     -------
@@ -31,19 +73,20 @@ def run_in_thread(function, daemon=True):
     Example
     -------
     ```python
-    @run_in_thread(daemon=True)
+    @run_in_thread
     def task1():
-        do_something
+        return do_something()
 
-    @run_in_thread(daemon=True)
-    def task2():
-        do_something_else
+    @run_in_thread(max_concurrency=4)
+    def task2(value):
+        return do_something_else(value)
     ...
-    t1 = task1()
-    t2 = task2()
+    f1 = task1()
+    futures = [task2(value) for value in values]
     ...
-    t1.join()
-    t2.join()
+    result = f1.result()
+    for future in concurrent.futures.as_completed(futures):
+        print(future.result())
     ```
     """
     if function is None:
@@ -51,67 +94,155 @@ def run_in_thread(function, daemon=True):
         a function and some arguments, so that they are passed around
         as one object without actually calling the function yet.
         """
-        return partial(run_in_thread, daemon=daemon)
+        return partial(run_in_thread, daemon=daemon, max_workers=max_workers,
+                       max_concurrency=max_concurrency)
+    if daemon is not None:
+        warnings.warn('daemon is ignored, run_in_thread runs the functions in a shared pool',
+                      DeprecationWarning, stacklevel=2)
+    limit = _concurrency_limit(max_concurrency)
 
     @wraps(function)  # maintain all the info about the function
     def wrapper(*func_args, **func_kwargs):
-        thread = Thread(target=function,
-                        args=func_args, kwargs=func_kwargs,
-                        daemon=daemon)
-        thread.start()
-        return thread
+        if limit is not None:
+            limit.acquire()
+        try:
+            future = _get_task_thread_pool(max_workers).submit(function, *func_args, **func_kwargs)
+        except BaseException:
+            if limit is not None:
+                limit.release()
+            raise
+        if limit is not None:
+            future.add_done_callback(lambda future: limit.release())
+        return future
     return wrapper
 
-def threaded(function):
-    @wraps(function)  # maintain all the info about the function
-    def wrapper(*func_args, **func_kwargs):
-        results = {}
-        # We can use a with statement to ensure threads are cleaned up promptly
-        with concurrent.futures.ThreadPoolExecutor() as executor:
 
-            futures = {executor.submit(function, [i]): idx for idx,
-                       i in enumerate(func_args[0])}
+def _concurrency_limit(max_concurrency):
+    if max_concurrency is None:
+        return None
+    if max_concurrency < 1:
+        raise ValueError('max_concurrency must be at least 1, not {!r}'.format(max_concurrency))
+    return threading.BoundedSemaphore(max_concurrency)
 
-            tasks = len(futures)
-            tenth = round(tasks / 10)
-            print('Formed pool of {} tasks'.format(tasks))
+_ERROR_POLICIES = ('raise', 'return')
 
-            for idx, future in enumerate(concurrent.futures.as_completed(futures)):
-                i = futures[future]
-                try:
-                    # store result
-                    data = future.result()
-                    # check to see if in array form
-                    if len(data) == 1:
-                        data = data[0]
-                    results[i] = data
-                except Exception as exc:
-                    print('{} generated an exception: {}'.format(
-                        func_args[0][i], exc))
 
-                if tenth != 0 and idx != 0 and idx % tenth == 0:
-                    print('{}% Done'.format((idx // tenth) * 10))
+def threaded(function=None, max_workers=None, max_in_flight=None, errors='raise',
+             progress=None):
+    """
+    Run function in a thread pool, once for each item of the iterable passed
+    as first argument, and return the list of the results in the same order.
+
+    The threads are shared by the calls, see get_shared_thread_pool. The
+    calls made from the function use the threads of another pool, so nested
+    calls don't wait for each other.
 
-        # sort and put in array
-        final = []
-        for k, v in sorted(results.items()):
-            final.append(v)
+    Parameters
+    ----------
+    function : function
+        The function which shall be wrapper. The FIRST argument is the one to
+        be iterated on, the other arguments are the same for all the items.
+
+    max_workers : int, optional
+        number of threads of the pool, by default None (see
+        concurrent.futures.ThreadPoolExecutor)
+
+    max_in_flight : int, optional
+        maximum number of items submitted to the pool and not collected yet,
+        so the iterable is read as the results come, by default twice the
+        number of threads
 
-        return final
+    errors : str, optional
+        'raise' - the first exception raised by the function is raised,
+            the items not started yet are cancelled
+        'return' - the exceptions take the place of the results in the list,
+            by default 'raise'
+
+    progress : function, optional
+        called with the number of collected results and the number of items,
+        None if the iterable has no length, after each result, by default None
+
+    Returns
+    -------
+    function
+        The wrapper function
+
+    Example
+    -------
+    >>> @threaded(max_workers=16)
+    ... def download(url, timeout=10):
+    ...     return requests.get(url, timeout=timeout).content
+    >>> pages = download(urls, timeout=5)
+    """
+    if function is None:
+        return partial(threaded, max_workers=max_workers, max_in_flight=max_in_flight,
+                       errors=errors, progress=progress)
+    if errors not in _ERROR_POLICIES:
+        raise ValueError('errors must be one of {}, not {!r}'.format(_ERROR_POLICIES, errors))
+
+    @wraps(function)  # maintain all the info about the function
+    def wrapper(iterable_values, *func_args, **func_kwargs):
+        executor = get_shared_thread_pool(max_workers)
+        # Default number of threads of ThreadPoolExecutor
+        limit = max_in_flight or 2 * (max_workers or min(32, (os.cpu_count() or 1) + 4))
+        total = len(iterable_values) if hasattr(iterable_values, '__len__') else None
+        results = []
+        # The futures are collected in submission order, no sort is needed
+        pending = deque()
+
+        def collect():
+            future = pending.popleft()
+            try:
+                results.append(future.result())
+            except Exception as exc:
+                if errors == 'raise':
+                    raise
+                results.append(exc)
+            if progress is not None:
+                progress(len(results), total)
+
+        try:
+            for value in iterable_values:
+                if len(pending) >= limit:
+                    collect()
+                pending.append(executor.submit(function, value, *func_args, **func_kwargs))
+            while pending:
+                collect()
+        finally:
+            for future in pending:
+                future.cancel()
+        return results
     return wrapper
 
-def run_in_process(function):
+def run_in_process(function=None, shared_memory=False, nb_processes=None,
+                   max_concurrency=None):
     """
-    Run function in another thread.
-    Caller with no longer be blocked by this function, but also will not
-    be able to catch exception or get results from function.
+    Run function in another process.
+    Caller with no longer be blocked by this function, the calls return a
+    concurrent.futures.Future giving the result or the exception of the
+    function, so they can be waited for with concurrent.futures.wait or
+    as_completed. The processes are the ones of get_shared_pool, so the
+    function, its arguments and its result have to be picklable, and the
+    function can't start processes itself.
+
     Parameters
     ----------
     function : function
         The function which shall be wrapper
 
-    daemon: bool
-        Set the thread to be daemon, by default True.
+    shared_memory : (bool, int), optional
+        pass the large bytes, bytearray, memoryview and numpy arrays arguments
+        and results through shared memory instead of pickling them, see
+        parallel, by default False
+
+    nb_processes : int, optional
+        number of processes of the shared pool, by default None
+        (os.cpu_count())
+
+    max_concurrency : int, optional
+        maximum number of calls of this function submitted and not done yet,
+        the next calls wait for one of them to be done, by default None
+        (no limit)
 
     Returns
     -------
@@ -121,36 +252,617 @@ def run_in_process(function):
     Example
     -------
     ```python
-    @run_in_thread(daemon=True)
-    def task1():
-        do_something
-
-    @run_in_thread(daemon=True)
-    def task2():
-        do_something_else
+    @run_in_process(max_concurrency=8)
+    def compress(path):
+        return do_something(path)
     ...
-    t1 = task1()
-    t2 = task2()
-    ...
-    t1.join()
-    t2.join()
+    futures = [compress(path) for path in paths]
+    concurrent.futures.wait(futures)
     ```
     """
+    if function is None:
+        return partial(run_in_process, shared_memory=shared_memory, nb_processes=nb_processes,
+                       max_concurrency=max_concurrency)
+    min_size = _shared_memory_size(shared_memory)
+    limit = _concurrency_limit(max_concurrency)
 
     @wraps(function)  # maintain all the info about the function
     def wrapper(*func_args, **func_kwargs):
-        process = Process(target=function,
-                        args=func_args, kwargs=func_kwargs)
-        process.start()
-        return process
+        target = _function_reference(function)
+        if min_size is not None:
+            # each block is removed by the child process once used, and the
+            # large results are sent back the same way
+            target = partial(_call_shared, target, min_size)
+            func_args = tuple(_share(arg, min_size, unlink=True) for arg in func_args)
+            func_kwargs = {key: _share(value, min_size, unlink=True)
+                           for key, value in func_kwargs.items()}
+        if limit is not None:
+            limit.acquire()
+        # The tasks sent to the pool can't be cancelled
+        future = concurrent.futures.Future()
+        future.set_running_or_notify_cancel()
+        if limit is not None:
+            future.add_done_callback(lambda future: limit.release())
+
+        def set_result(result):
+            try:
+                future.set_result(_receive(result))
+            except Exception as exc:
+                future.set_exception(exc)
+
+        def set_exception(exc):
+            # the blocks not used by the child process are removed here
+            _remove(func_args + tuple(func_kwargs.values()))
+            future.set_exception(exc)
+
+        try:
+            # the loggers of the processes write through the log sink if one is started
+            get_shared_pool(nb_processes).pool.apply_async(
+                target, func_args, func_kwargs,
+                callback=set_result, error_callback=set_exception)
+        except BaseException as exc:
+            set_exception(exc)
+            raise
+        return future
     return wrapper
 
-def parallel(function, nb_processes=None):
+
+def _function_reference(function):
+    """Returns function, or something to call it in place of it if it can't be pickled
+    because its name refers to its decorator in its module.
+    """
+    obj = sys.modules.get(function.__module__)
+    for name in function.__qualname__.split('.'):
+        obj = getattr(obj, name, None)
+    if obj is not function and getattr(obj, '__wrapped__', None) is function:
+        return partial(_call_wrapped, function.__module__, function.__qualname__)
+    return function
+
+
+def _call_wrapped(module, qualname, *args, **kwargs):
+    obj = importlib.import_module(module)
+    for name in qualname.split('.'):
+        obj = getattr(obj, name)
+    return obj.__wrapped__(*args, **kwargs)
+
+
+# Minimum size in bytes of the buffers passed through shared memory by
+# default, smaller ones are simply pickled
+SHARED_MEMORY_MIN_SIZE = 64 * 1024
+
+
+class _SharedBuffer(object):
+    """Picklable reference to a buffer copied into a shared memory block.
+
+    With unlink, the process using the buffer removes the block afterwards,
+    otherwise the process which created it does.
+    """
+    __slots__ = ('name', 'nbytes', 'kind', 'format', 'shape', 'dtype', 'unlink')
+
+    def __init__(self, name, nbytes, kind, format, shape, dtype, unlink):
+        self.name = name
+        self.nbytes = nbytes
+        self.kind = kind
+        self.format = format
+        self.shape = shape
+        self.dtype = dtype
+        self.unlink = unlink
+
+    def __getstate__(self):
+        return tuple(getattr(self, slot) for slot in self.__slots__)
+
+    def __setstate__(self, state):
+        for slot, value in zip(self.__slots__, state):
+            setattr(self, slot, value)
+
+
+def _shared_memory_size(shared_memory):
+    """Returns the minimum size of the shared buffers, None if disabled."""
+    if not shared_memory:
+        return None
+    if SharedMemory is None:
+        raise RuntimeError('shared memory requires Python 3.8 or higher')
+    if shared_memory is True:
+        return SHARED_MEMORY_MIN_SIZE
+    return max(1, int(shared_memory))
+
+
+def _share(obj, min_size, unlink):
+    """Copies obj into a shared memory block if it is a large enough buffer.
+
+    bytes, bytearray, memoryview and numpy arrays are shared, anything else
+    is returned as is.
+    """
+    numpy = sys.modules.get('numpy')
+    if numpy is not None and isinstance(obj, numpy.ndarray):
+        if obj.nbytes < min_size or obj.dtype.hasobject:
+            return obj
+        shm = SharedMemory(create=True, size=obj.nbytes)
+        numpy.ndarray(obj.shape, obj.dtype, buffer=shm.buf)[...] = obj
+        shared = _SharedBuffer(shm.name, obj.nbytes, 'ndarray', None, obj.shape,
+                               obj.dtype, unlink)
+    elif isinstance(obj, (bytes, bytearray, memoryview)):
+        view = memoryview(obj)
+        if view.nbytes < min_size:
+            return obj
+        kind = type(obj).__name__
+        format, shape = view.format, view.shape
+        if not view.c_contiguous:
+            view = memoryview(view.tobytes())
+        shm = SharedMemory(create=True, size=view.nbytes)
+        shm.buf[:view.nbytes] = view.cast('B')
+        shared = _SharedBuffer(shm.name, view.nbytes, kind, format, shape, None, unlink)
+        del view
+    else:
+        return obj
+    shm.close()
+    return shared
+
+
+def _attach(shared):
+    """Returns the shared memory block of a _SharedBuffer and a view on it.
+
+    bytes, bytearray and memoryview are viewed as memoryview and numpy arrays
+    as numpy arrays, without copy.
+    """
+    shm = SharedMemory(name=shared.name)
+    if shared.kind == 'ndarray':
+        import numpy
+        return shm, numpy.ndarray(shared.shape, shared.dtype, buffer=shm.buf)
+    view = shm.buf[:shared.nbytes]
+    if shared.format != 'B' or len(shared.shape) != 1:
+        try:
+            view = view.cast(shared.format, shared.shape)
+        except (TypeError, ValueError):
+            # Formats memoryview can't cast to are left as bytes
+            pass
+    return shm, view
+
+
+def _release(shm, unlink):
+    try:
+        shm.close()
+    except BufferError:
+        # A view on the block is still referenced, it is closed once collected
+        pass
+    if unlink:
+        try:
+            shm.unlink()
+        except FileNotFoundError:
+            pass
+
+
+def _remove(objs):
+    """Removes the shared memory blocks of the _SharedBuffer among objs which still exist."""
+    for obj in objs:
+        if isinstance(obj, _SharedBuffer):
+            try:
+                shm = SharedMemory(name=obj.name)
+            except FileNotFoundError:
+                continue
+            _release(shm, True)
+
+
+def _receive(obj):
+    """Copies a result sent through shared memory out of its block and removes it."""
+    if not isinstance(obj, _SharedBuffer):
+        return obj
+    shm, view = _attach(obj)
+    try:
+        if obj.kind == 'ndarray':
+            result = view.copy()
+        elif obj.kind == 'bytes':
+            result = view.tobytes()
+        else:
+            result = bytearray(view)
+            if obj.kind == 'memoryview':
+                result = memoryview(result)
+                if obj.format != 'B' or len(obj.shape) != 1:
+                    try:
+                        result = result.cast(obj.format, obj.shape)
+                    except (TypeError, ValueError):
+                        pass
+        del view
+    finally:
+        _release(shm, True)
+    return result
+
+
+def _call_shared(function, min_size, *args, **kwargs):
+    """Calls function in a child process with the shared buffers attached.
+
+    The large buffers returned by the function are sent back through shared
+    memory too, if min_size is not None.
+    """
+    attached = []
+    try:
+        result = _call_attached(function, args, kwargs, attached)
+        if min_size is not None:
+            result = _share(result, min_size, unlink=True)
+        return result
+    finally:
+        # The views are only referenced here anymore
+        result = None
+        for shared, shm in attached:
+            _release(shm, shared.unlink)
+
+
+def _call_attached(function, args, kwargs, attached):
+    def attach(obj):
+        if not isinstance(obj, _SharedBuffer):
+            return obj
+        shm, view = _attach(obj)
+        attached.append((obj, shm))
+        return view
+
+    return function(*[attach(arg) for arg in args],
+                    **{key: attach(value) for key, value in kwargs.items()})
+
+
+class _SharedArguments(object):
+    """Arguments shared once for all the calls of a function.
+
+    The shared memory blocks are removed by release().
+    """
+    def __init__(self, args, kwargs, min_size):
+        self.args = tuple(_share(arg, min_size, unlink=False) for arg in args)
+        self.kwargs = {key: _share(value, min_size, unlink=False)
+                       for key, value in kwargs.items()}
+
+    def release(self):
+        _remove(self.args + tuple(self.kwargs.values()))
+
+
+def _received(results):
+    """Yields the results of a stream, which is closed with it."""
+    try:
+        for result in results:
+            yield _receive(result)
+    finally:
+        results.close()
+
+
+class SharedPool(object):
+    """multiprocessing.Pool created on first use and reused afterwards.
+
+    Starting processes is expensive, so the calls of the functions wrapped by
+    parallel reuse the same pools, see get_shared_pool. A SharedPool can also
+    be created and passed to parallel explicitly, to control its lifetime:
+
+    >>> with SharedPool(4) as pool:
+    ...     parallel_square = parallel(square, pool=pool)
+    ...     parallel_square(range(10))
+
+    Parameters
+    ----------
+    nb_processes : int, optional
+        the number of processes, by default os.cpu_count()
+
+    initializer : function, optional
+        called by each process when it starts, by default None
+
+    initargs : tuple, optional
+        arguments of the initializer, by default ()
+
+    The processes send their logs to the log sink of code_utils.logger
+    started when they are started, if any. When the sink changes, the
+    processes are replaced once they finish the tasks already submitted.
+    """
+    def __init__(self, nb_processes=None, initializer=None, initargs=()):
+        self.nb_processes = nb_processes or os.cpu_count() or 1
+        self.initializer = initializer
+        self.initargs = initargs
+        self._pool = None
+        self._pid = None
+        self._sink = None
+        self._lock = threading.Lock()
+
+    @property
+    def pool(self):
+        """The multiprocessing.Pool, started if needed."""
+        stale = None
+        with self._lock:
+            sink = get_log_sink()
+            # A pool inherited from the parent process can't be used
+            if self._pool is not None and self._pid == os.getpid() and self._sink is not sink:
+                # its processes send their logs to the previous sink
+                stale, self._pool = self._pool, None
+            if self._pool is None or self._pid != os.getpid():
+                if SharedMemory is not None and os.name == 'posix':
+                    # The processes share the resource tracker of this process, so
+                    # the shared memory blocks they attach are not seen as leaked
+                    # by trackers of their own
+                    resource_tracker.ensure_running()
+                # the loggers of the processes write through the sink if one is started
+                self._pool = Pool(self.nb_processes, _initialize_process,
+                                  (sink, self.initializer, self.initargs))
+                self._pid = os.getpid()
+                self._sink = sink
+            pool = self._pool
+        if stale is not None:
+            # the tasks already submitted are run before the processes stop
+            stale.close()
+            threading.Thread(target=stale.join, name='shared-pool-join', daemon=True).start()
+        return pool
+
+    def shutdown(self, wait=True):
+        """Stops the processes, after their current tasks if wait is True.
+
+        The pool is started again if it is used afterwards.
+        """
+        with self._lock:
+            pool, self._pool = self._pool, None
+        if pool is None or self._pid != os.getpid():
+            return
+        if wait:
+            pool.close()
+            pool.join()
+        else:
+            pool.terminate()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.shutdown()
+
+
+def _initialize_process(sink, initializer, initargs):
+    set_log_sink(sink)
+    if initializer is not None:
+        initializer(*initargs)
+
+
+# Pools of get_shared_pool, by number of processes
+_shared_pools = {}
+# Thread pools, by decorator, number of threads and nesting level
+_thread_pools = {}
+_shared_pools_lock = threading.Lock()
+# Nesting level of the pool of threaded running the current thread
+_pool_thread = threading.local()
+
+
+def _set_nesting_level(level):
+    _pool_thread.level = level
+
+
+def _get_thread_pool(name, max_workers, level=None):
+    """Returns the ThreadPoolExecutor of a decorator, its threads knowing
+    their nesting level if one is given."""
+    key = (name, max_workers, level)
+    with _shared_pools_lock:
+        executor = _thread_pools.get(key)
+        if executor is None:
+            if level is None:
+                executor = concurrent.futures.ThreadPoolExecutor(
+                    max_workers, thread_name_prefix=name)
+            else:
+                executor = concurrent.futures.ThreadPoolExecutor(
+                    max_workers, thread_name_prefix='{}-{}'.format(name, level),
+                    initializer=_set_nesting_level, initargs=(level,))
+            _thread_pools[key] = executor
+        return executor
+
+
+def get_shared_thread_pool(max_workers=None):
+    """Returns the ThreadPoolExecutor of max_workers threads used by threaded.
+
+    Called from a thread of one of these pools, it returns a pool of the
+    next nesting level, so the functions run by threaded can call threaded
+    functions without waiting for threads busy waiting for them.
+    """
+    return _get_thread_pool('threaded', max_workers, getattr(_pool_thread, 'level', -1) + 1)
+
+
+def _get_task_thread_pool(max_workers=None):
+    """Returns the ThreadPoolExecutor used by run_in_thread and to_thread."""
+    return _get_thread_pool('run_in_thread', max_workers)
+
+
+def get_shared_pool(nb_processes=None):
+    """Returns the SharedPool of nb_processes processes used by parallel.
+
+    The processes send their logs to the log sink of code_utils.logger if
+    one is started, they are replaced when the sink changes.
+    """
+    with _shared_pools_lock:
+        pool = _shared_pools.get(nb_processes)
+        if pool is None:
+            pool = _shared_pools[nb_processes] = SharedPool(nb_processes)
+        return pool
+
+
+def shutdown_pools(wait=True):
+    """Stops the processes and threads of the shared pools.
+
+    They are started again if they are used afterwards. It is called at exit.
+    """
+    with _shared_pools_lock:
+        pools = list(_shared_pools.values()) + list(_thread_pools.values())
+        _shared_pools.clear()
+        _thread_pools.clear()
+    for pool in pools:
+        pool.shutdown(wait)
+
+
+# Idle processes are simply terminated at exit
+atexit.register(shutdown_pools, False)
+
+
+def _auto_chunksize(nb_values, nb_processes):
+    """Splits the values in about four chunks per process."""
+    return max(1, -(-nb_values // (nb_processes * 4)))
+
+
+def _call_first(function, args, kwargs, value):
+    return function(value, *args, **kwargs)
+
+
+def _call_chunk(function, args, kwargs, values):
+    results = []
+    try:
+        for value in values:
+            results.append(function(value, *args, **kwargs))
+    except BaseException:
+        # the results already sent through shared memory won't be received
+        _remove(results)
+        raise
+    return results
+
+
+def _iter_chunks(iterable_values, chunksize):
+    iterator = iter(iterable_values)
+    while True:
+        chunk = list(islice(iterator, chunksize))
+        if not chunk:
+            return
+        yield chunk
+
+
+def _stream(pool, call_chunk, iterable_values, chunksize, ordered, max_in_flight,
+            discard=None, release=None):
+    """Yields the results of the function, submitting the chunks as the results are consumed.
+
+    At most max_in_flight chunks are submitted to the pool and not consumed
+    yet, so the values are read from the iterable only when there is room.
+    If the stream stops early, on an error or when it is closed, discard is
+    called with the values and the results of each chunk not consumed, once
+    the chunk is done. release is called once the stream is stopped and no
+    chunk is running anymore.
+    """
+    chunks = _iter_chunks(iterable_values, chunksize)
+    submitted = _SubmittedChunks(pool, call_chunk, discard, release)
+    try:
+        if ordered:
+            pending = deque()
+            for index in count():
+                if len(pending) >= max_in_flight:
+                    yield from submitted.consume(pending.popleft())
+                chunk = next(chunks, None)
+                if chunk is None:
+                    break
+                pending.append(submitted.submit(index, chunk))
+            while pending:
+                yield from submitted.consume(pending.popleft())
+            return
+
+        for index in count():
+            if len(submitted) >= max_in_flight:
+                yield from submitted.consume()
+            chunk = next(chunks, None)
+            if chunk is None:
+                break
+            submitted.submit(index, chunk)
+        while len(submitted):
+            yield from submitted.consume()
+    finally:
+        submitted.stop()
+
+
+class _SubmittedChunks(object):
+    """Chunks submitted to a pool by _stream and not consumed yet.
+
+    The callbacks are called by a thread of the pool as the chunks are done.
+    Once the stream is stopped, the chunks not consumed are discarded as they
+    are done, so no process uses them anymore.
+    """
+    def __init__(self, pool, call_chunk, discard, release):
+        self.pool = pool
+        self.call_chunk = call_chunk
+        self.discard = discard
+        self.release = release
+        self.chunks = {}
+        # (success, results) of the chunks done and not consumed, by index
+        self.done = {}
+        # indexes of the chunks done, in the order they are done
+        self.done_order = queue.Queue()
+        # results of the chunk being consumed
+        self.current = deque()
+        self.running = 0
+        self.stopped = False
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.chunks)
+
+    def submit(self, index, chunk):
+        with self._lock:
+            self.chunks[index] = chunk
+            self.running += 1
+        try:
+            async_result = self.pool.apply_async(
+                self.call_chunk, (chunk,), callback=partial(self._set_done, index, True),
+                error_callback=partial(self._set_done, index, False))
+        except BaseException:
+            with self._lock:
+                del self.chunks[index]
+                self.running -= 1
+            raise
+        return index, async_result
+
+    def _set_done(self, index, success, result):
+        with self._lock:
+            self.running -= 1
+            if not self.stopped:
+                self.done[index] = (success, result)
+                self.done_order.put(index)
+                return
+            chunk = self.chunks.pop(index)
+            idle = not self.running
+        self._discard(chunk, success, result)
+        if idle and self.release is not None:
+            self.release()
+
+    def _discard(self, chunk, success, result):
+        if self.discard is not None:
+            self.discard(chunk)
+            if success:
+                self.discard(result)
+
+    def consume(self, pending=None):
+        """Yields the results of the chunk of a (index, async_result) pair,
+        or of the next chunk done, raising its exception."""
+        if pending is None:
+            index = self.done_order.get()
+        else:
+            index, async_result = pending
+            # the callbacks are called before wait returns
+            async_result.wait()
+        with self._lock:
+            success, result = self.done.pop(index)
+            chunk = self.chunks.pop(index)
+        if not success:
+            self._discard(chunk, success, result)
+            raise result
+        self.current = deque(result)
+        while self.current:
+            yield self.current.popleft()
+
+    def stop(self):
+        with self._lock:
+            self.stopped = True
+            done = [(self.chunks.pop(index), success, result)
+                    for index, (success, result) in self.done.items()]
+            self.done.clear()
+            idle = not self.running
+        if self.discard is not None:
+            self.discard(self.current)
+        for chunk, success, result in done:
+            self._discard(chunk, success, result)
+        if idle and self.release is not None:
+            self.release()
+
+
+def parallel(function, nb_processes=None, chunksize='auto', pool=None,
+             stream=False, ordered=True, max_in_flight=None, shared_memory=False):
     """
     Works similar to a decorator to parallelize "stupidly parallel"
     problems. Decorators and multiprocessing don't play nicely because
     of naming issues.
 
+    The processes are started on the first call and reused by the next ones,
+    see get_shared_pool. The values are sent to the processes in chunks.
+
     Parameters
     ----------
     function : function:
@@ -160,8 +872,39 @@ def parallel(function, nb_processes=None):
         (they can be named or unnamed arguments).
 
     nb_processes : int:
-        the number of processes to run.
-        It is passed to multiprocessing.Pool, by default None
+        the number of processes to run, by default None (os.cpu_count())
+
+    chunksize : (int, str), optional
+        number of values sent at once to a process, 'auto' splitting the
+        values in about four chunks per process, by default 'auto'
+
+    pool : SharedPool, optional
+        pool running the function instead of the shared pool of
+        nb_processes processes, by default None
+
+    stream : bool, optional
+        make the wrapper return a generator instead of a list. The values
+        are read from the iterable, which can be infinite, as the results are
+        consumed, and the results are yielded as soon as they are available.
+        'auto' chunksize is 1 for iterables without length, by default False
+
+    ordered : bool, optional
+        with stream, yield the results in the order of the values. If False,
+        the results of a chunk are yielded as soon as it is done,
+        by default True
+
+    max_in_flight : int, optional
+        with stream, maximum number of chunks sent to the processes and not
+        consumed yet, by default twice the number of processes
+
+    shared_memory : (bool, int), optional
+        pass the bytes, bytearray, memoryview and numpy arrays of at least
+        SHARED_MEMORY_MIN_SIZE bytes, or of at least the given number of bytes,
+        through shared memory instead of pickling them. The iterated values
+        and the results are copied into shared memory blocks, the other
+        arguments are copied once for all the values. The function receives
+        memoryviews, or numpy arrays, on the blocks. Only the arguments
+        themselves are shared, not the buffers they contain, by default False
 
     Returns
     -------
@@ -177,15 +920,525 @@ def parallel(function, nb_processes=None):
                                        nb_processes=5)
     >>> print(parallel_square_and_offset(range(10), offset=3))
     [3, 4, 7, 12, 19, 28, 39, 52, 67, 84]
+    >>> stream_square = parallel(square_and_offset, stream=True)
+    >>> for result in stream_square(itertools.count()):
+    ...     print(result)
+
+    """
+    @wraps(function)  # maintain all the info about the function
+    def wrapper(iterable_values, *args, **kwargs):
+        shared_pool = pool if pool is not None else get_shared_pool(nb_processes)
+        target = function
+        min_size = _shared_memory_size(shared_memory)
+        if min_size is not None:
+            target = partial(_call_shared, function, min_size)
+            share_value = partial(_share, min_size=min_size, unlink=True)
+
+        if stream:
+            size = chunksize
+            if size == 'auto':
+                size = _auto_chunksize(len(iterable_values), shared_pool.nb_processes) \
+                    if hasattr(iterable_values, '__len__') else 1
+            if min_size is None:
+                return _stream(shared_pool.pool, partial(_call_chunk, target, args, kwargs),
+                               iterable_values, size, ordered,
+                               max_in_flight or 2 * shared_pool.nb_processes)
+            shared_args = _SharedArguments(args, kwargs, min_size)
+            # the values are copied as they are sent, each block is removed by
+            # its worker, or here if the results of the chunk are not consumed
+            results = _stream(shared_pool.pool,
+                              partial(_call_chunk, target, shared_args.args, shared_args.kwargs),
+                              map(share_value, iterable_values), size, ordered,
+                              max_in_flight or 2 * shared_pool.nb_processes,
+                              _remove, shared_args.release)
+            return _received(results)
+
+        if not isinstance(iterable_values, (list, tuple)):
+            iterable_values = list(iterable_values)
+        size = chunksize
+        if size == 'auto':
+            size = _auto_chunksize(len(iterable_values), shared_pool.nb_processes)
+        if min_size is None:
+            call = partial(_call_first, target, args, kwargs)
+            return shared_pool.pool.map(call, iterable_values, size)
+        shared_args = _SharedArguments(args, kwargs, min_size)
+        shared_values = []
+        try:
+            shared_values.extend(share_value(value) for value in iterable_values)
+        except BaseException:
+            _remove(shared_values)
+            shared_args.release()
+            raise
+        # all the chunks are submitted at once, as with Pool.map, the blocks of
+        # the chunks which fail are removed here once they are done
+        results = _stream(shared_pool.pool,
+                          partial(_call_chunk, target, shared_args.args, shared_args.kwargs),
+                          shared_values, size, True, max(1, len(shared_values)),
+                          _remove, shared_args.release)
+        return [_receive(result) for result in list(results)]
+    return wrapper
+
+
+def _guided_chunks(order, costs, nb_processes, min_chunksize):
+    """Yields the indexes of the values of each chunk, taken in order.
+
+    Each chunk costs about half of what each process would still have to run
+    if the remaining values were split evenly, so the chunks get smaller
+    towards the end and the processes finish at about the same time.
+    """
+    remaining = sum(costs)
+    position = 0
+    while position < len(order):
+        target = remaining / (2 * nb_processes)
+        chunk = [order[position]]
+        chunk_cost = costs[order[position]]
+        position += 1
+        while position < len(order) and (len(chunk) < min_chunksize
+                                         or chunk_cost + costs[order[position]] <= target):
+            chunk.append(order[position])
+            chunk_cost += costs[order[position]]
+            position += 1
+        remaining -= chunk_cost
+        yield chunk
+
+
+def scheduled(function=None, nb_processes=None, pool=None, priority=None, cost=None,
+              min_chunksize=1, timeout=None):
+    """
+    Run function in a process pool once for each item of the iterable passed
+    as first argument, like parallel, for items taking very different times.
+
+    Instead of splitting the values in chunks of the same size beforehand,
+    the values are sorted by priority, then by decreasing cost, and sent in
+    chunks whose cost decreases towards the end, a new chunk being sent each
+    time a process is done with one. So the longest values are started first
+    and the last chunks are small, which avoids a process running a large
+    last chunk while the other ones wait.
+
+    If the function raises an exception or the timeout expires, the values
+    not sent yet are cancelled and the exception, or a
+    concurrent.futures.TimeoutError, is raised. The chunks already sent run
+    to the end in the background.
+
+    Parameters
+    ----------
+    function : function
+        The function which shall be wrapper. The FIRST argument is the one to
+        be iterated on, the other arguments are the same for all the items.
+
+    nb_processes : int, optional
+        number of processes of the shared pool, by default None
+        (os.cpu_count())
+
+    pool : SharedPool, optional
+        pool running the function instead of the shared pool of
+        nb_processes processes, by default None
+
+    priority : function, optional
+        returns the priority of a value, the values of higher priority are
+        run first, by default None (same priority)
+
+    cost : function, optional
+        returns an estimate of the time the function takes for a value, in
+        any unit, by default None (same cost)
+
+    min_chunksize : int, optional
+        minimum number of values sent at once to a process, by default 1
+
+    timeout : float, optional
+        maximum number of seconds to wait for the results, by default None
+
+    Returns
+    -------
+    function
+        The wrapper function
+
+    Example
+    -------
+    >>> @scheduled(cost=os.path.getsize, timeout=600)
+    ... def compress(path):
+    ...     ...
+    >>> compress(paths)
+    """
+    if function is None:
+        return partial(scheduled, nb_processes=nb_processes, pool=pool, priority=priority,
+                       cost=cost, min_chunksize=min_chunksize, timeout=timeout)
+
+    @wraps(function)  # maintain all the info about the function
+    def wrapper(iterable_values, *args, **kwargs):
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        values = list(iterable_values)
+        costs = [cost(value) for value in values] if cost is not None else [1] * len(values)
+        priorities = [priority(value) for value in values] if priority is not None \
+            else [0] * len(values)
+        order = sorted(range(len(values)), key=lambda i: (-priorities[i], -costs[i]))
+        shared_pool = pool if pool is not None else get_shared_pool(nb_processes)
+        call = partial(_call_chunk, _function_reference(function), args, kwargs)
+        chunks = _guided_chunks(order, costs, shared_pool.nb_processes, min_chunksize)
+        results = [None] * len(values)
+        # The callbacks are called by a thread of the pool as the chunks are done
+        done = queue.Queue()
+
+        def submit():
+            indexes = next(chunks, None)
+            if indexes is None:
+                return False
+            shared_pool.pool.apply_async(
+                call, ([values[i] for i in indexes],),
+                callback=lambda chunk_results: done.put((indexes, chunk_results, None)),
+                error_callback=lambda error: done.put((indexes, None, error)))
+            return True
+
+        in_flight = 0
+        while in_flight < shared_pool.nb_processes and submit():
+            in_flight += 1
+        while in_flight:
+            try:
+                wait = None if deadline is None else max(0, deadline - time.monotonic())
+                indexes, chunk_results, error = done.get(timeout=wait)
+            except queue.Empty:
+                raise concurrent.futures.TimeoutError(
+                    '{} did not finish within {} seconds'.format(function.__name__, timeout))
+            if error is not None:
+                raise error
+            for index, result in zip(indexes, chunk_results):
+                results[index] = result
+            if not submit():
+                in_flight -= 1
+        return results
+    return wrapper
+
+
+# Marks the end of an iterator
+_NO_VALUE = object()
+
+# Estimated cost of sending a value to a process and getting its result back
+_PROCESS_CALL_COST = 1e-4
+_PROCESS_BYTE_COST = 1e-8
+
+
+def _payload_size(value, args, kwargs):
+    """Returns the size of the pickled arguments of a call, None if they can't be pickled."""
+    try:
+        return len(pickle.dumps((value, args, kwargs), pickle.HIGHEST_PROTOCOL))
+    except Exception:
+        return None
 
+
+def _decide(measurements, inline_threshold, cpu_ratio, nb_processes):
+    """Returns where to run the calls: 'inline', 'thread' or 'process'."""
+    wall_time = measurements['wall_time']
+    if wall_time < inline_threshold:
+        return 'inline'
+    if measurements['cpu_time'] < cpu_ratio * wall_time:
+        # The calls mostly wait, threads run them concurrently
+        return 'thread'
+    if not measurements['picklable'] or (nb_processes or os.cpu_count() or 1) < 2:
+        return 'inline'
+    cost = _PROCESS_CALL_COST + _PROCESS_BYTE_COST * measurements['payload_size']
+    return 'process' if wall_time > cost else 'inline'
+
+
+def auto_parallel(function=None, sample_size=3, nb_processes=None, max_workers=None,
+                  inline_threshold=2e-4, cpu_ratio=0.5):
     """
+    Run function once for each item of the iterable passed as first argument,
+    inline, in a thread pool or in a process pool depending on the first calls.
+
+    The first sample_size calls, over one or several calls of the wrapper, are
+    run inline and measured. Then the following items are run:
+        'inline' - if the calls take less than inline_threshold seconds, or
+            if they use the CPU and can't be run by processes faster
+        'thread' - if the calls spend more than half their time waiting,
+            with threaded
+        'process' - if the calls use the CPU, with parallel, provided the
+            function and the arguments can be pickled and the calls take
+            longer than sending the arguments to a process
+
+    The decision and the median measurements are available as the decision
+    and measurements attributes of the wrapper, decision being None until
+    enough calls are measured.
+
+    Parameters
+    ----------
+    function : function
+        The function which shall be wrapper. The FIRST argument is the one to
+        be iterated on, the other arguments are the same for all the items.
+        It has to be importable from its module to be run by processes,
+        as with parallel.
+
+    sample_size : int, optional
+        number of calls measured before deciding, by default 3
+
+    nb_processes : int, optional
+        number of processes of the pool, by default None (os.cpu_count())
+
+    max_workers : int, optional
+        number of threads of the pool, by default None
+
+    inline_threshold : float, optional
+        duration of a call in seconds under which the calls are run inline,
+        by default 2e-4
+
+    cpu_ratio : float, optional
+        part of the duration of the calls spent using the CPU above which
+        the calls are considered CPU bound, by default 0.5
+
+    Returns
+    -------
+    function
+        The wrapper function
+
+    Example
+    -------
+    >>> run = auto_parallel(square_and_offset)
+    >>> run(range(100), offset=3)
+    >>> run.decision, run.measurements['cpu_time']
+    ('inline', 1.2e-06)
+    """
+    if function is None:
+        return partial(auto_parallel, sample_size=sample_size, nb_processes=nb_processes,
+                       max_workers=max_workers, inline_threshold=inline_threshold,
+                       cpu_ratio=cpu_ratio)
+    lock = threading.Lock()
+    # The process runner is added with the decision, once the function can
+    # be found in its module even if it is decorated there
+    runners = {'thread': threaded(function, max_workers=max_workers)}
+
+    samples = []
+
+    def measure(value, args, kwargs):
+        start_cpu, start = time.thread_time(), time.perf_counter()
+        result = function(value, *args, **kwargs)
+        wall_time = time.perf_counter() - start
+        cpu_time = time.thread_time() - start_cpu
+        payload_size = _payload_size(value, args, kwargs)
+        with lock:
+            if wrapper.decision is not None:
+                return result
+            samples.append((wall_time, cpu_time, payload_size))
+            measurements = wrapper.measurements
+            measurements['samples'] = len(samples)
+            if len(samples) >= sample_size:
+                # medians, a call slowed down by the rest of the system does not count
+                for key, values in zip(('wall_time', 'cpu_time'), zip(*samples)):
+                    measurements[key] = sorted(values)[len(values) // 2]
+                sizes = [size for _, _, size in samples if size is not None]
+                measurements['payload_size'] = sorted(sizes)[len(sizes) // 2] if sizes else 0
+                measurements['picklable'] = len(sizes) == len(samples)
+                target = _function_reference(function)
+                try:
+                    pickle.dumps(target)
+                except Exception:
+                    measurements['picklable'] = False
+                decision = _decide(measurements, inline_threshold, cpu_ratio, nb_processes)
+                if decision == 'process':
+                    runners['process'] = parallel(target, nb_processes=nb_processes)
+                wrapper.decision = decision
+        return result
+
     @wraps(function)  # maintain all the info about the function
     def wrapper(iterable_values, *args, **kwargs):
-        args = list(args)
-        pool = Pool(nb_processes)
-        result = [pool.apply_async(function, args=[value]+args,
-                                kwds=kwargs)
-                  for value in iterable_values]
-        pool.close()
-        return [r.get() for r in result]
-    return wrapper
\ No newline at end of file
+        values = iter(iterable_values)
+        results = []
+        while wrapper.decision is None:
+            value = next(values, _NO_VALUE)
+            if value is _NO_VALUE:
+                return results
+            results.append(measure(value, args, kwargs))
+        if wrapper.decision == 'inline':
+            results.extend(function(value, *args, **kwargs) for value in values)
+        else:
+            results.extend(runners[wrapper.decision](values, *args, **kwargs))
+        return results
+
+    wrapper.decision = None
+    wrapper.measurements = {'samples': 0, 'wall_time': 0., 'cpu_time': 0.,
+                            'payload_size': 0., 'picklable': True}
+    return wrapper
+
+
+
+class _AsyncLimit(object):
+    """asyncio.Semaphore of max_concurrency for each event loop."""
+    def __init__(self, max_concurrency):
+        _concurrency_limit(max_concurrency)
+        self.max_concurrency = max_concurrency
+        self._semaphores = weakref.WeakKeyDictionary()
+
+    def get(self):
+        loop = asyncio.get_running_loop()
+        semaphore = self._semaphores.get(loop)
+        if semaphore is None:
+            semaphore = self._semaphores[loop] = asyncio.Semaphore(self.max_concurrency)
+        return semaphore
+
+
+async def _await_limited(limit, submit):
+    """Awaits the future returned by submit, once the limit allows it."""
+    if limit is None:
+        return await asyncio.wrap_future(submit())
+    async with limit.get():
+        return await asyncio.wrap_future(submit())
+
+
+def to_thread(function=None, max_workers=None, max_concurrency=None):
+    """
+    Make a function return an awaitable running it in a thread, so it does
+    not block the event loop. The threads are the ones of run_in_thread, the
+    function sees the context variables of the
+    caller as asyncio.to_thread does.
+
+    Parameters
+    ----------
+    function : function
+        The function which shall be wrapper
+
+    max_workers : int, optional
+        number of threads of the shared pool, by default None (see
+        concurrent.futures.ThreadPoolExecutor)
+
+    max_concurrency : int, optional
+        maximum number of calls of this function running in the pool for
+        each event loop, the next calls wait for one of them to be done,
+        by default None (no limit)
+
+    Returns
+    -------
+    function
+        The wrapper coroutine function
+
+    Example
+    -------
+    >>> @to_thread
+    ... def read(path):
+    ...     with open(path) as file:
+    ...         return file.read()
+    >>> content = await read(path)
+    """
+    if function is None:
+        return partial(to_thread, max_workers=max_workers, max_concurrency=max_concurrency)
+    limit = _AsyncLimit(max_concurrency) if max_concurrency is not None else None
+
+    @wraps(function)  # maintain all the info about the function
+    async def wrapper(*func_args, **func_kwargs):
+        context = contextvars.copy_context()
+        return await _await_limited(limit, lambda: _get_task_thread_pool(max_workers).submit(
+            context.run, function, *func_args, **func_kwargs))
+    return wrapper
+
+
+def to_process(function=None, shared_memory=False, nb_processes=None, max_concurrency=None):
+    """
+    Make a function return an awaitable running it in a process, so it does
+    not block the event loop. The processes are the ones of get_shared_pool,
+    as with run_in_process.
+
+    Parameters
+    ----------
+    function : function
+        The function which shall be wrapper
+
+    shared_memory : (bool, int), optional
+        pass the large bytes, bytearray, memoryview and numpy arrays arguments
+        and results through shared memory instead of pickling them, see
+        parallel, by default False
+
+    nb_processes : int, optional
+        number of processes of the shared pool, by default None
+        (os.cpu_count())
+
+    max_concurrency : int, optional
+        maximum number of calls of this function running in the pool for
+        each event loop, the next calls wait for one of them to be done,
+        by default None (no limit)
+
+    Returns
+    -------
+    function
+        The wrapper coroutine function
+
+    Example
+    -------
+    >>> @to_process
+    ... def checksum(data):
+    ...     return hashlib.sha256(data).hexdigest()
+    >>> digest = await checksum(data)
+    """
+    if function is None:
+        return partial(to_process, shared_memory=shared_memory, nb_processes=nb_processes,
+                       max_concurrency=max_concurrency)
+    limit = _AsyncLimit(max_concurrency) if max_concurrency is not None else None
+    run = run_in_process(function, shared_memory=shared_memory, nb_processes=nb_processes)
+
+    @wraps(function)  # maintain all the info about the function
+    async def wrapper(*func_args, **func_kwargs):
+        return await _await_limited(limit, lambda: run(*func_args, **func_kwargs))
+    return wrapper
+
+
+def async_gather_map(function=None, max_concurrency=100, return_exceptions=False):
+    """
+    Run a coroutine function once for each item of the iterable passed as
+    first argument, at most max_concurrency at a time, and return the list of
+    the results in the same order.
+
+    The items are read from the iterable as the calls finish, so it can be
+    long or infinite.
+
+    Parameters
+    ----------
+    function : coroutine function
+        The function which shall be wrapper. The FIRST argument is the one to
+        be iterated on, the other arguments are the same for all the items.
+
+    max_concurrency : int, optional
+        maximum number of calls running at the same time, by default 100
+
+    return_exceptions : bool, optional
+        return the exceptions in place of the results instead of raising the
+        first one and cancelling the running calls, by default False
+
+    Returns
+    -------
+    function
+        The wrapper coroutine function
+
+    Example
+    -------
+    >>> @async_gather_map(max_concurrency=20)
+    ... async def fetch(url, session):
+    ...     async with session.get(url) as response:
+    ...         return await response.read()
+    >>> pages = await fetch(urls, session)
+    """
+    if function is None:
+        return partial(async_gather_map, max_concurrency=max_concurrency,
+                       return_exceptions=return_exceptions)
+    _concurrency_limit(max_concurrency)
+
+    @wraps(function)  # maintain all the info about the function
+    async def wrapper(iterable_values, *func_args, **func_kwargs):
+        values = iter(iterable_values)
+        results = []
+
+        # Each worker runs one call at a time, so at most max_concurrency run
+        async def work():
+            for value in values:
+                index = len(results)
+                results.append(None)
+                try:
+                    results[index] = await function(value, *func_args, **func_kwargs)
+                except Exception as exc:
+                    if not return_exceptions:
+                        raise
+                    results[index] = exc
+
+        workers = [asyncio.ensure_future(work()) for _ in range(max_concurrency)]
+        try:
+            await asyncio.gather(*workers)
+        finally:
+            for worker in workers:
+                worker.cancel()
+        return results
+    return wrapper
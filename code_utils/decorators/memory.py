@@ -0,0 +1,161 @@
+from functools import partial, wraps
+import asyncio
+import itertools
+import tracemalloc
+
+from code_utils.metrics import get_registry
+
+__all__ = [
+    'track_memory',
+    'enable_memory_tracking',
+    'disable_memory_tracking',
+]
+
+_enabled = False
+# Whether tracemalloc was started by enable_memory_tracking
+_started_tracemalloc = False
+
+
+def enable_memory_tracking(nframes=1):
+    """Makes the functions decorated by track_memory record their allocations.
+
+    tracemalloc is started, storing nframes frames per allocation, if it is
+    not running yet. Tracing the allocations slows the whole process down.
+    """
+    global _enabled, _started_tracemalloc
+    if not tracemalloc.is_tracing():
+        tracemalloc.start(nframes)
+        _started_tracemalloc = True
+    _enabled = True
+
+
+def disable_memory_tracking():
+    """Makes the functions decorated by track_memory only call the function,
+    and stops tracemalloc if it was started by enable_memory_tracking."""
+    global _enabled, _started_tracemalloc
+    _enabled = False
+    if _started_tracemalloc:
+        tracemalloc.stop()
+        _started_tracemalloc = False
+
+
+# The allocations of tracemalloc itself are not counted
+_SNAPSHOT_FILTERS = [tracemalloc.Filter(False, tracemalloc.__file__)]
+
+# Python >= 3.9
+_reset_peak = getattr(tracemalloc, 'reset_peak', None)
+
+
+class _Measure(object):
+    """Measures the memory allocated between start and stop.
+
+    Before Python 3.9 the peak of tracemalloc can't be reset, so the peak of
+    the call is only known if it exceeds the previous peak of the process,
+    otherwise the memory allocated at the end of the call is used instead.
+    """
+    def __init__(self, sites):
+        self.sites = sites
+        self.before = None
+
+    def start(self):
+        if self.sites:
+            self.before = tracemalloc.take_snapshot().filter_traces(_SNAPSHOT_FILTERS)
+        self.current, self.peak = tracemalloc.get_traced_memory()
+        if _reset_peak is not None:
+            _reset_peak()
+
+    def stop(self):
+        current, peak = tracemalloc.get_traced_memory()
+        if _reset_peak is None and peak <= self.peak:
+            peak = current
+        sites = []
+        if self.sites:
+            after = tracemalloc.take_snapshot().filter_traces(_SNAPSHOT_FILTERS)
+            for diff in after.compare_to(self.before, 'lineno'):
+                if diff.size_diff > 0:
+                    frame = diff.traceback[0]
+                    sites.append(('{}:{}'.format(frame.filename, frame.lineno),
+                                  diff.size_diff, diff.count_diff))
+        return max(0, peak - self.current), current - self.current, sites
+
+
+def track_memory(func=None, name=None, registry=None, sample_every=1, sites=False):
+    """Decorates the passed function to record the memory its calls allocate.
+
+    While enable_memory_tracking is in effect, the peak and net memory
+    allocated by the calls, measured with tracemalloc, are recorded in the
+    MemoryStats of the function in a metrics registry, see code_utils.metrics.
+    With sites, the memory allocated by each line during the calls is also
+    summed to find the top allocators, which requires two tracemalloc
+    snapshots of all the memory of the process per call, so it is best
+    combined with sample_every. Otherwise the function is simply called.
+
+    The peak is reset at the start of each call, so the measures of calls
+    running at the same time, in several threads or nested, are approximate.
+
+    Parameters
+    ----------
+    func : function
+        Function which allocations shall be recorded.
+
+    name : str, optional
+        name of the statistics in the registry, by default the module and
+        qualified name of the function
+
+    registry : MetricsRegistry, optional
+        registry recording the statistics, by default the one of
+        code_utils.metrics.get_registry()
+
+    sample_every : int, optional
+        measure only one call out of sample_every, by default 1
+
+    sites : bool, optional
+        sum the memory allocated by each line, by default False
+
+    Returns
+    -------
+    function
+        The function wrapper.
+
+    Example
+    -------
+    >>> @track_memory(sample_every=100, sites=True)
+    ... def load(path):
+    ...     ...
+    >>> enable_memory_tracking()
+    >>> get_registry().snapshot('function_memory_bytes')
+    """
+    if func is None:
+        return partial(track_memory, name=name, registry=registry, sample_every=sample_every,
+                       sites=sites)
+    stats = (registry or get_registry()).memory(
+        name or '{}.{}'.format(func.__module__, func.__qualname__))
+    calls = itertools.count()
+
+    def skip():
+        return not tracemalloc.is_tracing() or (sample_every > 1 and next(calls) % sample_every)
+
+    if asyncio.iscoroutinefunction(func):
+        @wraps(func)  # maintain all the info about the function
+        async def async_with_memory(*args, **kwargs):
+            if not _enabled or skip():
+                return await func(*args, **kwargs)
+            measure = _Measure(sites)
+            measure.start()
+            try:
+                return await func(*args, **kwargs)
+            finally:
+                stats.record(*measure.stop())
+        return async_with_memory
+
+    @wraps(func)  # maintain all the info about the function
+    def with_memory(*args, **kwargs):
+        if not _enabled or skip():
+            return func(*args, **kwargs)
+        measure = _Measure(sites)
+        measure.start()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            stats.record(*measure.stop())
+    return with_memory
@@ -0,0 +1,112 @@
+import asyncio
+import threading
+import time
+
+from code_utils.decorators.base import BaseDecorator
+from code_utils.decorators.concurrency import _AsyncLimit
+
+__all__ = [
+    'rate_limit',
+    'max_concurrency',
+]
+
+
+class rate_limit(BaseDecorator):
+    """Limit the number of calls of the decorated function per period.
+
+    The calls are throttled by a token bucket: it holds up to burst tokens,
+    refilled at calls / period tokens per second, and each call takes one.
+    When the bucket is empty, the call waits for its token, with time.sleep
+    or asyncio.sleep for coroutine functions, so the calls of all the threads
+    and event loops are served in order without holding any lock while
+    waiting.
+
+    Parameters
+    ----------
+    calls : int
+        number of calls allowed per period
+
+    period : float, optional
+        duration of the period in seconds, by default 1.0
+
+    burst : int, optional
+        maximum number of calls run at once after an idle time, by default
+        calls
+
+    Example
+    -------
+    >>> @rate_limit(10, period=1.0)
+    ... def fetch(url):
+    ...     return requests.get(url)
+    >>> pages = threaded(fetch)(urls)
+    """
+    def setup(self, calls, period=1.0, burst=None):
+        if calls <= 0 or period <= 0:
+            raise ValueError('calls and period must be positive, not {!r} and {!r}'
+                             .format(calls, period))
+        self.calls = calls
+        self.period = period
+        self.rate = calls / period
+        self.capacity = burst or calls
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self):
+        """Takes a token and returns how long to wait for it, in seconds."""
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            # the token may be taken in advance, the next calls wait longer
+            self._tokens -= 1
+            if self._tokens >= 0:
+                return 0.
+            return -self._tokens / self.rate
+
+    def run(self, func, *args, **kwargs):
+        if asyncio.iscoroutinefunction(func):
+            return self._run_async(func, *args, **kwargs)
+        delay = self.reserve()
+        if delay:
+            time.sleep(delay)
+        return func(*args, **kwargs)
+
+    async def _run_async(self, func, *args, **kwargs):
+        delay = self.reserve()
+        if delay:
+            await asyncio.sleep(delay)
+        return await func(*args, **kwargs)
+
+
+class max_concurrency(BaseDecorator):
+    """Limit the number of calls of the decorated function running at the same time.
+
+    The other calls wait for one of the running calls to return. For
+    coroutine functions the limit applies to each event loop.
+
+    Parameters
+    ----------
+    n : int
+        maximum number of calls running at the same time
+
+    Example
+    -------
+    >>> @max_concurrency(4)
+    ... def query(sql):
+    ...     return database.execute(sql)
+    """
+    def setup(self, n):
+        self.n = n
+        self._semaphore = threading.BoundedSemaphore(n)
+        self._async_limit = _AsyncLimit(n)
+
+    def run(self, func, *args, **kwargs):
+        if asyncio.iscoroutinefunction(func):
+            return self._run_async(func, *args, **kwargs)
+        with self._semaphore:
+            return func(*args, **kwargs)
+
+    async def _run_async(self, func, *args, **kwargs):
+        async with self._async_limit.get():
+            return await func(*args, **kwargs)
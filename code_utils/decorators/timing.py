@@ -1,70 +1,160 @@
 # timing.py
-from functools import wraps
+from functools import partial, wraps
+import asyncio
+import fnmatch
+import inspect
+import itertools
 import time
 
+from code_utils.metrics import get_registry
+
 __all__ = [
     'timer',
     'time_all_class_methods',
 ]
 
-def timer(func):
+def timer(func=None, name=None, registry=None, sample_every=1):
     """Decorates the passed function with a timer.
-    It prints the time the function's call took.
+    The duration of the calls is measured with time.perf_counter_ns and
+    recorded in the TimingStats of the function in a metrics registry,
+    see code_utils.metrics.
 
     Parameters
     ----------
     func : function
         Function which execution shall be timed.
 
+    name : str, optional
+        name of the durations in the registry, by default the module and
+        qualified name of the function
+
+    registry : MetricsRegistry, optional
+        registry recording the durations, by default the one of
+        code_utils.metrics.get_registry()
+
+    sample_every : int, optional
+        time only one call out of sample_every, the count and the total
+        of the statistics only cover the timed calls, by default 1
+
     Returns
     -------
     function
         The function wrapper with a timer.
+
+    Example
+    -------
+    >>> @timer(sample_every=10)
+    ... def work():
+    ...     ...
+    >>> get_registry().snapshot()
     """
+    if func is None:
+        return partial(timer, name=name, registry=registry, sample_every=sample_every)
+    stats = (registry or get_registry()).timing(
+        name or '{}.{}'.format(func.__module__, func.__qualname__))
+    calls = itertools.count()
+
+    if asyncio.iscoroutinefunction(func):
+        @wraps(func)  # maintain all the info about the function
+        async def async_with_timer(*args, **kwargs):
+            if sample_every > 1 and next(calls) % sample_every:
+                return await func(*args, **kwargs)
+            start = time.perf_counter_ns()
+            try:
+                return await func(*args, **kwargs)
+            finally:
+                stats.record(time.perf_counter_ns() - start)
+        return async_with_timer
+
     @wraps(func)  # maintain all the info about the function
     def with_timer(*args, **kwargs):
-        start = time.time()
-        result = func(*args, **kwargs)
-        end = time.time()
-        print ('{} ran in {}'.format(func.__name__, end - start))
-        return result
+        if sample_every > 1 and next(calls) % sample_every:
+            return func(*args, **kwargs)
+        start = time.perf_counter_ns()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            stats.record(time.perf_counter_ns() - start)
     return with_timer
 
-def time_all_class_methods(Cls):
-    """Decorates all the methods of the passed class
-    with the timer decorator.
+def _selected(name, include, exclude):
+    """Returns whether the method called name shall be timed."""
+    if include is not None:
+        selected = any(fnmatch.fnmatchcase(name, pattern) for pattern in include)
+    else:
+        # The special methods are only timed if they are included
+        selected = not (name.startswith('__') and name.endswith('__'))
+    return selected and not any(fnmatch.fnmatchcase(name, pattern) for pattern in exclude)
+
+
+def time_all_class_methods(Cls=None, include=None, exclude=(), registry=None, sample_every=1):
+    """Decorates the methods of the passed class with the timer decorator.
+
+    The methods, class methods, static methods and property functions
+    defined by the class, including the coroutine functions, are replaced
+    once by their timed version, so the class and its instances are left
+    untouched otherwise. The durations are named after the module and
+    qualified name of the methods, with '.setter' and '.deleter' appended
+    for the property functions.
 
     Parameters
     ----------
     Cls : class
         The class which methods shall be wrapper.
 
+    include : list, optional
+        names or fnmatch patterns of the methods to time, by default None
+        (all the methods but the special ones like __init__)
+
+    exclude : list, optional
+        names or fnmatch patterns of the methods not to time, by default ()
+
+    registry : MetricsRegistry, optional
+        registry recording the durations, see timer
+
+    sample_every : int, optional
+        time only one call out of sample_every, see timer, by default 1
+
     Returns
     -------
     class
-        The wrapper class
+        The class, with its methods timed
+
+    Example
+    -------
+    >>> @time_all_class_methods(exclude=['_*'])
+    ... class Client(object):
+    ...     def get(self, key):
+    ...         ...
     """
-    class NewCls():
-        def __init__(self, *args, **kwargs):
-            self.oInstance = Cls(*args, **kwargs)
-        def __getattribute__(self, s):
-            """
-            this is called whenever any attribute of a NewCls object is accessed.
-            This function first tries to get the attribute off NewCls.
-            If it fails, it tries to get the attribute from self.oInstance
-            (an instance of the wrapper class).
-            If it manages to get the attribute from self.oInstance, and
-            the attribute is an instance method then `timer` is applied.
-            """
-            try:
-                x = self.super().__getattribute__(s)
-            except AttributeError:
-                pass
-            else:
-                return x
-            x = self.oInstance.__getattribute__(s)
-            if type(x) == type(self.__init__): # it is an instance method
-                return timer(x) # this is equivalent of just decorating the method with time_this
-            else:
-                return x
-    return NewCls
\ No newline at end of file
+    if Cls is None:
+        return partial(time_all_class_methods, include=include, exclude=exclude,
+                       registry=registry, sample_every=sample_every)
+    if isinstance(include, str):
+        include = [include]
+    if isinstance(exclude, str):
+        exclude = [exclude]
+    prefix = '{}.{}.'.format(Cls.__module__, Cls.__qualname__)
+
+    def timed(func, name):
+        return timer(func, name=prefix + name, registry=registry, sample_every=sample_every)
+
+    for name, attribute in list(vars(Cls).items()):
+        if not _selected(name, include, exclude):
+            continue
+        if isinstance(attribute, staticmethod):
+            attribute = staticmethod(timed(attribute.__func__, name))
+        elif isinstance(attribute, classmethod):
+            attribute = classmethod(timed(attribute.__func__, name))
+        elif isinstance(attribute, property):
+            attribute = property(
+                timed(attribute.fget, name) if attribute.fget else None,
+                timed(attribute.fset, name + '.setter') if attribute.fset else None,
+                timed(attribute.fdel, name + '.deleter') if attribute.fdel else None,
+                attribute.__doc__)
+        elif inspect.isfunction(attribute):
+            attribute = timed(attribute, name)
+        else:
+            continue
+        setattr(Cls, name, attribute)
+    return Cls
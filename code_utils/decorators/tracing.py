@@ -0,0 +1,233 @@
+import asyncio
+import contextvars
+import json
+import os
+import threading
+import time
+from collections import deque
+from functools import wraps
+
+__all__ = [
+    'trace',
+    'Tracer',
+    'get_tracer',
+]
+
+# Spans entered and not exited yet in the current thread or task, innermost last
+_stack = contextvars.ContextVar('code_utils_trace_stack', default=())
+
+
+class _Frame(object):
+    __slots__ = ('path', 'start', 'children', 'tracer', 'span')
+
+    def __init__(self, path, start, tracer, span=None):
+        self.path = path
+        self.start = start
+        # time spent in the child spans, in nanoseconds
+        self.children = 0
+        self.tracer = tracer
+        self.span = span
+
+
+class Tracer(object):
+    """Aggregates the spans recorded by trace, by call path.
+
+    A call path is the tuple of the names of the spans entered, from the
+    outermost one. For each path the tracer counts the calls, their total
+    time and their self time, which excludes the time spent in child spans.
+    It also keeps the last max_events spans to export them as Chrome trace
+    events. The spans are only recorded while the tracer is enabled.
+
+    A Tracer passed to trace records the spans of the functions and blocks
+    traced with it, apart from the tracer returned by get_tracer.
+
+    Parameters
+    ----------
+    max_events : int, optional
+        number of spans kept for the Chrome trace export, 0 to keep none,
+        by default 100000
+    """
+    def __init__(self, max_events=100000):
+        self.enabled = False
+        self._lock = threading.Lock()
+        self._paths = {}
+        self._events = deque(maxlen=max_events)
+        self.max_events = max_events
+
+    def enable(self):
+        self.enabled = True
+
+    def disable(self):
+        self.enabled = False
+
+    def reset(self):
+        with self._lock:
+            self._paths.clear()
+            self._events.clear()
+
+    def record(self, path, start_ns, total_ns, self_ns):
+        with self._lock:
+            stats = self._paths.get(path)
+            if stats is None:
+                stats = self._paths[path] = [0, 0, 0]
+            stats[0] += 1
+            stats[1] += total_ns
+            # concurrent child tasks may take longer than their parent
+            stats[2] += max(0, self_ns)
+            if self.max_events:
+                self._events.append((path[-1], start_ns, total_ns, threading.get_ident()))
+
+    def stats(self):
+        """Returns the count, total and self time in seconds of each call path,
+        by path joined with ';'."""
+        with self._lock:
+            paths = sorted(self._paths.items())
+        return {';'.join(path): {'count': count, 'total': total_ns / 1e9, 'self': self_ns / 1e9}
+                for path, (count, total_ns, self_ns) in paths}
+
+    def collapsed_stacks(self):
+        """Returns the self time of each call path in microseconds, in the
+        collapsed stack format of flamegraph.pl and speedscope."""
+        with self._lock:
+            paths = sorted(self._paths.items())
+        return ''.join('{} {}\n'.format(';'.join(path), self_ns // 1000)
+                       for path, (_, _, self_ns) in paths)
+
+    def chrome_trace(self):
+        """Returns the last spans as a dict in the Chrome trace event format,
+        to be opened with chrome://tracing or Perfetto."""
+        with self._lock:
+            events = list(self._events)
+        pid = os.getpid()
+        return {
+            'traceEvents': [{'name': name, 'cat': 'span', 'ph': 'X', 'pid': pid, 'tid': tid,
+                             'ts': start_ns / 1000, 'dur': total_ns / 1000}
+                            for name, start_ns, total_ns, tid in events],
+            'displayTimeUnit': 'ms',
+        }
+
+    def write_collapsed_stacks(self, filepath):
+        with open(filepath, 'w') as file:
+            file.write(self.collapsed_stacks())
+
+    def write_chrome_trace(self, filepath):
+        with open(filepath, 'w') as file:
+            json.dump(self.chrome_trace(), file)
+
+
+_tracer = Tracer()
+
+
+def get_tracer():
+    """Returns the Tracer recording the spans of trace."""
+    return _tracer
+
+
+def _enter(name, tracer, span=None):
+    stack = _stack.get()
+    path = stack[-1].path + (name,) if stack else (name,)
+    frame = _Frame(path, time.perf_counter_ns(), tracer, span)
+    _stack.set(stack + (frame,))
+    return frame
+
+
+def _exit(frame):
+    total = time.perf_counter_ns() - frame.start
+    stack = _stack.get()[:-1]
+    _stack.set(stack)
+    if stack:
+        stack[-1].children += total
+    frame.tracer.record(frame.path, frame.start, total, total - frame.children)
+
+
+class _Span(object):
+    """Context manager recording a span, which can also decorate functions."""
+    def __init__(self, name, tracer):
+        self.name = name
+        self.tracer = tracer
+
+    def __enter__(self):
+        if self.tracer.enabled:
+            _enter(self.name or '<span>', self.tracer, self)
+        return self
+
+    def __exit__(self, *exc_info):
+        stack = _stack.get()
+        # The span is not recorded if tracing was disabled when it was entered
+        if stack and stack[-1].span is self:
+            _exit(stack[-1])
+
+    def __call__(self, func):
+        return _traced(func, self.name, self.tracer)
+
+
+def _traced(func, name, tracer):
+    name = name or '{}.{}'.format(func.__module__, func.__qualname__)
+
+    if asyncio.iscoroutinefunction(func):
+        @wraps(func)  # maintain all the info about the function
+        async def async_traced(*args, **kwargs):
+            if not tracer.enabled:
+                return await func(*args, **kwargs)
+            frame = _enter(name, tracer)
+            try:
+                return await func(*args, **kwargs)
+            finally:
+                _exit(frame)
+        return async_traced
+
+    @wraps(func)  # maintain all the info about the function
+    def traced(*args, **kwargs):
+        if not tracer.enabled:
+            return func(*args, **kwargs)
+        frame = _enter(name, tracer)
+        try:
+            return func(*args, **kwargs)
+        finally:
+            _exit(frame)
+    return traced
+
+
+def trace(func=None, name=None, tracer=None):
+    """Records the calls of a function, or a block of code, as spans of a
+    tracer, while it is enabled.
+
+    The spans entered and not exited yet are kept in a context variable, so
+    each thread and asyncio task has its own stack of spans, the tasks
+    starting with the stack of the code creating them. When the tracer is
+    disabled, the decorated functions only check a flag before being called.
+
+    Parameters
+    ----------
+    func : function or str, optional
+        Function which calls shall be traced, or the name of the span of a
+        `with` block
+
+    name : str, optional
+        name of the span, by default the module and qualified name of the
+        function
+
+    tracer : Tracer, optional
+        tracer recording the spans, by default the one returned by get_tracer
+
+    Returns
+    -------
+    function or context manager
+        The function wrapper, or a context manager recording a span which
+        can also be used as decorator
+
+    Example
+    -------
+    >>> @trace
+    ... def handle(request):
+    ...     with trace('parse'):
+    ...         ...
+    >>> get_tracer().enable()
+    >>> handle(request)
+    >>> get_tracer().write_collapsed_stacks('handle.folded')
+    """
+    if tracer is None:
+        tracer = _tracer
+    if func is None or isinstance(func, str):
+        return _Span(func if isinstance(func, str) else name, tracer)
+    return _traced(func, name, tracer)
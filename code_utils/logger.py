@@ -1,28 +1,605 @@
 import os
+import atexit
+import copy
 import functools
+import gzip
+import json
 import logging
+import multiprocessing
+import queue
+import shutil
+import threading
+import time
+import traceback
+import warnings
+from logging.handlers import QueueHandler, QueueListener
 
-def create_logger(filepath, name='logger', **kwargs):
+_OVERFLOW_POLICIES = ('block', 'drop_oldest', 'drop_newest')
+
+_BUFFERED_OPTIONS = ('buffer_size', 'flush_interval', 'flush_level', 'max_bytes',
+                     'rotate_interval', 'backup_count', 'compress')
+
+_FILE_OPTIONS = _BUFFERED_OPTIONS + ('fields', 'queue_size', 'overflow')
+
+
+# Handlers created by create_logger, by absolute path of their file
+_file_handlers = {}
+_file_handlers_lock = threading.Lock()
+
+
+class JsonFormatter(logging.Formatter):
+    """Formatter writing each record as a JSON object on one line.
+
+    The time is written as the timestamp of the record, which avoids the
+    conversion of logging.Formatter's asctime.
+
+    Parameters
+    ----------
+    fields : (list, tuple), optional
+        attributes of the records to write, 'message' being the message
+        merged with its arguments, by default JsonFormatter.default_fields
+    """
+    default_fields = ('created', 'levelname', 'name', 'message')
+
+    def __init__(self, fields=default_fields):
+        super().__init__()
+        self.fields = tuple(fields)
+
+    def format(self, record):
+        data = {}
+        for field in self.fields:
+            if field == 'message':
+                data['message'] = record.getMessage()
+            else:
+                data[field] = getattr(record, field, None)
+        if record.exc_info:
+            if not record.exc_text:
+                record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            data['exc_info'] = record.exc_text
+        if record.stack_info:
+            data['stack_info'] = record.stack_info
+        return json.dumps(data, default=str, ensure_ascii=False)
+
+
+class _BoundedQueueListener(QueueListener):
+    """QueueListener which waits for room in the queue to stop."""
+    def enqueue_sentinel(self):
+        self.queue.put(self._sentinel)
+
+
+class BoundedQueueHandler(QueueHandler):
+    """Handler passing the records through a bounded queue to other handlers.
+
+    The records are handled by a QueueListener in a background thread, so the
+    logging calls don't wait for the writes. Closing the handler waits for
+    the queued records to be handled; this is done at exit by logging.shutdown.
+
+    Parameters
+    ----------
+    handlers : logging.Handler
+        handlers the records are passed to in the background thread
+
+    queue_size : int, optional
+        maximum number of queued records, by default 10000
+
+    overflow : str, optional
+        what to do when the queue is full:
+        'block' - wait for room in the queue
+        'drop_oldest' - drop the oldest queued record
+        'drop_newest' - drop the record being logged,
+            by default 'block'
+        The dropped records are counted in the 'dropped' attribute.
+    """
+    def __init__(self, *handlers, queue_size=10000, overflow='block'):
+        if overflow not in _OVERFLOW_POLICIES:
+            raise ValueError('overflow must be one of {}, not {!r}'.format(
+                _OVERFLOW_POLICIES, overflow))
+        super().__init__(queue.Queue(queue_size))
+        self.overflow = overflow
+        self.dropped = 0
+        self.listener = _BoundedQueueListener(self.queue, *handlers,
+                                              respect_handler_level=True)
+        self.listener.start()
+
+    def prepare(self, record):
+        """Merges the message with its arguments, which could change later on.
+
+        Unlike QueueHandler.prepare, the record is not formatted here: the
+        records stay in this process, so the formatting, including the
+        exception's traceback, is left to the listener thread.
+        """
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+    def enqueue(self, record):
+        # Called with the handler's lock held, the counter needs no other lock
+        if self.overflow == 'block':
+            self.queue.put(record)
+            return
+        try:
+            self.queue.put_nowait(record)
+            return
+        except queue.Full:
+            if self.overflow == 'drop_newest':
+                self.dropped += 1
+                return
+        while True:
+            try:
+                self.queue.get_nowait()
+                self.queue.task_done()
+                self.dropped += 1
+            except queue.Empty:
+                pass
+            try:
+                self.queue.put_nowait(record)
+                return
+            except queue.Full:
+                continue
+
+    def close(self):
+        """Waits for the queued records to be handled and closes the handlers."""
+        if self.listener is not None:
+            self.listener.stop()
+            for handler in self.listener.handlers:
+                handler.close()
+            self.listener = None
+        super().close()
+
+
+class BufferedRotatingFileHandler(logging.Handler):
+    """File handler writing the records in batches and rotating the file.
+
+    The formatted records are buffered and written at once when the buffer
+    reaches 'buffer_size' bytes, when a record of at least 'flush_level' is
+    handled, or at the latest 'flush_interval' seconds after being buffered.
+
+    The file is rotated once it would exceed 'max_bytes' or once it is older
+    than 'rotate_interval' seconds: 'file.log' is renamed 'file.log.1',
+    'file.log.1' is renamed 'file.log.2' and so on up to 'backup_count'.
+    With 'compress', the rotated files are compressed with gzip in a
+    background thread ('file.log.1.gz').
+
+    The attributes 'bytes_written', 'records_written', 'flushes' and
+    'rotations' count what has been written so far.
+
+    Parameters
+    ----------
+    filename : str
+        path of the log file
+
+    encoding : str, optional
+        encoding of the file, by default 'utf-8'
+
+    buffer_size : int, optional
+        number of bytes buffered before writing them, by default 65536
+
+    flush_interval : float, optional
+        maximum number of seconds a record stays in the buffer,
+        by default 1.0, None to only flush on size and level
+
+    flush_level : int, optional
+        records of this level or higher are written immediately along with
+        the buffer, by default logging.ERROR
+
+    max_bytes : int, optional
+        maximum size of the file before it is rotated, by default 0 (never)
+
+    rotate_interval : float, optional
+        maximum age of the file in seconds before it is rotated,
+        by default None (never)
+
+    backup_count : int, optional
+        number of rotated files kept, by default 5
+
+    compress : bool, optional
+        compress the rotated files with gzip, by default False
+    """
+    def __init__(self, filename, encoding='utf-8', buffer_size=64 * 1024,
+                 flush_interval=1.0, flush_level=logging.ERROR, max_bytes=0,
+                 rotate_interval=None, backup_count=5, compress=False):
+        super().__init__()
+        self.baseFilename = os.path.abspath(filename)
+        self.encoding = encoding
+        self.buffer_size = buffer_size
+        self.flush_interval = flush_interval
+        self.flush_level = flush_level
+        self.max_bytes = max_bytes
+        self.rotate_interval = rotate_interval
+        self.backup_count = backup_count
+        self.compress = compress
+
+        self.bytes_written = 0
+        self.records_written = 0
+        self.flushes = 0
+        self.rotations = 0
+
+        self._buffer = []
+        self._buffered_bytes = 0
+        self._buffered_since = None
+        self._compressor = None
+        self._open()
+
+        self._stopped = threading.Event()
+        self._flusher = None
+        if flush_interval is not None:
+            self._flusher = threading.Thread(target=self._flush_periodically,
+                                             name='log-flusher', daemon=True)
+            self._flusher.start()
+
+    def _open(self):
+        self.stream = open(self.baseFilename, 'ab')
+        self._size = self.stream.tell()
+        self._opened_at = time.time()
+
+    def emit(self, record):
+        try:
+            data = (self.format(record) + '\n').encode(self.encoding)
+            if not self._buffer:
+                self._buffered_since = time.monotonic()
+            self._buffer.append(data)
+            self._buffered_bytes += len(data)
+            if self._buffered_bytes >= self.buffer_size \
+                    or record.levelno >= self.flush_level:
+                self._write()
+        except Exception:
+            self.handleError(record)
+
+    def _write(self):
+        """Writes the buffer to the file, rotating it first if needed."""
+        if not self._buffer or self.stream is None:
+            return
+        if self._should_rotate():
+            self._rotate()
+        data = b''.join(self._buffer)
+        nb_records = len(self._buffer)
+        self._buffer = []
+        self._buffered_bytes = 0
+        self.stream.write(data)
+        self.stream.flush()
+        self._size += len(data)
+        self.bytes_written += len(data)
+        self.records_written += nb_records
+        self.flushes += 1
+
+    def _should_rotate(self):
+        if self._size == 0:
+            return False
+        if self.max_bytes and self._size + self._buffered_bytes > self.max_bytes:
+            return True
+        return self.rotate_interval is not None \
+            and time.time() - self._opened_at >= self.rotate_interval
+
+    def _rotate(self):
+        self.stream.close()
+        # The previously rotated file has to be compressed before being renamed
+        if self._compressor is not None:
+            self._compressor.join()
+            self._compressor = None
+        if self.backup_count > 0:
+            for i in range(self.backup_count - 1, 0, -1):
+                for extension in ('', '.gz'):
+                    source = '{}.{}{}'.format(self.baseFilename, i, extension)
+                    if os.path.exists(source):
+                        os.replace(source, '{}.{}{}'.format(self.baseFilename, i + 1, extension))
+            rotated = self.baseFilename + '.1'
+            os.replace(self.baseFilename, rotated)
+            if self.compress:
+                self._compressor = threading.Thread(target=_gzip_file, args=(rotated,),
+                                                    name='log-compressor', daemon=True)
+                self._compressor.start()
+        else:
+            os.remove(self.baseFilename)
+        self.rotations += 1
+        self._open()
+
+    def _flush_periodically(self):
+        while not self._stopped.wait(self.flush_interval):
+            self.acquire()
+            try:
+                if self._buffer \
+                        and time.monotonic() - self._buffered_since >= self.flush_interval:
+                    self._write()
+            except Exception:
+                if logging.raiseExceptions:
+                    traceback.print_exc()
+            finally:
+                self.release()
+
+    def flush(self):
+        """Writes the buffered records to the file."""
+        self.acquire()
+        try:
+            self._write()
+        finally:
+            self.release()
+
+    def close(self):
+        """Writes the buffered records and closes the file."""
+        self._stopped.set()
+        self.acquire()
+        try:
+            try:
+                self._write()
+            finally:
+                if self.stream is not None:
+                    self.stream.close()
+                    self.stream = None
+            if self._compressor is not None:
+                self._compressor.join()
+                self._compressor = None
+        finally:
+            self.release()
+            super().close()
+
+    def __repr__(self):
+        return '<{} {} ({})>'.format(self.__class__.__name__, self.baseFilename,
+                                     logging.getLevelName(self.level))
+
+
+def _gzip_file(path):
+    """Compresses a file into path.gz and removes it."""
+    with open(path, 'rb') as source, gzip.open(path + '.gz.tmp', 'wb') as destination:
+        shutil.copyfileobj(source, destination)
+    os.replace(path + '.gz.tmp', path + '.gz')
+    os.remove(path)
+
+
+def create_logger(filepath, name='logger', async_mode=False, buffered=False, **kwargs):
     """
     Creates a logging object and returns it
+
+    Parameters
+    ----------
+    filepath : str
+        path of the log file
+
+    name : str, optional
+        name of the logger, by default 'logger'
+
+    async_mode : bool, optional
+        write the records to the file in a background thread, the logging
+        calls only put them in a queue, by default False
+
+    buffered : bool, optional
+        write the records in batches with a BufferedRotatingFileHandler,
+        which can also rotate the file, by default False
+
+    kwargs : optional
+        format - format of the records, or 'json' to write them with a
+            JsonFormatter, by default '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+        fields - attributes of the records written by the JsonFormatter,
+            by default JsonFormatter.default_fields
+        queue_size - maximum number of queued records with async_mode,
+            by default 10000
+        overflow - 'block', 'drop_oldest' or 'drop_newest', what to do when
+            the queue is full with async_mode, see BoundedQueueHandler,
+            by default 'block'
+        buffer_size, flush_interval, flush_level, max_bytes, rotate_interval,
+            backup_count, compress - options of the BufferedRotatingFileHandler
+            with buffered
+
+    Returns
+    -------
+    logging.Logger
+        the logger
+
+    Calling it again with the same filepath, for the same or another logger,
+    does not open the file again: the handler created by the first call,
+    and so its options, is reused. It is only added once to each logger.
+    A RuntimeWarning is issued when the format, async_mode, buffered or
+    kwargs options differ from the ones of the first call.
     """
     fmt = kwargs.get('format', '%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 
     logger = logging.getLogger(name)
     logger.setLevel(logging.INFO)
 
-    os.makedirs(os.path.dirname(filepath), exist_ok=True)
+    fh = _get_file_handler(filepath, fmt, async_mode, buffered, kwargs)
+
+    # add handler to logger object, once
+    if fh not in logger.handlers:
+        logger.addHandler(fh)
+    return logger
+
+
+def _get_file_handler(filepath, fmt, async_mode, buffered, kwargs, warn=True):
+    """Returns the handler writing to filepath, created on first use.
+
+    In a process forwarding its records to a log sink, the handler is a
+    _SinkHandler and the file is written by the sink's process. With warn,
+    a RuntimeWarning is issued when the handler already exists with other
+    options.
+    """
+    key = os.path.abspath(filepath)
+    options = {k: v for k, v in kwargs.items() if k in _FILE_OPTIONS}
+    with _file_handlers_lock:
+        fh = _file_handlers.get(key)
+        if fh is None or not _handler_is_open(fh):
+            if _forwards_to_sink():
+                fh = _SinkHandler(_sink_queue)
+            else:
+                fh = _create_file_handler(filepath, fmt, async_mode, buffered, options)
+            # what a log sink needs to create the same handler
+            fh.log_target = (key, fmt, buffered, options)
+            fh.log_async = async_mode
+            _file_handlers[key] = fh
+        elif warn:
+            _, first_fmt, first_buffered, first_options = fh.log_target
+            if (fmt, bool(async_mode), bool(buffered), options) != \
+                    (first_fmt, bool(fh.log_async), bool(first_buffered), first_options):
+                warnings.warn('{} is already written by a handler created with other options, '
+                              'which is reused'.format(key), RuntimeWarning, stacklevel=3)
+    return fh
+
+
+def _create_file_handler(filepath, fmt, async_mode, buffered, kwargs):
+    """Creates the handler writing to filepath."""
+    directory = os.path.dirname(filepath)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
 
     # create the logging file handler
-    fh = logging.FileHandler(filepath)
-    formatter = logging.Formatter(fmt)
+    if buffered:
+        fh = BufferedRotatingFileHandler(
+            filepath, **{key: kwargs[key] for key in _BUFFERED_OPTIONS if key in kwargs})
+    else:
+        fh = logging.FileHandler(filepath)
+    if fmt == 'json':
+        formatter = JsonFormatter(kwargs.get('fields', JsonFormatter.default_fields))
+    else:
+        formatter = logging.Formatter(fmt)
     fh.setFormatter(formatter)
 
-    # add handler to logger object
-    logger.addHandler(fh)
-    return logger
+    if async_mode:
+        # the file handler is called by the queue's listener thread
+        fh = BoundedQueueHandler(fh,
+                                 queue_size=kwargs.get('queue_size', 10000),
+                                 overflow=kwargs.get('overflow', 'block'))
+    return fh
+
+
+def _handler_is_open(handler):
+    if isinstance(handler, BoundedQueueHandler):
+        return handler.listener is not None
+    if isinstance(handler, _SinkHandler):
+        return handler.sink is not None
+    return handler.stream is not None
+
+# Queue of the log sink the records are sent to, see start_log_sink
+_sink_queue = None
+# Process writing the records of the sink and its thread
+_sink_pid = None
+_sink_thread = None
+
+
+class _SinkHandler(logging.Handler):
+    """Handler sending the records to the log sink of another process."""
+    def __init__(self, sink):
+        super().__init__()
+        self.sink = sink
+
+    def emit(self, record):
+        try:
+            # Only the formatted message and traceback are pickled
+            record = copy.copy(record)
+            record.msg = record.getMessage()
+            record.args = None
+            if record.exc_info:
+                record.exc_text = logging.Formatter().formatException(record.exc_info)
+                record.exc_info = None
+            record.log_target = self.log_target
+            self.sink.put(record)
+        except Exception:
+            self.handleError(record)
+
+    def close(self):
+        self.sink = None
+        super().close()
+
+
+def _forwards_to_sink():
+    return _sink_queue is not None and _sink_pid != os.getpid()
+
+
+def _handle_sink_records(sink):
+    """Writes the records received by the sink, until None is received."""
+    while True:
+        record = sink.get()
+        if record is None:
+            break
+        filepath, fmt, buffered, options = record.__dict__.pop('log_target')
+        try:
+            handler = _get_file_handler(filepath, fmt, False, buffered, options, warn=False)
+            if record.levelno >= handler.level:
+                handler.handle(record)
+        except Exception:
+            if logging.raiseExceptions:
+                traceback.print_exc()
+
+
+def start_log_sink():
+    """Makes this process write the records logged by its child processes.
+
+    The loggers created by create_logger in child processes then send their
+    records through a multiprocessing queue, and a thread of this process
+    writes them to the files. Each file is so written by a single process.
+
+    The process based decorators of code_utils.decorators.concurrency pass
+    the sink to the child processes they start; other child processes have
+    to call set_log_sink(get_log_sink()) unless they are forked.
+
+    Returns
+    -------
+    multiprocessing.SimpleQueue
+        the queue of the sink
+    """
+    global _sink_queue, _sink_pid, _sink_thread
+    if _sink_thread is not None and _sink_pid == os.getpid():
+        return _sink_queue
+    _sink_queue = multiprocessing.SimpleQueue()
+    _sink_pid = os.getpid()
+    _sink_thread = threading.Thread(target=_handle_sink_records, args=(_sink_queue,),
+                                    name='log-sink', daemon=True)
+    _sink_thread.start()
+    # registered after logging's own shutdown, so called before it
+    atexit.register(stop_log_sink)
+    return _sink_queue
+
+
+def stop_log_sink():
+    """Writes the records already sent to the sink and stops it."""
+    global _sink_queue, _sink_pid, _sink_thread
+    if _sink_thread is None or _sink_pid != os.getpid():
+        return
+    _sink_queue.put(None)
+    _sink_thread.join()
+    atexit.unregister(stop_log_sink)
+    _sink_queue = _sink_pid = _sink_thread = None
+
+
+def get_log_sink():
+    """Returns the queue of the log sink, None if there is none."""
+    return _sink_queue
+
+
+def set_log_sink(sink):
+    """Makes the loggers of create_logger in this process send their records to the sink.
+
+    Meant to be called at the start of a child process with the result of
+    get_log_sink() in the parent. The handlers inherited from the parent by
+    a forked process are replaced as well.
+
+    Parameters
+    ----------
+    sink : multiprocessing.SimpleQueue
+        queue of the log sink, None does nothing
+    """
+    global _sink_queue
+    if sink is None or _sink_pid == os.getpid():
+        return
+    _sink_queue = sink
+    with _file_handlers_lock:
+        inherited = {}
+        for key, handler in list(_file_handlers.items()):
+            if not isinstance(handler, _SinkHandler):
+                # not closed, a buffered handler would write its parent's records again
+                sink_handler = _SinkHandler(sink)
+                sink_handler.log_target = handler.log_target
+                sink_handler.log_async = handler.log_async
+                _file_handlers[key] = inherited[handler] = sink_handler
+    if not inherited:
+        return
+    for logger in list(logging.Logger.manager.loggerDict.values()):
+        for handler in list(getattr(logger, 'handlers', ())):
+            if handler in inherited:
+                logger.removeHandler(handler)
+                logger.addHandler(inherited[handler])
+
 
 if __name__ == "__main__":
     loggername = os.path.basename(__file__).rsplit('.', 1)[0]
     loggerfile = os.path.join(os.path.dirname(__file__), 'logs',  loggername + '.log')
-    logger = create_logger(loggerfile, loggername)
\ No newline at end of file
+    logger = create_logger(loggerfile, loggername)
@@ -0,0 +1,303 @@
+"""In-process registry of the metrics recorded by the decorators.
+
+The durations recorded by decorators.timing.timer are aggregated per
+function in a TimingStats, kept by a MetricsRegistry:
+
+>>> @timer
+... def work():
+...     ...
+>>> work()
+>>> get_registry().snapshot()
+{'module.work': {'count': 1, 'total': 0.0012, 'min': 0.0012, ...}}
+>>> print(get_registry().to_prometheus())
+"""
+import json
+import threading
+
+__all__ = [
+    'TimingStats',
+    'MemoryStats',
+    'MetricsRegistry',
+    'get_registry',
+]
+
+# Each power of two is split in 2**_SUB_BUCKET_BITS buckets, so the
+# percentiles are within about 3% of the recorded durations
+_SUB_BUCKET_BITS = 5
+_SUB_BUCKETS = 1 << _SUB_BUCKET_BITS
+
+DEFAULT_QUANTILES = (0.5, 0.9, 0.99)
+
+
+def _bucket(value):
+    """Returns the index of the bucket of a positive integer."""
+    if value < _SUB_BUCKETS:
+        return value
+    shift = value.bit_length() - 1 - _SUB_BUCKET_BITS
+    return _SUB_BUCKETS * (shift + 1) + (value >> shift) - _SUB_BUCKETS
+
+
+def _bucket_middle(index):
+    """Returns the value in the middle of a bucket."""
+    if index < _SUB_BUCKETS:
+        return index
+    shift = index // _SUB_BUCKETS - 1
+    low = (_SUB_BUCKETS + index % _SUB_BUCKETS) << shift
+    return low + ((1 << shift) - 1) / 2
+
+
+class TimingStats(object):
+    """Count, total, min, max and percentiles of durations in nanoseconds.
+
+    The durations are counted in log-linear buckets, like an HDR histogram,
+    so the memory used is bounded (at most a few thousand buckets) and the
+    percentiles are within about 3% of the recorded values. Thread safe.
+
+    Parameters
+    ----------
+    quantiles : tuple, optional
+        quantiles exported by snapshot and the registry,
+        by default (0.5, 0.9, 0.99)
+    """
+    prometheus_type = 'summary'
+
+    def __init__(self, quantiles=DEFAULT_QUANTILES):
+        self.quantiles = quantiles
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.count = 0
+            self.total_ns = 0
+            self.min_ns = None
+            self.max_ns = None
+            self._buckets = {}
+
+    def record(self, duration_ns):
+        """Adds a duration, in nanoseconds."""
+        index = _bucket(max(0, duration_ns))
+        with self._lock:
+            self.count += 1
+            self.total_ns += duration_ns
+            if self.min_ns is None or duration_ns < self.min_ns:
+                self.min_ns = duration_ns
+            if self.max_ns is None or duration_ns > self.max_ns:
+                self.max_ns = duration_ns
+            self._buckets[index] = self._buckets.get(index, 0) + 1
+
+    def percentile(self, quantile):
+        """Returns the duration in nanoseconds below which quantile of the durations are."""
+        with self._lock:
+            return self._percentile(quantile)
+
+    def _percentile(self, quantile):
+        if not self.count:
+            return None
+        rank = quantile * self.count
+        seen = 0
+        for index in sorted(self._buckets):
+            seen += self._buckets[index]
+            if seen >= rank:
+                break
+        return min(max(_bucket_middle(index), self.min_ns), self.max_ns)
+
+    def snapshot(self):
+        """Returns the statistics as a dict, with the durations in seconds."""
+        with self._lock:
+            count = self.count
+            snapshot = {
+                'count': count,
+                'total': self.total_ns / 1e9,
+                'min': self.min_ns / 1e9 if count else None,
+                'max': self.max_ns / 1e9 if count else None,
+                'mean': self.total_ns / count / 1e9 if count else None,
+            }
+            for quantile in self.quantiles:
+                value = self._percentile(quantile)
+                snapshot['p{:g}'.format(quantile * 100)] = value / 1e9 if count else None
+        return snapshot
+
+    def prometheus_samples(self):
+        """Returns the (suffix, labels, value) of the samples of the Prometheus text format."""
+        with self._lock:
+            samples = []
+            for quantile in self.quantiles:
+                value = self._percentile(quantile)
+                samples.append(('', {'quantile': '{:g}'.format(quantile)},
+                                value / 1e9 if value is not None else float('nan')))
+            samples.append(('_sum', {}, self.total_ns / 1e9))
+            samples.append(('_count', {}, self.count))
+        return samples
+
+
+class MemoryStats(object):
+    """Memory allocated by the calls of a function and their top allocation sites.
+
+    For each call, the peak is the maximum memory allocated during the call
+    and the net the memory still allocated at its end, both in bytes. The
+    memory allocated by the calls is also summed by allocation site, keeping
+    the max_sites largest ones. Thread safe.
+
+    Parameters
+    ----------
+    top : int, optional
+        number of allocation sites exported by snapshot, by default 10
+
+    max_sites : int, optional
+        number of allocation sites kept, by default 1000
+    """
+    prometheus_type = 'gauge'
+
+    def __init__(self, top=10, max_sites=1000):
+        self.top = top
+        self.max_sites = max_sites
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.count = 0
+            self.peak_total = 0
+            self.peak_max = 0
+            self.net_total = 0
+            # site -> [bytes, blocks]
+            self._sites = {}
+
+    def record(self, peak, net, sites=()):
+        """Adds a call, sites being (site, bytes, blocks) tuples."""
+        with self._lock:
+            self.count += 1
+            self.peak_total += peak
+            self.peak_max = max(self.peak_max, peak)
+            self.net_total += net
+            for site, size, blocks in sites:
+                totals = self._sites.get(site)
+                if totals is None:
+                    totals = self._sites[site] = [0, 0]
+                totals[0] += size
+                totals[1] += blocks
+            if len(self._sites) > 2 * self.max_sites:
+                largest = sorted(self._sites.items(), key=lambda item: -item[1][0])
+                self._sites = dict(largest[:self.max_sites])
+
+    def top_sites(self, top=None):
+        """Returns the (site, bytes, blocks) of the sites which allocated the most."""
+        with self._lock:
+            sites = sorted(self._sites.items(), key=lambda item: -item[1][0])
+        return [(site, size, blocks) for site, (size, blocks) in sites[:top or self.top]]
+
+    def snapshot(self):
+        """Returns the statistics as a dict, with the sizes in bytes."""
+        with self._lock:
+            count = self.count
+            snapshot = {
+                'count': count,
+                'peak_max': self.peak_max,
+                'peak_mean': self.peak_total / count if count else None,
+                'net_total': self.net_total,
+                'net_mean': self.net_total / count if count else None,
+            }
+        snapshot['top_allocators'] = [{'site': site, 'size': size, 'blocks': blocks}
+                                      for site, size, blocks in self.top_sites()]
+        return snapshot
+
+    def prometheus_samples(self):
+        """Returns the (suffix, labels, value) of the samples of the Prometheus text format."""
+        with self._lock:
+            return [('', {'stat': 'calls'}, self.count),
+                    ('', {'stat': 'peak_max'}, self.peak_max),
+                    ('', {'stat': 'peak_total'}, self.peak_total),
+                    ('', {'stat': 'net_total'}, self.net_total)]
+
+
+def _escape_label(value):
+    return value.replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_value(value):
+    value = float(value)
+    return 'NaN' if value != value else repr(value)
+
+
+def _format_labels(labels):
+    return ','.join('{}="{}"'.format(key, _escape_label(str(value)))
+                    for key, value in labels.items())
+
+
+class MetricsRegistry(object):
+    """Named metrics, created on first use, and their exporters. Thread safe.
+
+    Parameters
+    ----------
+    prefix : str, optional
+        prefix of the names of the metrics exported in the Prometheus
+        format, by default 'code_utils_'
+    """
+    def __init__(self, prefix='code_utils_'):
+        self.prefix = prefix
+        # (family, name) -> metric
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def get(self, family, name, factory):
+        """Returns the metric of a family with a name, created by factory if needed."""
+        key = (family, name)
+        metric = self._metrics.get(key)
+        if metric is None:
+            with self._lock:
+                metric = self._metrics.setdefault(key, factory())
+        return metric
+
+    def timing(self, name):
+        """Returns the TimingStats of the durations of a function."""
+        return self.get('function_duration_seconds', name, TimingStats)
+
+    def memory(self, name):
+        """Returns the MemoryStats of the allocations of a function."""
+        return self.get('function_memory_bytes', name, MemoryStats)
+
+    def reset(self):
+        """Resets all the metrics, which stay used by the decorated functions."""
+        with self._lock:
+            metrics = list(self._metrics.values())
+        for metric in metrics:
+            metric.reset()
+
+    def snapshot(self, family='function_duration_seconds'):
+        """Returns a dict of the snapshots of the metrics of a family by name."""
+        with self._lock:
+            metrics = [(name, metric) for (metric_family, name), metric in self._metrics.items()
+                       if metric_family == family]
+        return {name: metric.snapshot() for name, metric in sorted(metrics, key=lambda item: item[0])}
+
+    def to_json(self, **kwargs):
+        """Returns the snapshots of all the metrics by family as a JSON string."""
+        with self._lock:
+            families = sorted({family for family, _ in self._metrics})
+        return json.dumps({family: self.snapshot(family) for family in families}, **kwargs)
+
+    def to_prometheus(self):
+        """Returns all the metrics in the Prometheus text exposition format."""
+        with self._lock:
+            metrics = sorted(self._metrics.items(), key=lambda item: item[0])
+        lines = []
+        family = None
+        for (metric_family, name), metric in metrics:
+            full_name = self.prefix + metric_family
+            if metric_family != family:
+                family = metric_family
+                lines.append('# TYPE {} {}'.format(full_name, metric.prometheus_type))
+            for suffix, labels, value in metric.prometheus_samples():
+                labels = dict({'function': name}, **labels)
+                lines.append('{}{}{{{}}} {}'.format(full_name, suffix, _format_labels(labels),
+                                                    _format_value(value)))
+        return '\n'.join(lines) + '\n' if lines else ''
+
+
+_registry = MetricsRegistry()
+
+
+def get_registry():
+    """Returns the registry used by default by the decorators."""
+    return _registry
@@ -1,4 +1,14 @@
+import asyncio
+import concurrent.futures
+import fnmatch
 import os
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict, deque, namedtuple
+from functools import partial
+from itertools import islice
 
 USER_PATH = os.path.expanduser('~')
 DESKTOP_PATH = os.path.join(os.path.expanduser('~'), 'Desktop')
@@ -9,8 +19,585 @@ _check_funcs = {
     'all': all,
 }
 
+_KINDS = ('any', 'file', 'dir')
 
-def list_directory(directory, strings_to_contain=[''], mode='any'):
+_PATTERN_TYPES = ('substring', 'glob', 'regex')
+
+# Flags of a regex without inline global flags such as (?i)
+_DEFAULT_REGEX_FLAGS = re.compile('').flags
+
+
+def _trie_regex(strings):
+    """Returns a regex source matching any of the strings.
+
+    The alternatives are factorised in a prefix tree, so at every position of
+    a name the regex engine follows at most one branch per character instead
+    of trying every string one after the other. At a given position the
+    longest of the strings is matched.
+    """
+    trie = {}
+    for string in strings:
+        node = trie
+        for char in string:
+            node = node.setdefault(char, {})
+        # The empty key marks the end of a string
+        node[''] = {}
+
+    def build(node):
+        branches = [re.escape(char) + build(child)
+                    for char, child in sorted(node.items()) if char]
+        if not branches:
+            return ''
+        if len(branches) == 1 and '' not in node:
+            return branches[0]
+        source = '(?:{})'.format('|'.join(branches))
+        return source + '?' if '' in node else source
+
+    return build(trie)
+
+
+def _compile_patterns(patterns, mode, pattern_type):
+    """Compiles the patterns into a single function taking a name.
+
+    Returns None if every name matches.
+    """
+    if not patterns:
+        # Same as any([]) and all([])
+        return None if mode == 'all' else (lambda name: False)
+    if pattern_type == 'substring':
+        if mode == 'any':
+            if '' in patterns:
+                return None
+            if len(patterns) == 1:
+                pattern = patterns[0]
+                return lambda name: pattern in name
+            search = re.compile(_trie_regex(patterns)).search
+            return lambda name: search(name) is not None
+        required = tuple(set(p for p in patterns if p))
+        if not required:
+            return None
+        if len(required) == 1:
+            pattern = required[0]
+            return lambda name: pattern in name
+        # Set coverage: the longest string found at each position of the name
+        # also covers all the required strings it contains.
+        covers = {p: frozenset(q for q in required if q in p) for p in required}
+        nb_required = len(required)
+        finditer = re.compile('(?=({}))'.format(_trie_regex(required))).finditer
+
+        def contains_all(name):
+            found = set()
+            for match in finditer(name):
+                found |= covers[match.group(1)]
+                if len(found) == nb_required:
+                    return True
+            return False
+        return contains_all
+
+    if pattern_type == 'glob':
+        # Globs have to match the whole name
+        regexes = [re.compile(fnmatch.translate(p)) for p in patterns]
+        if mode == 'any' and regexes:
+            match = re.compile('|'.join('(?:{})'.format(r.pattern) for r in regexes)).match
+            return lambda name: match(name) is not None
+        matches = tuple(r.match for r in regexes)
+    else:
+        regexes = [re.compile(p) for p in patterns]
+        # Patterns with groups can't be merged, their numbering would change,
+        # nor patterns with inline global flags, which only apply to themselves
+        if mode == 'any' and len(regexes) > 1 and not any(
+                r.groups or r.flags != _DEFAULT_REGEX_FLAGS for r in regexes):
+            try:
+                search = re.compile('|'.join('(?:{})'.format(r.pattern) for r in regexes)).search
+            except re.error:
+                pass
+            else:
+                return lambda name: search(name) is not None
+        matches = tuple(r.search for r in regexes)
+
+    if len(matches) == 1:
+        match = matches[0]
+        return lambda name: match(name) is not None
+
+    function = _check_funcs[mode]
+    return lambda name: function(m(name) is not None for m in matches)
+
+
+class NameMatcher(object):
+    """Filter on file and folder names, compiled once and reusable.
+
+    Parameters
+    ----------
+    strings_to_contain : (str, list)
+        patterns which the folder and file names need to contain,
+        by default ['']
+
+    mode : str, optional
+        'any' - only one element of 'strings_to_contain' has to be present
+        'all' - all elements of 'strings_to_contain' have to be present,
+            by default 'any'
+
+    pattern_type : str, optional
+        'substring' - the patterns are plain strings contained in the names
+        'glob' - the patterns are shell-style wildcards matching the whole names
+        'regex' - the patterns are regular expressions searched in the names,
+            by default 'substring'
+
+    exclude : (str, list), optional
+        patterns of the same type, names matching any of them are rejected,
+        by default None
+
+    Example
+    -------
+    >>> matcher = NameMatcher(['.jpg', '.png'], exclude='thumb')
+    >>> matcher('photo.jpg'), matcher('photo_thumb.jpg')
+    (True, False)
+    """
+    def __init__(self, strings_to_contain=[''], mode='any',
+                 pattern_type='substring', exclude=None):
+        if isinstance(strings_to_contain, str):
+            strings_to_contain = [strings_to_contain]
+        if isinstance(exclude, str):
+            exclude = [exclude]
+        if mode not in _check_funcs:
+            raise ValueError('mode must be one of {}, not {!r}'.format(
+                tuple(_check_funcs), mode))
+        if pattern_type not in _PATTERN_TYPES:
+            raise ValueError('pattern_type must be one of {}, not {!r}'.format(
+                _PATTERN_TYPES, pattern_type))
+        self.patterns = tuple(strings_to_contain)
+        self.mode = mode
+        self.pattern_type = pattern_type
+        self.exclude = tuple(exclude) if exclude else ()
+
+        include = _compile_patterns(self.patterns, mode, pattern_type)
+        excluded = _compile_patterns(self.exclude, 'any', pattern_type) \
+            if self.exclude else False
+        if excluded is None:
+            # Everything is excluded
+            self.match = lambda name: False
+        elif excluded is False:
+            self.match = include
+        elif include is None:
+            self.match = lambda name: not excluded(name)
+        else:
+            self.match = lambda name: include(name) and not excluded(name)
+
+    @property
+    def matches_everything(self):
+        """True if the matcher does not filter out any name."""
+        return self.match is None
+
+    def __call__(self, name):
+        return self.match is None or self.match(name)
+
+    def filter(self, names):
+        """Yields the names which match."""
+        if self.match is None:
+            return iter(names)
+        return filter(self.match, names)
+
+
+def _get_matcher(strings_to_contain, mode, pattern_type='substring', exclude=None):
+    """Returns the name matching function, None if every name matches."""
+    if isinstance(strings_to_contain, NameMatcher):
+        return strings_to_contain.match
+    return NameMatcher(strings_to_contain, mode, pattern_type, exclude).match
+
+
+def _entry_kind_check(kind):
+    """Returns a predicate telling if a DirEntry is of the demanded kind.
+
+    The type information cached on the DirEntry by os.scandir is used,
+    so no additional stat call is needed on most platforms.
+    """
+    if kind not in _KINDS:
+        raise ValueError('kind must be one of {}, not {!r}'.format(_KINDS, kind))
+    if kind == 'file':
+        return lambda entry: entry.is_file()
+    if kind == 'dir':
+        return lambda entry: entry.is_dir()
+    return None
+
+
+def _scan_directory(path, descend, name_matches, kind_matches, follow_symlinks):
+    """Lists one directory with os.scandir.
+
+    Returns the paths of the entries which follow the requirements and the
+    paths of the sub folders to walk through when descend is True.
+    """
+    matches = []
+    sub_folders = []
+    with os.scandir(path) as entries:
+        for entry in entries:
+            if (kind_matches is None or kind_matches(entry)) \
+                    and (name_matches is None or name_matches(entry.name)):
+                matches.append(entry.path)
+            if descend:
+                try:
+                    is_dir = entry.is_dir(follow_symlinks=follow_symlinks)
+                except OSError:
+                    is_dir = False
+                if is_dir:
+                    sub_folders.append(entry.path)
+    return matches, sub_folders
+
+
+# Flags describing the type of a cached entry
+_IS_FILE = 1
+_IS_DIR = 2
+_IS_SYMLINK = 4
+
+_KIND_FLAGS = {
+    'any': None,
+    'file': _IS_FILE,
+    'dir': _IS_DIR,
+}
+
+# Listings of folders modified less than this before being read are not
+# cached, a modification within the same mtime tick would go unnoticed
+_RACY_DELAY_NS = 2 * 10**9
+
+
+def _entry_flags(entry):
+    """Returns the type flags of a DirEntry."""
+    flags = 0
+    try:
+        if entry.is_file():
+            flags |= _IS_FILE
+        if entry.is_dir():
+            flags |= _IS_DIR
+        if entry.is_symlink():
+            flags |= _IS_SYMLINK
+    except OSError:
+        pass
+    return flags
+
+
+class ListingCache(object):
+    """Cache of directory listings, invalidated by the directory's mtime.
+
+    Each cached listing holds the names and types of the entries of a
+    directory along with the directory's st_mtime_ns. A listing is reused
+    after a single stat call on the directory showing an unchanged mtime,
+    otherwise the directory is listed again with os.scandir.
+
+    Adding, removing or renaming an entry changes the mtime of its directory,
+    modifying the content of a file or the target of a symbolic link does not.
+
+    Parameters
+    ----------
+    max_entries : int, optional
+        maximum number of entries (files and folders) kept in memory over all
+        cached directories, the least recently used directories being evicted
+        first, by default 1000000
+
+    path : str, optional
+        path of a SQLite file in which the listings are persisted, so they can
+        be reused by later runs. They are written on save() or close(),
+        by default None (the cache only lives in memory)
+
+    Example
+    -------
+    >>> with ListingCache(path='listings.sqlite') as cache:
+    ...     files = list_files(directory, recursive=True, cache=cache)
+    """
+    def __init__(self, max_entries=1000000, path=None):
+        self.max_entries = max_entries
+        self.path = path
+        self.hits = 0
+        self.misses = 0
+        self._listings = OrderedDict()
+        self._nb_entries = 0
+        self._lock = threading.Lock()
+        self._db = None
+        if path is not None:
+            directory = os.path.dirname(path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self._db = sqlite3.connect(path, check_same_thread=False)
+            self._db.execute('CREATE TABLE IF NOT EXISTS listings ('
+                             'path TEXT PRIMARY KEY, mtime_ns INTEGER, '
+                             'names BLOB, flags BLOB)')
+
+    def listing(self, directory):
+        """Returns the entries of the directory as a tuple of (name, flags)."""
+        key = os.path.abspath(directory)
+        mtime_ns = os.stat(key).st_mtime_ns
+        with self._lock:
+            cached = self._listings.get(key)
+            if cached is None and self._db is not None:
+                cached = self._load(key)
+            if cached is not None and cached[0] == mtime_ns:
+                self.hits += 1
+                self._store(key, cached, persist=False)
+                return cached[1]
+            self.misses += 1
+
+        with os.scandir(key) as entries:
+            listing = tuple((entry.name, _entry_flags(entry)) for entry in entries)
+        if time.time_ns() - mtime_ns > _RACY_DELAY_NS:
+            with self._lock:
+                self._store(key, (mtime_ns, listing), persist=True)
+        return listing
+
+    def invalidate(self, directory=None):
+        """Forgets the listing of the directory, or all listings if None."""
+        with self._lock:
+            if directory is None:
+                self._listings.clear()
+                self._nb_entries = 0
+                if self._db is not None:
+                    self._db.execute('DELETE FROM listings')
+                return
+            key = os.path.abspath(directory)
+            cached = self._listings.pop(key, None)
+            if cached is not None:
+                self._nb_entries -= len(cached[1])
+            if self._db is not None:
+                self._db.execute('DELETE FROM listings WHERE path = ?', (key,))
+
+    def _store(self, key, cached, persist):
+        """Stores a listing as the most recently used one and evicts the oldest."""
+        previous = self._listings.pop(key, None)
+        if previous is not None:
+            self._nb_entries -= len(previous[1])
+        self._listings[key] = cached
+        self._nb_entries += len(cached[1])
+        while self._nb_entries > self.max_entries and len(self._listings) > 1:
+            _, evicted = self._listings.popitem(last=False)
+            self._nb_entries -= len(evicted[1])
+        if persist and self._db is not None:
+            mtime_ns, listing = cached
+            names = '\0'.join(name for name, _ in listing)
+            self._db.execute('INSERT OR REPLACE INTO listings VALUES (?, ?, ?, ?)',
+                             (key, mtime_ns, names.encode('utf-8', 'surrogateescape'),
+                              bytes(flags for _, flags in listing)))
+
+    def _load(self, key):
+        """Reads a listing from the SQLite file."""
+        row = self._db.execute('SELECT mtime_ns, names, flags FROM listings '
+                               'WHERE path = ?', (key,)).fetchone()
+        if row is None:
+            return None
+        mtime_ns, names, flags = row
+        if not flags:
+            return mtime_ns, ()
+        names = bytes(names).decode('utf-8', 'surrogateescape').split('\0')
+        return mtime_ns, tuple(zip(names, flags))
+
+    def save(self):
+        """Writes the listings to the SQLite file."""
+        if self._db is not None:
+            with self._lock:
+                self._db.commit()
+
+    def close(self):
+        """Saves and closes the SQLite file."""
+        if self._db is not None:
+            self.save()
+            self._db.close()
+            self._db = None
+
+    def __len__(self):
+        return len(self._listings)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def _scan_cached(path, descend, name_matches, kind_flag, follow_symlinks, cache):
+    """Same as _scan_directory, reading the listing from a ListingCache."""
+    matches = []
+    sub_folders = []
+    for name, flags in cache.listing(path):
+        if (kind_flag is None or flags & kind_flag) \
+                and (name_matches is None or name_matches(name)):
+            matches.append(os.path.join(path, name))
+        if descend and flags & _IS_DIR \
+                and (follow_symlinks or not flags & _IS_SYMLINK):
+            sub_folders.append(os.path.join(path, name))
+    return matches, sub_folders
+
+
+def _walk(directory, scan, max_depth, onerror):
+    """Walks through the directory in the calling thread."""
+    # Stack of (path, depth) still to be listed
+    stack = [(directory, 0)]
+    while stack:
+        path, depth = stack.pop()
+        try:
+            matches, sub_folders = scan(path, max_depth is None or depth < max_depth)
+        except OSError as error:
+            # The requested directory itself has to be readable
+            if depth == 0:
+                raise
+            if onerror is not None:
+                onerror(error)
+            continue
+        yield from matches
+        # Reversed so the sub folders are listed in scandir order
+        stack.extend((sub_folder, depth + 1) for sub_folder in reversed(sub_folders))
+
+
+def _walk_parallel(directory, scan, max_depth, onerror, workers, ordered):
+    """Walks through the directory with a pool of threads.
+
+    The listings are submitted to the pool by the calling thread, which
+    consumes the results either in the order of _walk or as soon as they are
+    available. Up to 'workers' folders are read at the same time, and at most
+    twice as many are submitted or listed but not consumed yet, so the walk
+    doesn't run ahead of the caller.
+    """
+    stop = threading.Event()
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=workers)
+    max_ahead = 2 * workers
+
+    def task(path, depth):
+        if stop.is_set():
+            return [], [], None
+        try:
+            matches, sub_folders = scan(path, max_depth is None or depth < max_depth)
+        except OSError as error:
+            if depth == 0:
+                raise
+            return [], [], error
+        return matches, [(sub_folder, depth + 1) for sub_folder in sub_folders], None
+
+    try:
+        if ordered:
+            # Stack of [path, depth, future], the future being None until submitted
+            stack = [[directory, 0, None]]
+            submitted = 0
+            while stack:
+                # The folders on top of the stack are the next ones consumed
+                for entry in reversed(stack):
+                    if submitted >= max_ahead:
+                        break
+                    if entry[2] is None:
+                        entry[2] = executor.submit(task, entry[0], entry[1])
+                        submitted += 1
+                path, depth, future = stack.pop()
+                matches, children, error = future.result()
+                submitted -= 1
+                if error is not None and onerror is not None:
+                    onerror(error)
+                yield from matches
+                stack.extend([child, child_depth, None]
+                             for child, child_depth in reversed(children))
+        else:
+            waiting = deque([(directory, 0)])
+            pending = set()
+            while waiting or pending:
+                while waiting and len(pending) < max_ahead:
+                    pending.add(executor.submit(task, *waiting.popleft()))
+                done, pending = concurrent.futures.wait(
+                    pending, return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in done:
+                    matches, children, error = future.result()
+                    if error is not None and onerror is not None:
+                        onerror(error)
+                    yield from matches
+                    waiting.extend(children)
+    finally:
+        # Also reached when the caller stops iterating early
+        stop.set()
+        executor.shutdown(wait=False)
+
+
+def iter_directory(directory, strings_to_contain=[''], mode='any', *,
+                   pattern_type='substring', exclude=None,
+                   kind='any', recursive=False, max_depth=None,
+                   follow_symlinks=False, onerror=None,
+                   workers=None, ordered=True, cache=None):
+    """Yields the paths of the files and folders in the directory which contain the demanded strings.
+
+    The directory is read with os.scandir and the paths are yielded lazily,
+    one directory listing at a time.
+
+    Parameters
+    ----------
+    directory : str
+        path of the directory
+
+    strings_to_contain : (str, list, NameMatcher)
+        strings which the folder and file names need to contain,
+        or an already compiled NameMatcher, by default ['']
+
+    mode : str, optional
+        'any' - only one element of 'strings_to_contain' has to be present
+        'all' - all elements of 'strings_to_contain' have to be present,
+            by default 'any'
+
+    pattern_type : str, optional
+        'substring', 'glob' or 'regex', see NameMatcher, by default 'substring'
+
+    exclude : (str, list), optional
+        patterns rejecting the names matching any of them, by default None
+
+    kind : str, optional
+        'any' - files and folders are yielded
+        'file' - only files are yielded
+        'dir' - only folders are yielded,
+            by default 'any'
+
+    recursive : bool, optional
+        walk through the sub folders as well, by default False
+
+    max_depth : int, optional
+        maximum depth of the walk when recursive, 0 being the directory itself,
+        by default None (no limit)
+
+    follow_symlinks : bool, optional
+        walk into symbolic links pointing to folders when recursive,
+        by default False
+
+    onerror : function, optional
+        called with the OSError raised when a sub folder can't be read,
+        by default None (the sub folder is skipped)
+
+    workers : int, optional
+        number of threads listing the sub folders in parallel when recursive.
+        Useful on network file systems where each listing waits on the network,
+        by default None (the walk is done in the calling thread)
+
+    ordered : bool, optional
+        with workers, yield the paths in the same order as the walk without
+        workers. If False, the paths of a folder are yielded as soon as it is
+        listed, by default True
+
+    cache : ListingCache, optional
+        cache in which the listings are looked up before reading the folders,
+        by default None
+
+    Yields
+    ------
+    str
+        path of a file or folder which follows the requirements.
+    """
+    name_matches = _get_matcher(strings_to_contain, mode, pattern_type, exclude)
+    kind_matches = _entry_kind_check(kind)
+    if not recursive:
+        max_depth = 0
+    if cache is None:
+        scan = partial(_scan_directory, name_matches=name_matches,
+                       kind_matches=kind_matches, follow_symlinks=follow_symlinks)
+    else:
+        scan = partial(_scan_cached, name_matches=name_matches,
+                       kind_flag=_KIND_FLAGS[kind], follow_symlinks=follow_symlinks,
+                       cache=cache)
+
+    if workers is not None and workers > 1 and max_depth != 0:
+        return _walk_parallel(directory, scan, max_depth, onerror, workers, ordered)
+    return _walk(directory, scan, max_depth, onerror)
+
+
+def list_directory(directory, strings_to_contain=[''], mode='any', *,
+                   recursive=False, pattern_type='substring', exclude=None, workers=None,
+                   cache=None):
     """Returns all file and folders in the directory which contain the demanded strings.
 
     Parameters
@@ -18,29 +605,44 @@ def list_directory(directory, strings_to_contain=[''], mode='any'):
     directory : str
         path of the directory
 
-    strings_to_contain : (str, list)
+    strings_to_contain : (str, list, NameMatcher)
         strings which the folder and file names need to contain,
-        by default ['']
+        or an already compiled NameMatcher, by default ['']
 
     mode : str, optional
         'any' - only one element of 'strings_to_contain' has to be present
         'all' - all elements of 'strings_to_contain' have to be present,
             by default 'any'
 
+    recursive : bool, optional
+        list the content of the sub folders as well, by default False
+
+    pattern_type : str, optional
+        'substring', 'glob' or 'regex', see NameMatcher, by default 'substring'
+
+    exclude : (str, list), optional
+        patterns rejecting the names matching any of them, by default None
+
+    workers : int, optional
+        number of threads listing the sub folders in parallel when recursive,
+        by default None
+
+    cache : ListingCache, optional
+        cache in which the listings are looked up, by default None
+
     Returns
     -------
     list
         list of the paths of the files and folders in the directory which follow the requirements.
     """
-
-    if isinstance(strings_to_contain, str):
-        strings_to_contain = [strings_to_contain]
-    function = _check_funcs[mode]
-    return [os.path.join(directory, f) for f in os.listdir(directory)
-            if function(x in f for x in strings_to_contain)]
+    return list(iter_directory(directory, strings_to_contain, mode,
+                               recursive=recursive, pattern_type=pattern_type,
+                               exclude=exclude, workers=workers, cache=cache))
 
 
-def list_folders(directory, strings_to_contain=[''], mode='any'):
+def list_folders(directory, strings_to_contain=[''], mode='any', *,
+                 recursive=False, pattern_type='substring', exclude=None, workers=None,
+                 cache=None):
     """Returns all folders in the directory which contain the demanded strings.
 
     Parameters
@@ -48,47 +650,454 @@ def list_folders(directory, strings_to_contain=[''], mode='any'):
     directory : str
         path of the directory
 
-    strings_to_contain : (str, list)
+    strings_to_contain : (str, list, NameMatcher)
         strings which the folder and file names need to contain,
-        by default ['']
+        or an already compiled NameMatcher, by default ['']
 
     mode : str, optional
         'any' - only one element of 'strings_to_contain' has to be present
         'all' - all elements of 'strings_to_contain' have to be present,
             by default 'any'
 
+    recursive : bool, optional
+        list the folders inside the sub folders as well, by default False
+
+    pattern_type : str, optional
+        'substring', 'glob' or 'regex', see NameMatcher, by default 'substring'
+
+    exclude : (str, list), optional
+        patterns rejecting the names matching any of them, by default None
+
+    workers : int, optional
+        number of threads listing the sub folders in parallel when recursive,
+        by default None
+
+    cache : ListingCache, optional
+        cache in which the listings are looked up, by default None
+
     Returns
     -------
     list
         list of the paths of the folders in the directory which follow the requirements.
     """
-    dir_list = list_directory(directory, strings_to_contain, mode)
-
-    return [f for f in dir_list if os.path.isdir(f)]
+    return list(iter_directory(directory, strings_to_contain, mode,
+                               kind='dir', recursive=recursive,
+                               pattern_type=pattern_type, exclude=exclude,
+                               workers=workers, cache=cache))
 
 
-def list_files(directory, strings_to_contain=[''], mode='any'):
-    """Returns all folders in the directory which contain the demanded strings.
+def list_files(directory, strings_to_contain=[''], mode='any', *,
+               recursive=False, pattern_type='substring', exclude=None, workers=None,
+               cache=None):
+    """Returns all files in the directory which contain the demanded strings.
 
     Parameters
     ----------
     directory : str
         path of the directory
 
-    strings_to_contain : (str, list)
+    strings_to_contain : (str, list, NameMatcher)
         strings which the folder and file names need to contain,
-        by default ['']
+        or an already compiled NameMatcher, by default ['']
 
     mode : str, optional
         'any' - only one element of 'strings_to_contain' has to be present
         'all' - all elements of 'strings_to_contain' have to be present,
             by default 'any'
 
+    recursive : bool, optional
+        list the files inside the sub folders as well, by default False
+
+    pattern_type : str, optional
+        'substring', 'glob' or 'regex', see NameMatcher, by default 'substring'
+
+    exclude : (str, list), optional
+        patterns rejecting the names matching any of them, by default None
+
+    workers : int, optional
+        number of threads listing the sub folders in parallel when recursive,
+        by default None
+
+    cache : ListingCache, optional
+        cache in which the listings are looked up, by default None
+
     Returns
     -------
     list
-        list of the paths of the folders in the directory which follow the requirements.
+        list of the paths of the files in the directory which follow the requirements.
+    """
+    return list(iter_directory(directory, strings_to_contain, mode,
+                               kind='file', recursive=recursive,
+                               pattern_type=pattern_type, exclude=exclude,
+                               workers=workers, cache=cache))
+
+
+Change = namedtuple('Change', ['status', 'path'])
+Change.__doc__ = """Change found by diff: status is 'added', 'removed' or 'modified'."""
+
+
+class Snapshot(object):
+    """State of the files and folders of a directory, created by snapshot().
+
+    For every walked folder its st_mtime_ns, the names of its entries which
+    follow the requirements and the names of its sub folders are recorded.
+    For every entry which follows the requirements its size, st_mtime_ns and
+    inode are recorded.
+
+    Snapshots can be pickled to be reused by a later run.
     """
-    dir_list = list_directory(directory, strings_to_contain, mode)
+    def __init__(self, directory, strings_to_contain=[''], mode='any',
+                 pattern_type='substring', exclude=None, kind='any',
+                 recursive=True, follow_symlinks=False):
+        if isinstance(strings_to_contain, NameMatcher):
+            matcher = strings_to_contain
+            strings_to_contain, mode = matcher.patterns, matcher.mode
+            pattern_type, exclude = matcher.pattern_type, matcher.exclude
+        _entry_kind_check(kind)
+        self.directory = directory
+        self.filters = (strings_to_contain, mode, pattern_type, exclude)
+        self.kind = kind
+        self.recursive = recursive
+        self.follow_symlinks = follow_symlinks
+        # path -> (mtime_ns, names of the matching entries, names of the sub folders)
+        self.folders = {}
+        # path -> (size, mtime_ns, inode)
+        self.entries = {}
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, path):
+        return path in self.entries
+
+    def paths(self):
+        """Returns the paths of the recorded entries."""
+        return list(self.entries)
+
+
+def _entry_record(stat_result):
+    return stat_result.st_size, stat_result.st_mtime_ns, stat_result.st_ino
+
+
+def _removed_folder(snapshot, folder, forget):
+    """Yields the entries recorded below a folder which has been removed.
+
+    With forget, the records of the folder and its sub folders are dropped.
+    """
+    stack = [folder]
+    while stack:
+        path = stack.pop()
+        record = snapshot.folders.pop(path, None) if forget \
+            else snapshot.folders.get(path)
+        if record is None:
+            continue
+        _, names, sub_folders = record
+        for name in names:
+            yield os.path.join(path, name)
+        stack.extend(os.path.join(path, name) for name in sub_folders)
+
+
+def diff(old_snapshot, directory=None, check_files=False, update=False):
+    """Yields the changes of a directory since a snapshot has been taken.
+
+    Only the folders whose st_mtime_ns changed are listed again, the other
+    ones cost a single stat call. Adding, removing or renaming an entry changes
+    the mtime of its folder, modifying a file does not: the entries of
+    unchanged folders are only checked for modifications with check_files.
+
+    Parameters
+    ----------
+    old_snapshot : Snapshot
+        snapshot the directory is compared to
+
+    directory : str, optional
+        directory to compare, by default the directory of the snapshot
+
+    check_files : bool, optional
+        also stat the entries of unchanged folders to find modified files,
+        by default False
+
+    update : bool, optional
+        update the snapshot with the changes while they are yielded, so it
+        can be passed to the next call, by default False
+
+    Yields
+    ------
+    Change
+        (status, path) with status being 'added', 'removed' or 'modified'.
+
+    Example
+    -------
+    >>> state = snapshot(directory, '.csv', kind='file')
+    >>> while True:
+    ...     for status, path in diff(state, update=True):
+    ...         print(status, path)
+    ...     time.sleep(10)
+    """
+    if directory is None:
+        directory = old_snapshot.directory
+    name_matches = _get_matcher(*old_snapshot.filters)
+    kind_matches = _entry_kind_check(old_snapshot.kind)
+    follow_symlinks = old_snapshot.follow_symlinks
+    old_folders = old_snapshot.folders
+    old_entries = old_snapshot.entries
+
+    stack = [directory]
+    while stack:
+        folder = stack.pop()
+        old_folder = old_folders.get(folder)
+        try:
+            mtime_ns = os.stat(folder).st_mtime_ns
+        except OSError:
+            # The requested directory itself has to be readable
+            if folder == directory:
+                raise
+            continue
+        descend = old_snapshot.recursive
+
+        if old_folder is not None and old_folder[0] == mtime_ns:
+            _, names, sub_folders = old_folder
+            if check_files:
+                for name in names:
+                    path = os.path.join(folder, name)
+                    try:
+                        record = _entry_record(os.stat(path, follow_symlinks=False))
+                    except OSError:
+                        # Removed meanwhile, seen by the next diff
+                        continue
+                    if record != old_entries.get(path):
+                        if update:
+                            old_entries[path] = record
+                        yield Change('modified', path)
+            stack.extend(os.path.join(folder, name) for name in reversed(sub_folders))
+            continue
+
+        names = []
+        sub_folders = []
+        records = {}
+        with os.scandir(folder) as entries:
+            for entry in entries:
+                if (kind_matches is None or kind_matches(entry)) \
+                        and (name_matches is None or name_matches(entry.name)):
+                    try:
+                        records[entry.path] = _entry_record(entry.stat(follow_symlinks=False))
+                    except OSError:
+                        continue
+                    names.append(entry.name)
+                if descend:
+                    try:
+                        is_dir = entry.is_dir(follow_symlinks=follow_symlinks)
+                    except OSError:
+                        is_dir = False
+                    if is_dir:
+                        sub_folders.append(entry.name)
+
+        old_names, old_sub_folders = (), ()
+        if old_folder is not None:
+            _, old_names, old_sub_folders = old_folder
+        for name in old_names:
+            path = os.path.join(folder, name)
+            if path not in records:
+                if update:
+                    old_entries.pop(path, None)
+                yield Change('removed', path)
+        for path, record in records.items():
+            old_record = old_entries.get(path)
+            if old_record != record:
+                if update:
+                    old_entries[path] = record
+                yield Change('added' if old_record is None else 'modified', path)
+
+        for name in set(old_sub_folders).difference(sub_folders):
+            for path in _removed_folder(old_snapshot, os.path.join(folder, name), update):
+                if update:
+                    old_entries.pop(path, None)
+                yield Change('removed', path)
+        if update:
+            if time.time_ns() - mtime_ns < _RACY_DELAY_NS:
+                # Listed again by the next diff, see ListingCache
+                mtime_ns = None
+            old_folders[folder] = (mtime_ns, tuple(names), tuple(sub_folders))
+        stack.extend(os.path.join(folder, name) for name in reversed(sub_folders))
+
+
+def snapshot(directory, strings_to_contain=[''], mode='any', *,
+             recursive=True, pattern_type='substring', exclude=None, kind='any',
+             follow_symlinks=False):
+    """Records the state of the files and folders in the directory which contain the demanded strings.
+
+    The snapshot is meant to be passed to diff() later on.
 
-    return [f for f in dir_list if os.path.isfile(f)]
+    Parameters
+    ----------
+    directory : str
+        path of the directory
+
+    strings_to_contain : (str, list, NameMatcher)
+        strings which the folder and file names need to contain,
+        or an already compiled NameMatcher, by default ['']
+
+    mode : str, optional
+        'any' - only one element of 'strings_to_contain' has to be present
+        'all' - all elements of 'strings_to_contain' have to be present,
+            by default 'any'
+
+    recursive : bool, optional
+        record the content of the sub folders as well, by default True
+
+    pattern_type : str, optional
+        'substring', 'glob' or 'regex', see NameMatcher, by default 'substring'
+
+    exclude : (str, list), optional
+        patterns rejecting the names matching any of them, by default None
+
+    kind : str, optional
+        'any', 'file' or 'dir', see iter_directory, by default 'any'
+
+    follow_symlinks : bool, optional
+        walk into symbolic links pointing to folders, by default False
+
+    Returns
+    -------
+    Snapshot
+        the recorded state of the directory.
+    """
+    state = Snapshot(directory, strings_to_contain, mode, pattern_type, exclude,
+                     kind, recursive, follow_symlinks)
+    for _ in diff(state, update=True):
+        pass
+    return state
+
+
+# Pool of the threads reading the folders for the async functions
+_async_executor = None
+_async_executor_lock = threading.Lock()
+
+
+def _get_async_executor():
+    global _async_executor
+    with _async_executor_lock:
+        if _async_executor is None:
+            _async_executor = concurrent.futures.ThreadPoolExecutor(
+                thread_name_prefix='os_utils')
+        return _async_executor
+
+
+def _next_chunk(walker, chunk_size):
+    return list(islice(walker, chunk_size))
+
+
+async def aiter_directory(directory, strings_to_contain=[''], mode='any', *,
+                          chunk_size=1000, chunked=False, executor=None, **kwargs):
+    """Asynchronous version of iter_directory.
+
+    The paths are read by iter_directory in a thread, chunk_size paths at a
+    time, so the event loop is never blocked by the file system. Cancelling
+    the task consuming the paths stops the walk once the chunk being read is
+    done.
+
+    Parameters
+    ----------
+    directory : str
+        path of the directory
+
+    strings_to_contain : (str, list, NameMatcher)
+        strings which the folder and file names need to contain,
+        or an already compiled NameMatcher, by default ['']
+
+    mode : str, optional
+        'any' - only one element of 'strings_to_contain' has to be present
+        'all' - all elements of 'strings_to_contain' have to be present,
+            by default 'any'
+
+    chunk_size : int, optional
+        number of paths read per call to the thread, by default 1000
+
+    chunked : bool, optional
+        yield lists of paths instead of single paths, by default False
+
+    executor : concurrent.futures.Executor, optional
+        executor reading the paths, by default a thread pool shared by the
+        asynchronous functions of this module
+
+    kwargs : optional
+        other arguments of iter_directory (recursive, kind, workers, cache, ...)
+
+    Yields
+    ------
+    str
+        path of a file or folder which follows the requirements,
+        or a list of them if chunked.
+    """
+    walker = iter_directory(directory, strings_to_contain, mode, **kwargs)
+    if executor is None:
+        executor = _get_async_executor()
+    future = None
+    try:
+        while True:
+            future = executor.submit(_next_chunk, walker, chunk_size)
+            chunk = await asyncio.wrap_future(future)
+            if not chunk:
+                return
+            if chunked:
+                yield chunk
+            else:
+                for path in chunk:
+                    yield path
+    finally:
+        # The walker can't be closed while a thread is reading from it
+        if future is None or future.cancel() or future.done():
+            walker.close()
+        else:
+            future.add_done_callback(lambda _: walker.close())
+
+
+async def alist_directory(directory, strings_to_contain=[''], mode='any', *,
+                          recursive=False, pattern_type='substring', exclude=None, workers=None,
+                          cache=None, chunk_size=1000, executor=None):
+    """Asynchronous version of list_directory.
+
+    See aiter_directory for chunk_size and executor.
+    """
+    paths = []
+    async for chunk in aiter_directory(directory, strings_to_contain, mode,
+                                       chunk_size=chunk_size, chunked=True, executor=executor,
+                                       pattern_type=pattern_type, exclude=exclude,
+                                       recursive=recursive, workers=workers,
+                                       cache=cache):
+        paths.extend(chunk)
+    return paths
+
+
+async def alist_folders(directory, strings_to_contain=[''], mode='any', *,
+                        recursive=False, pattern_type='substring', exclude=None, workers=None,
+                        cache=None, chunk_size=1000, executor=None):
+    """Asynchronous version of list_folders.
+
+    See aiter_directory for chunk_size and executor.
+    """
+    paths = []
+    async for chunk in aiter_directory(directory, strings_to_contain, mode,
+                                       chunk_size=chunk_size, chunked=True, executor=executor,
+                                       kind='dir', pattern_type=pattern_type, exclude=exclude,
+                                       recursive=recursive, workers=workers,
+                                       cache=cache):
+        paths.extend(chunk)
+    return paths
+
+
+async def alist_files(directory, strings_to_contain=[''], mode='any', *,
+                      recursive=False, pattern_type='substring', exclude=None, workers=None,
+                      cache=None, chunk_size=1000, executor=None):
+    """Asynchronous version of list_files.
+
+    See aiter_directory for chunk_size and executor.
+    """
+    paths = []
+    async for chunk in aiter_directory(directory, strings_to_contain, mode,
+                                       chunk_size=chunk_size, chunked=True, executor=executor,
+                                       kind='file', pattern_type=pattern_type, exclude=exclude,
+                                       recursive=recursive, workers=workers,
+                                       cache=cache):
+        paths.extend(chunk)
+    return paths
@@ -0,0 +1,208 @@
+"""Sampling profiler for live processes.
+
+A thread of the profiler samples the stacks of the other threads at regular
+intervals, with sys._current_frames, so the profiled code is not slowed down
+by every call as with deterministic profilers. By default only the samples
+of the stacks going through a function marked with profile_target are kept:
+
+>>> @profile_target
+... def handle(request):
+...     ...
+>>> with SamplingProfiler(interval=0.005) as profiler:
+...     serve()
+>>> profiler.write('handle.folded')
+
+The profiler of a running process can also be started and stopped by a
+signal, see install_signal_handler.
+"""
+import inspect
+import os
+import signal
+import sys
+import threading
+import time
+
+__all__ = [
+    'profile_target',
+    'SamplingProfiler',
+    'get_profiler',
+    'install_signal_handler',
+]
+
+# Code objects of the functions marked by profile_target
+_target_codes = set()
+
+
+def profile_target(func):
+    """Marks a function so the samples of the stacks going through it are
+    kept by the SamplingProfiler.
+
+    The function itself is returned, so its calls cost nothing more. The
+    functions wrapped by other decorators, and the functions of class and
+    static methods, are marked instead of their wrappers.
+    """
+    _target_codes.add(inspect.unwrap(getattr(func, '__func__', func)).__code__)
+    return func
+
+
+def _frame_label(frame):
+    code = frame.f_code
+    return '{}:{}'.format(frame.f_globals.get('__name__', '?'),
+                          getattr(code, 'co_qualname', code.co_name))
+
+
+class SamplingProfiler(object):
+    """Samples the stacks of the threads of the process from a thread of its own.
+
+    The samples are aggregated by stack, from the outermost function marked
+    with profile_target, and counted by marked function, every marked
+    function on the stack of a sample getting the sample.
+
+    Parameters
+    ----------
+    interval : float, optional
+        time between two samples in seconds, by default 0.01
+
+    targets_only : bool, optional
+        only keep the samples of the stacks going through a function marked
+        with profile_target, by default True
+    """
+    def __init__(self, interval=0.01, targets_only=True):
+        self.interval = interval
+        self.targets_only = targets_only
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self.reset()
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def reset(self):
+        with self._lock:
+            self.samples = 0
+            self._stacks = {}
+            self._targets = {}
+
+    def start(self):
+        """Starts sampling, in a daemon thread."""
+        if self.running:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='sampling-profiler', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stops sampling, the samples are kept."""
+        thread, self._thread = self._thread, None
+        if thread is not None:
+            self._stop.set()
+            thread.join()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def _run(self):
+        own_thread = threading.get_ident()
+        next_sample = time.monotonic()
+        while not self._stop.is_set():
+            self.sample(own_thread)
+            next_sample += self.interval
+            self._stop.wait(max(0, next_sample - time.monotonic()))
+
+    def sample(self, ignored_thread=None):
+        """Records the stacks of the threads of the process but ignored_thread."""
+        for thread_id, frame in sys._current_frames().items():
+            if thread_id == ignored_thread:
+                continue
+            frames = []
+            while frame is not None:
+                frames.append(frame)
+                frame = frame.f_back
+            frames.reverse()
+            targets = [i for i, frame in enumerate(frames) if frame.f_code in _target_codes]
+            if self.targets_only and not targets:
+                continue
+            start = targets[0] if targets else 0
+            stack = tuple(_frame_label(frame) for frame in frames[start:])
+            target_labels = {stack[i - start] for i in targets}
+            with self._lock:
+                self.samples += 1
+                self._stacks[stack] = self._stacks.get(stack, 0) + 1
+                for label in target_labels:
+                    self._targets[label] = self._targets.get(label, 0) + 1
+
+    def stacks(self):
+        """Returns the number of samples of each stack, from the outermost function."""
+        with self._lock:
+            return dict(self._stacks)
+
+    def target_samples(self):
+        """Returns the number of samples going through each marked function."""
+        with self._lock:
+            return dict(self._targets)
+
+    def collapsed_stacks(self):
+        """Returns the samples in the collapsed stack format of flamegraph.pl and speedscope."""
+        return ''.join('{} {}\n'.format(';'.join(stack), count)
+                       for stack, count in sorted(self.stacks().items()))
+
+    def write(self, filepath):
+        """Writes the samples to filepath in the collapsed stack format."""
+        directory = os.path.dirname(filepath)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(filepath, 'w') as file:
+            file.write(self.collapsed_stacks())
+
+
+_profiler = None
+_profiler_lock = threading.Lock()
+
+
+def get_profiler():
+    """Returns the SamplingProfiler controlled by install_signal_handler."""
+    global _profiler
+    with _profiler_lock:
+        if _profiler is None:
+            _profiler = SamplingProfiler()
+        return _profiler
+
+
+def install_signal_handler(filepath, signum=getattr(signal, 'SIGUSR2', None)):
+    """Starts and stops the profiler of get_profiler when the process
+    receives signum, for instance with `kill -USR2 <pid>`.
+
+    When the profiler is stopped, the samples are written to filepath, in
+    which '{pid}' is replaced by the id of the process, and forgotten.
+    Has to be called from the main thread.
+
+    Parameters
+    ----------
+    filepath : str
+        path of the file the samples are written to
+
+    signum : int, optional
+        the signal, by default signal.SIGUSR2
+    """
+    if signum is None:
+        raise ValueError('signum has to be given on this platform')
+
+    def toggle(received_signum, frame):
+        profiler = get_profiler()
+        if not profiler.running:
+            profiler.start()
+            return
+        # The samples are written from another thread, not to block the main thread
+        def stop_and_write():
+            profiler.stop()
+            profiler.write(filepath.format(pid=os.getpid()))
+            profiler.reset()
+        threading.Thread(target=stop_and_write, name='sampling-profiler-writer').start()
+
+    signal.signal(signum, toggle)
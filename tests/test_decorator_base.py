@@ -50,5 +50,17 @@ class TestBaseDecorator(unittest.TestCase):
         self.assertEqual(return_args_kwargs.args, (4,))
         self.assertEqual(return_args_kwargs.kwargs, {'five':5})
 
+    def test_base_decorator_method(self):
+        class Greeter:
+            def __init__(self, greeting):
+                self.greeting = greeting
+
+            @BaseDecorator
+            def greet(self, name):
+                return '{} {}'.format(self.greeting, name)
+
+        self.assertEqual(Greeter('Hello').greet('you'), 'Hello you')
+        self.assertEqual(Greeter.greet(Greeter('Hi'), 'me'), 'Hi me')
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,100 @@
+import unittest
+import asyncio
+import threading
+from code_utils.decorators.batching import batched
+from code_utils.decorators.concurrency import threaded, shutdown_pools
+
+
+class TestBatched(unittest.TestCase):
+    def tearDown(self):
+        shutdown_pools()
+
+    def test_batched(self):
+        batches = []
+
+        @batched(max_size=4, max_wait_ms=20)
+        def square_all(values):
+            batches.append(list(values))
+            return [ValueError(value) if value == 3 else value**2 for value in values]
+
+        results = threaded(square_all, max_workers=8, errors='return')(range(10))
+        self.assertEqual([r for i, r in enumerate(results) if i != 3],
+                         [i**2 for i in range(10) if i != 3])
+        self.assertIsInstance(results[3], ValueError)
+        self.assertEqual(sorted(sum(batches, [])), list(range(10)))
+        self.assertLess(len(batches), 10)
+        self.assertTrue(all(len(batch) <= 4 for batch in batches))
+        self.assertEqual(square_all.submit(5).result(), 25)
+
+        @batched
+        def wrong_length(values):
+            return []
+        with self.assertRaises(ValueError):
+            wrong_length(1)
+
+    def test_batched_cancel(self):
+        batches = []
+        started, resume = threading.Event(), threading.Event()
+
+        @batched(max_size=3, max_wait_ms=20)
+        def identity(values):
+            batches.append(list(values))
+            started.set()
+            resume.wait(5)
+            if 'exit' in values:
+                raise SystemExit
+            return values
+
+        first = identity.submit(0)
+        started.wait(5)
+        # the next batch is collected while the first one runs
+        futures = [identity.submit(value) for value in (1, 2, 3)]
+        self.assertTrue(futures[1].cancel())
+        resume.set()
+        self.assertEqual(first.result(5), 0)
+        self.assertEqual([futures[0].result(5), futures[2].result(5)], [1, 3])
+        self.assertTrue(futures[1].cancelled())
+        self.assertEqual(batches, [[0], [1, 3]])
+
+        # the thread keeps running after any exception
+        with self.assertRaises(SystemExit):
+            identity.submit('exit').result(5)
+        self.assertEqual(identity(4), 4)
+
+    def test_batched_async(self):
+        batches = []
+
+        @batched(max_size=3, max_wait_ms=10)
+        async def square_all(values):
+            batches.append(list(values))
+            if 7 in values:
+                raise KeyError(7)
+            return [value**2 for value in values]
+
+        async def run():
+            return await asyncio.gather(*[square_all(i) for i in range(7)])
+
+        self.assertEqual(asyncio.run(run()), [i**2 for i in range(7)])
+        self.assertEqual(batches, [[0, 1, 2], [3, 4, 5], [6]])
+        with self.assertRaises(KeyError):
+            asyncio.run(square_all(7))
+
+    def test_batched_async_cancelled(self):
+        @batched(max_size=2, max_wait_ms=10)
+        async def cancelled_inside(values):
+            inner = asyncio.ensure_future(asyncio.sleep(10))
+            asyncio.get_running_loop().call_soon(inner.cancel)
+            await inner
+            return values
+
+        async def run():
+            return await asyncio.wait_for(
+                asyncio.gather(*[cancelled_inside(i) for i in range(3)], return_exceptions=True),
+                timeout=5)
+
+        results = asyncio.run(run())
+        self.assertTrue(all(isinstance(result, asyncio.CancelledError) for result in results))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,374 @@
+
+import unittest
+import asyncio
+import concurrent.futures
+import itertools
+import os
+import tempfile
+import threading
+import time
+from code_utils.decorators.concurrency import parallel, run_in_process, run_in_thread, threaded, \
+    auto_parallel, scheduled, to_thread, to_process, async_gather_map, SharedPool, get_shared_pool, \
+    get_shared_thread_pool, shutdown_pools
+
+
+def square_and_offset(value, offset=0):
+    return value**2 + offset
+
+
+def fail_on_three(value):
+    if value == 3:
+        raise ValueError(value)
+    return value
+
+
+def fail_on_first_byte_three(data, separator=b''):
+    if data[0] == 3:
+        raise ValueError(data[0])
+    return bytes(data) + bytes(separator)
+
+
+def describe_and_join(data, separator, suffix=b''):
+    return type(data).__name__, type(separator).__name__, bytes(data) + bytes(separator) + suffix
+
+
+def burn_cpu(value, duration=0.005):
+    end = time.thread_time() + duration
+    while time.thread_time() < end:
+        pass
+    return value
+
+
+def sleep_and_time(duration):
+    time.sleep(duration)
+    return time.monotonic()
+
+
+@run_in_process(nb_processes=2)
+def decorated_square(value):
+    return value**2
+
+
+@auto_parallel(nb_processes=2)
+def decorated_burn_cpu(value):
+    return burn_cpu(value, duration=0.01)
+
+
+def write_to_file(data, filepath):
+    with open(filepath, 'wb') as file:
+        file.write(type(data).__name__.encode() + data)
+
+
+def _shared_blocks():
+    return set(os.listdir('/dev/shm')) if os.path.isdir('/dev/shm') else set()
+
+
+class TestParallel(unittest.TestCase):
+    def tearDown(self):
+        shutdown_pools()
+
+    def test_parallel(self):
+        parallel_square_and_offset = parallel(square_and_offset, nb_processes=2)
+        self.assertEqual(parallel_square_and_offset(range(10), offset=3),
+                         [3, 4, 7, 12, 19, 28, 39, 52, 67, 84])
+        self.assertEqual(parallel_square_and_offset(iter([1, 2]), 1), [2, 5])
+        self.assertEqual(parallel_square_and_offset([]), [])
+        with self.assertRaises(ValueError):
+            parallel(fail_on_three, nb_processes=2, chunksize=1)(range(5))
+
+    def test_shared_pool(self):
+        pool = get_shared_pool(2).pool
+        parallel(square_and_offset, nb_processes=2)(range(3))
+        self.assertIs(get_shared_pool(2).pool, pool)
+        shutdown_pools()
+        self.assertIsNot(get_shared_pool(2).pool, pool)
+
+        with SharedPool(2) as shared_pool:
+            self.assertEqual(parallel(square_and_offset, pool=shared_pool, chunksize=2)(range(5)),
+                             [0, 1, 4, 9, 16])
+        self.assertIsNone(shared_pool._pool)
+
+    def test_stream(self):
+        stream_square = parallel(square_and_offset, nb_processes=2, stream=True, max_in_flight=2)
+        results = stream_square(itertools.count(), 1)
+        self.assertEqual(list(itertools.islice(results, 5)), [1, 2, 5, 10, 17])
+        results.close()
+
+        unordered = parallel(square_and_offset, nb_processes=2, stream=True, ordered=False,
+                             chunksize=3)
+        self.assertEqual(sorted(unordered(range(10))), [i**2 for i in range(10)])
+        for ordered in (True, False):
+            failing = parallel(fail_on_three, nb_processes=2, stream=True, ordered=ordered)
+            with self.assertRaises(ValueError):
+                list(failing(range(5)))
+
+    def test_shared_memory(self):
+        blocks = _shared_blocks()
+        big, separator = b'a' * 100, b'-' * 100
+        shared = parallel(describe_and_join, nb_processes=2, shared_memory=50)
+        results = shared([big, b'small'], separator, suffix=b'!')
+        self.assertEqual(results, [
+            ('memoryview', 'memoryview', big + separator + b'!'),
+            ('bytes', 'memoryview', b'small' + separator + b'!'),
+        ])
+        self.assertIsInstance(results[0][2], bytes)
+        # large results are sent back through shared memory
+        self.assertEqual(parallel(bytearray, nb_processes=2, shared_memory=50)([big]),
+                         [bytearray(big)])
+        streamed = parallel(describe_and_join, nb_processes=2, shared_memory=50, stream=True)
+        self.assertEqual(list(streamed(iter([bytearray(big)]), b'')),
+                         [('memoryview', 'bytes', big)])
+
+        with tempfile.TemporaryDirectory() as tmp:
+            filepath = os.path.join(tmp, 'data')
+            run_in_process(shared_memory=50)(write_to_file)(big, filepath).result()
+            with open(filepath, 'rb') as file:
+                self.assertEqual(file.read(), b'memoryview' + big)
+        # large results are sent back through shared memory
+        self.assertEqual(run_in_process(shared_memory=50)(bytes)(bytearray(big)).result(), big)
+        self.assertEqual(_shared_blocks(), blocks)
+
+    def test_shared_memory_failure(self):
+        blocks = _shared_blocks()
+        values = [bytes([value]) * 100 for value in (1, 3, 5, 7, 9)]
+        # the values after the failing one are not used by the worker of the chunk
+        failing = parallel(fail_on_first_byte_three, nb_processes=2, chunksize=4, shared_memory=10)
+        with self.assertRaises(ValueError):
+            failing(values)
+        for ordered in (True, False):
+            failing = parallel(fail_on_first_byte_three, nb_processes=2, chunksize=4,
+                               shared_memory=10, stream=True, ordered=ordered)
+            with self.assertRaises(ValueError):
+                list(failing(values, b'-' * 100))
+        with self.assertRaises(ValueError):
+            run_in_process(fail_on_first_byte_three, shared_memory=10)(values[1]).result()
+        # the chunks running when a stream is closed are removed once done
+        streamed = parallel(fail_on_first_byte_three, nb_processes=2, chunksize=1,
+                            shared_memory=10, stream=True)
+        results = streamed(values[:1] * 10)
+        self.assertEqual(next(results), values[0])
+        results.close()
+        shutdown_pools()
+        self.assertEqual(_shared_blocks(), blocks)
+
+
+class TestRunIn(unittest.TestCase):
+    def tearDown(self):
+        shutdown_pools()
+
+    def test_run_in_thread(self):
+        future = run_in_thread(square_and_offset)(3, offset=1)
+        self.assertEqual(future.result(), 10)
+        with self.assertRaises(ValueError):
+            run_in_thread(fail_on_three)(3).result()
+
+        running, peak = [0], [0]
+        lock = threading.Lock()
+
+        @run_in_thread(max_workers=8, max_concurrency=2)
+        def track(value):
+            with lock:
+                running[0] += 1
+                peak[0] = max(peak[0], running[0])
+            time.sleep(0.01)
+            with lock:
+                running[0] -= 1
+            return value
+
+        futures = [track(i) for i in range(8)]
+        self.assertEqual(sorted(f.result() for f in concurrent.futures.as_completed(futures)),
+                         list(range(8)))
+        self.assertLessEqual(peak[0], 2)
+        with self.assertWarns(DeprecationWarning):
+            run_in_thread(square_and_offset, daemon=True)
+
+    def test_run_in_process(self):
+        futures = [run_in_process(square_and_offset, nb_processes=2)(i, 1) for i in range(4)]
+        concurrent.futures.wait(futures)
+        self.assertEqual([future.result() for future in futures], [1, 2, 5, 10])
+        self.assertNotEqual(run_in_process(os.getpid)().result(), os.getpid())
+        with self.assertRaises(ValueError):
+            run_in_process(fail_on_three, max_concurrency=1)(3).result()
+        # the function can be decorated in its module
+        self.assertEqual(decorated_square(4).result(), 16)
+
+
+class TestThreaded(unittest.TestCase):
+    def tearDown(self):
+        shutdown_pools()
+
+    def test_threaded(self):
+        self.assertEqual(threaded(square_and_offset)(range(10), offset=1),
+                         [i**2 + 1 for i in range(10)])
+        self.assertEqual(threaded(max_workers=2)(square_and_offset)(iter([1, 2]), 3), [4, 7])
+        self.assertEqual(threaded(square_and_offset)([]), [])
+        with self.assertRaises(ValueError):
+            threaded(fail_on_three)(range(5))
+        results = threaded(errors='return')(fail_on_three)(range(5))
+        self.assertEqual(results[:3] + results[4:], [0, 1, 2, 4])
+        self.assertIsInstance(results[3], ValueError)
+        with self.assertRaises(ValueError):
+            threaded(square_and_offset, errors='ignore')
+
+    def test_threaded_bounded(self):
+        progress = []
+        running, peak = [0], [0]
+        lock = threading.Lock()
+
+        def track(value):
+            with lock:
+                running[0] += 1
+                peak[0] = max(peak[0], running[0])
+            with lock:
+                running[0] -= 1
+            return value
+
+        values = itertools.islice(itertools.count(), 50)
+        threaded(track, max_workers=4, max_in_flight=3,
+                 progress=lambda done, total: progress.append((done, total)))(values)
+        self.assertLessEqual(peak[0], 3)
+        self.assertEqual(progress[-1], (50, None))
+        threaded(track, progress=lambda done, total: progress.append((done, total)))([1, 2])
+        self.assertEqual(progress[-1], (2, 2))
+
+        # The pool is reused by the calls
+        executor = get_shared_thread_pool(4)
+        threaded(track, max_workers=4)(range(3))
+        self.assertIs(get_shared_thread_pool(4), executor)
+
+    def test_threaded_nested(self):
+        for max_workers in (None, 2):
+            inner = threaded(square_and_offset, max_workers=max_workers)
+
+            @threaded(max_workers=max_workers)
+            def outer(value):
+                return sum(inner(range(value)))
+
+            # A deadlock makes the call time out instead of hanging the tests
+            future = concurrent.futures.ThreadPoolExecutor(1).submit(outer, range(100))
+            self.assertEqual(future.result(timeout=10),
+                             [sum(i**2 for i in range(value)) for value in range(100)])
+        # run_in_thread has threads of its own
+        self.assertEqual(run_in_thread(outer)(range(3)).result(timeout=10), [0, 0, 1])
+
+
+class TestAutoParallel(unittest.TestCase):
+    def tearDown(self):
+        shutdown_pools()
+
+    def test_auto_parallel(self):
+        run = auto_parallel(square_and_offset)
+        self.assertEqual(run(range(2), offset=1), [1, 2])
+        self.assertIsNone(run.decision)
+        self.assertEqual(run(range(10), offset=1), [i**2 + 1 for i in range(10)])
+        self.assertEqual(run.decision, 'inline')
+        self.assertEqual(run.measurements['samples'], 3)
+        self.assertGreater(run.measurements['payload_size'], 0)
+
+        def wait(value):
+            time.sleep(0.01)
+            return value
+        run = auto_parallel(wait, sample_size=2)
+        self.assertEqual(run(range(6)), list(range(6)))
+        self.assertEqual(run.decision, 'thread')
+
+        run = auto_parallel(burn_cpu, nb_processes=2)
+        self.assertEqual(run(range(6)), list(range(6)))
+        self.assertEqual(run.decision, 'process')
+        self.assertGreater(run.measurements['cpu_time'], 0.004)
+        # the function can be decorated in its module
+        self.assertEqual(decorated_burn_cpu(range(6)), list(range(6)))
+        self.assertEqual(decorated_burn_cpu.decision, 'process')
+        self.assertTrue(decorated_burn_cpu.measurements['picklable'])
+
+        # functions which can't be pickled are not sent to processes
+        run = auto_parallel(lambda value: burn_cpu(value), nb_processes=2)
+        self.assertEqual(run(range(4)), list(range(4)))
+        self.assertEqual(run.decision, 'inline')
+        self.assertFalse(run.measurements['picklable'])
+
+
+class TestScheduled(unittest.TestCase):
+    def tearDown(self):
+        shutdown_pools()
+
+    def test_guided_chunks(self):
+        from code_utils.decorators.concurrency import _guided_chunks
+        costs = [1, 1, 1, 1, 10, 1, 1, 1, 1, 1, 1, 1]
+        order = sorted(range(len(costs)), key=lambda i: -costs[i])
+        chunks = list(_guided_chunks(order, costs, 1, 1))
+        self.assertEqual(chunks[0], [4])
+        self.assertEqual(sorted(sum(chunks, [])), list(range(len(costs))))
+        # the chunks of values of the same cost get smaller
+        self.assertEqual([len(chunk) for chunk in chunks], [1, 5, 3, 1, 1, 1])
+        self.assertTrue(all(len(chunk) >= 3 for chunk in _guided_chunks(list(range(9)), [1] * 9, 4, 3)))
+
+    def test_scheduled(self):
+        run = scheduled(square_and_offset, nb_processes=2)
+        self.assertEqual(run(range(10), offset=1), [i**2 + 1 for i in range(10)])
+        self.assertEqual(run([]), [])
+
+        # A single process runs the values by priority, then by decreasing cost
+        durations = [0.001, 0.003, 0.002, 0.004]
+        ends = scheduled(sleep_and_time, nb_processes=1, cost=lambda duration: duration,
+                         priority=lambda duration: duration == 0.001)(durations)
+        self.assertEqual(sorted(range(4), key=lambda i: ends[i]), [0, 3, 1, 2])
+
+        with self.assertRaises(ValueError):
+            scheduled(fail_on_three, nb_processes=2)(range(100))
+        start = time.monotonic()
+        with self.assertRaises(concurrent.futures.TimeoutError):
+            scheduled(sleep_and_time, nb_processes=2, timeout=0.05)([0.3] * 10)
+        self.assertLess(time.monotonic() - start, 0.25)
+
+
+class TestAsyncBridges(unittest.TestCase):
+    def tearDown(self):
+        shutdown_pools()
+
+    def test_to_thread_and_process(self):
+        @to_thread(max_concurrency=2)
+        def wait(value):
+            time.sleep(0.01)
+            return value, threading.current_thread() is threading.main_thread()
+
+        async def run():
+            results = await asyncio.gather(*[wait(i) for i in range(4)])
+            squares = await asyncio.gather(*[to_process(square_and_offset, nb_processes=2)(i, 1)
+                                             for i in range(3)])
+            with self.assertRaises(ValueError):
+                await to_process(fail_on_three)(3)
+            return results, squares
+
+        results, squares = asyncio.run(run())
+        self.assertEqual(results, [(i, False) for i in range(4)])
+        self.assertEqual(squares, [1, 2, 5])
+        # the semaphores are not bound to the first event loop
+        self.assertEqual(asyncio.run(wait(5)), (5, False))
+
+    def test_async_gather_map(self):
+        running, peak = [0], [0]
+
+        @async_gather_map(max_concurrency=3)
+        async def track(value, offset):
+            running[0] += 1
+            peak[0] = max(peak[0], running[0])
+            await asyncio.sleep(0.001 * (value % 3))
+            running[0] -= 1
+            return value + offset
+
+        self.assertEqual(asyncio.run(track(range(20), 1)), list(range(1, 21)))
+        self.assertEqual(peak[0], 3)
+
+        async def fail(value):
+            await asyncio.sleep(0)
+            return fail_on_three(value)
+        with self.assertRaises(ValueError):
+            asyncio.run(async_gather_map(fail)(range(5)))
+        results = asyncio.run(async_gather_map(fail, return_exceptions=True)(range(5)))
+        self.assertEqual(results[:3] + results[4:], [0, 1, 2, 4])
+        self.assertIsInstance(results[3], ValueError)
+
+
+if __name__ == '__main__':
+    unittest.main()
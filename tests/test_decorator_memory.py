@@ -0,0 +1,91 @@
+import unittest
+import asyncio
+import json
+from unittest import mock
+from code_utils.decorators.memory import track_memory, enable_memory_tracking, \
+    disable_memory_tracking
+from code_utils.metrics import MetricsRegistry
+
+_kept = []
+
+
+class TestTrackMemory(unittest.TestCase):
+    def setUp(self):
+        super().setUp()
+        self.registry = MetricsRegistry()
+
+    def tearDown(self):
+        disable_memory_tracking()
+        del _kept[:]
+
+    def test_track_memory(self):
+        @track_memory(name='allocate', registry=self.registry, sites=True)
+        def allocate(size):
+            temporary = bytearray(4 * size)
+            del temporary
+            _kept.append(bytearray(size))
+
+        allocate(10**6)
+        self.assertEqual(self.registry.memory('allocate').count, 0)
+
+        enable_memory_tracking()
+        allocate(10**6)
+        stats = self.registry.snapshot('function_memory_bytes')['allocate']
+        self.assertEqual(stats['count'], 1)
+        self.assertGreaterEqual(stats['peak_max'], 4 * 10**6)
+        self.assertGreaterEqual(stats['net_total'], 10**6)
+        self.assertLess(stats['net_total'], 2 * 10**6)
+        site, size = stats['top_allocators'][0]['site'], stats['top_allocators'][0]['size']
+        self.assertIn('test_decorator_memory.py', site)
+        self.assertGreaterEqual(size, 10**6)
+
+        # exported with the timings
+        self.assertIn('function_memory_bytes', json.loads(self.registry.to_json()))
+        self.assertIn('code_utils_function_memory_bytes{function="allocate",stat="calls"} 1.0',
+                      self.registry.to_prometheus().splitlines())
+
+        disable_memory_tracking()
+        allocate(10)
+        self.assertEqual(self.registry.memory('allocate').count, 1)
+
+    def test_track_memory_sampling(self):
+        @track_memory(name='sampled', registry=self.registry, sample_every=4)
+        def allocate(size):
+            _kept.append(bytearray(size))
+
+        @track_memory(name='async', registry=self.registry)
+        async def allocate_async(size):
+            await asyncio.sleep(0)
+            _kept.append(bytearray(size))
+
+        enable_memory_tracking()
+        for _ in range(8):
+            allocate(1000)
+        asyncio.run(allocate_async(10**5))
+        stats = self.registry.snapshot('function_memory_bytes')
+        self.assertEqual(stats['sampled']['count'], 2)
+        self.assertEqual(stats['sampled']['top_allocators'], [])
+        self.assertGreaterEqual(stats['async']['net_total'], 10**5)
+
+    def test_track_memory_without_reset_peak(self):
+        # Python < 3.9
+        @track_memory(name='no_reset', registry=self.registry)
+        def allocate(size):
+            temporary = bytearray(4 * size)
+            del temporary
+            _kept.append(bytearray(size))
+
+        enable_memory_tracking()
+        with mock.patch('code_utils.decorators.memory._reset_peak', None):
+            allocate(10**6)
+            allocate(10**5)
+        stats = self.registry.memory('no_reset')
+        # the peak of the first call exceeds the one of the process
+        self.assertGreaterEqual(stats.peak_max, 4 * 10**6)
+        # the second one is only known by the memory it keeps
+        self.assertGreaterEqual(stats.peak_total, 4 * 10**6 + 10**5)
+        self.assertLess(stats.peak_total, 4 * 10**6 + 4 * 10**5)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,94 @@
+import unittest
+import asyncio
+import threading
+import time
+from code_utils.decorators.concurrency import threaded, shutdown_pools
+from code_utils.decorators.throttling import rate_limit, max_concurrency
+
+
+class TestThrottling(unittest.TestCase):
+    def tearDown(self):
+        shutdown_pools()
+
+    def test_rate_limit(self):
+        @rate_limit(5, period=0.1)
+        def identity(value):
+            return value
+
+        start = time.monotonic()
+        # 5 calls right away, then 5 per 0.1 second
+        self.assertEqual(threaded(identity, max_workers=4)(range(15)), list(range(15)))
+        self.assertGreaterEqual(time.monotonic() - start, 0.19)
+        self.assertEqual(identity.__name__, 'identity')
+        with self.assertRaises(ValueError):
+            rate_limit(0)
+
+    def test_rate_limit_async(self):
+        @rate_limit(10, period=0.1, burst=1)
+        async def identity(value):
+            return value
+
+        async def run():
+            return await asyncio.gather(*[identity(i) for i in range(4)])
+
+        start = time.monotonic()
+        self.assertEqual(asyncio.run(run()), [0, 1, 2, 3])
+        self.assertGreaterEqual(time.monotonic() - start, 0.029)
+
+    def test_max_concurrency(self):
+        running, peak = [0], [0]
+        lock = threading.Lock()
+
+        @max_concurrency(2)
+        def track(value):
+            with lock:
+                running[0] += 1
+                peak[0] = max(peak[0], running[0])
+            time.sleep(0.005)
+            with lock:
+                running[0] -= 1
+            return value
+
+        self.assertEqual(threaded(track, max_workers=8)(range(10)), list(range(10)))
+        self.assertEqual(peak[0], 2)
+
+        @max_concurrency(3)
+        async def track_async(value):
+            running[0] += 1
+            peak[0] = max(peak[0], running[0])
+            await asyncio.sleep(0.001)
+            running[0] -= 1
+            return value
+
+        async def run():
+            return await asyncio.gather(*[track_async(i) for i in range(10)])
+
+        peak[0] = 0
+        self.assertEqual(asyncio.run(run()), list(range(10)))
+        self.assertEqual(peak[0], 3)
+
+
+    def test_decorated_method(self):
+        class Client:
+            def __init__(self, name):
+                self.name = name
+
+            @rate_limit(100)
+            def fetch(self, value):
+                return self.name, value
+
+            @max_concurrency(2)
+            async def query(self, value):
+                await asyncio.sleep(0)
+                return self.name, value
+
+        client = Client('a')
+        self.assertEqual(client.fetch(1), ('a', 1))
+        self.assertEqual(Client('b').fetch(value=2), ('b', 2))
+        self.assertEqual(client.fetch.__name__, 'fetch')
+        self.assertEqual(asyncio.run(client.query(3)), ('a', 3))
+        # Accessed from the class, the decorator itself is returned
+        self.assertIs(Client.__dict__['fetch'], Client.fetch)
+
+if __name__ == '__main__':
+    unittest.main()
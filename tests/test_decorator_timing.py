@@ -0,0 +1,105 @@
+import unittest
+import asyncio
+import time
+from code_utils.decorators.timing import timer, time_all_class_methods
+from code_utils.metrics import MetricsRegistry, get_registry
+
+
+class TestTimer(unittest.TestCase):
+    def test_timer(self):
+        @timer
+        def wait(duration):
+            time.sleep(duration)
+            return duration
+
+        self.assertEqual(wait(0.01), 0.01)
+        stats = get_registry().snapshot()[__name__ + '.TestTimer.test_timer.<locals>.wait']
+        self.assertEqual(stats['count'], 1)
+        self.assertGreaterEqual(stats['min'], 0.01)
+
+        registry = MetricsRegistry()
+
+        @timer(name='sampled', registry=registry, sample_every=3)
+        def fail(value):
+            raise ValueError(value)
+
+        for i in range(9):
+            with self.assertRaises(ValueError):
+                fail(i)
+        self.assertEqual(registry.snapshot()['sampled']['count'], 3)
+
+        @timer(name='async', registry=registry)
+        async def wait_async(duration):
+            await asyncio.sleep(duration)
+            return duration
+
+        self.assertEqual(asyncio.run(wait_async(0.01)), 0.01)
+        self.assertGreaterEqual(registry.snapshot()['async']['max'], 0.01)
+
+    def test_time_all_class_methods(self):
+        registry = MetricsRegistry()
+
+        @time_all_class_methods(registry=registry, exclude=['_*'])
+        class Counter(object):
+            def __init__(self):
+                self._value = 0
+
+            def add(self, value):
+                self._value += value
+                return self
+
+            async def add_async(self, value):
+                return self.add(value)
+
+            @classmethod
+            def create(cls):
+                return cls()
+
+            @staticmethod
+            def double(value):
+                return 2 * value
+
+            @property
+            def value(self):
+                return self._value
+
+            @value.setter
+            def value(self, value):
+                self._value = value
+
+            def _private(self):
+                pass
+
+        counter = Counter.create()
+        self.assertIsInstance(counter, Counter)
+        self.assertEqual(counter.add(1).add(2).value, 3)
+        counter.value = Counter.double(5)
+        asyncio.run(counter.add_async(1))
+        self.assertEqual(counter.value, 11)
+        counter._private()
+        prefix = __name__ + '.TestTimer.test_time_all_class_methods.<locals>.Counter.'
+        counts = {name[len(prefix):]: stats['count'] for name, stats in registry.snapshot().items()}
+        self.assertEqual(counts, {'add': 3, 'add_async': 1, 'create': 1, 'double': 1,
+                                  'value': 2, 'value.setter': 1})
+        self.assertEqual(Counter.add.__name__, 'add')
+
+        @time_all_class_methods(include=['__init__', 'add'], registry=registry)
+        class Other(Counter):
+            def __init__(self):
+                super().__init__()
+
+            def add(self, value):
+                return super().add(value)
+
+            def sub(self, value):
+                return self.add(-value)
+
+        Other().sub(1)
+        names = [name.rsplit('.', 2)[-2:] for name in registry.snapshot()]
+        self.assertIn(['Other', '__init__'], names)
+        self.assertIn(['Other', 'add'], names)
+        self.assertNotIn(['Other', 'sub'], names)
+
+
+if __name__ == '__main__':
+    unittest.main()
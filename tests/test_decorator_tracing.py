@@ -0,0 +1,108 @@
+import unittest
+import asyncio
+import json
+import os
+import tempfile
+import time
+from code_utils.decorators.tracing import trace, get_tracer, Tracer
+
+
+@trace(name='outer')
+def outer():
+    inner()
+    with trace('block'):
+        time.sleep(0.01)
+    inner()
+
+
+@trace(name='inner')
+def inner():
+    time.sleep(0.005)
+
+
+class TestTrace(unittest.TestCase):
+    def setUp(self):
+        super().setUp()
+        self.tracer = get_tracer()
+        self.tracer.reset()
+
+    def tearDown(self):
+        self.tracer.disable()
+        self.tracer.reset()
+
+    def test_disabled(self):
+        outer()
+        self.assertEqual(self.tracer.stats(), {})
+
+    def test_trace(self):
+        self.tracer.enable()
+        outer()
+        stats = self.tracer.stats()
+        self.assertEqual(sorted(stats), ['outer', 'outer;block', 'outer;inner'])
+        self.assertEqual(stats['outer;inner']['count'], 2)
+        self.assertGreaterEqual(stats['outer']['total'], 0.02)
+        # the self time of outer excludes the time of its children
+        self.assertLess(stats['outer']['self'], 0.005)
+        self.assertAlmostEqual(stats['outer']['total'],
+                               sum(path['self'] for path in stats.values()), delta=1e-6)
+
+        with tempfile.TemporaryDirectory() as tmp:
+            filepath = os.path.join(tmp, 'trace.folded')
+            self.tracer.write_collapsed_stacks(filepath)
+            with open(filepath) as file:
+                lines = file.read().splitlines()
+            self.assertEqual([line.split()[0] for line in lines], ['outer', 'outer;block', 'outer;inner'])
+            self.assertGreaterEqual(int(lines[2].split()[1]), 10000)
+
+            filepath = os.path.join(tmp, 'trace.json')
+            self.tracer.write_chrome_trace(filepath)
+            with open(filepath) as file:
+                events = json.load(file)['traceEvents']
+        self.assertEqual([event['name'] for event in events], ['inner', 'block', 'inner', 'outer'])
+        self.assertTrue(all(event['ph'] == 'X' for event in events))
+
+    def test_trace_async(self):
+        @trace
+        async def child(duration):
+            await asyncio.sleep(duration)
+
+        @trace(name='parent')
+        async def parent():
+            await asyncio.gather(child(0.01), child(0.01))
+            with trace('after'):
+                await child(0)
+
+        self.tracer.enable()
+        asyncio.run(parent())
+        child_name = child.__module__ + '.' + child.__qualname__
+        stats = self.tracer.stats()
+        self.assertEqual(sorted(stats), sorted(['parent', 'parent;' + child_name, 'parent;after',
+                                                'parent;after;' + child_name]))
+        self.assertEqual(stats['parent;' + child_name]['count'], 2)
+        # the concurrent children take longer than their parent
+        self.assertGreaterEqual(stats['parent']['self'], 0)
+
+
+    def test_own_tracer(self):
+        tracer = Tracer(max_events=0)
+
+        @trace(tracer=tracer)
+        def job():
+            with trace('step', tracer=tracer):
+                inner()
+
+        job()
+        self.assertEqual(tracer.stats(), {})
+        tracer.enable()
+        job()
+        job_name = job.__module__ + '.' + job.__qualname__
+        self.assertEqual(sorted(tracer.stats()), [job_name, job_name + ';step'])
+        self.assertEqual(self.tracer.stats(), {})
+        self.assertEqual(tracer.chrome_trace()['traceEvents'], [])
+        # The spans of the other tracers are part of the call paths
+        self.tracer.enable()
+        job()
+        self.assertEqual(list(self.tracer.stats()), [job_name + ';step;inner'])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,215 @@
+
+import unittest
+import logging
+import os
+import tempfile
+import threading
+import gzip
+import json
+import multiprocessing
+import time
+from code_utils.logger import create_logger, BoundedQueueHandler, BufferedRotatingFileHandler, \
+    start_log_sink, stop_log_sink
+from code_utils.decorators.concurrency import parallel, run_in_process, scheduled, SharedPool, \
+    shutdown_pools
+
+
+class _SlowHandler(logging.Handler):
+    def __init__(self):
+        super().__init__()
+        self.event = threading.Event()
+        self.messages = []
+
+    def emit(self, record):
+        self.event.wait()
+        self.messages.append(record.getMessage())
+
+
+def _handler_types(name):
+    return {type(handler).__name__ for handler in logging.getLogger(name).handlers}
+
+
+def _log_from_child(value, filepath):
+    logger = create_logger(filepath, 'test_sink_child', format='%(name)s %(message)s')
+    logger.info('value %d', value)
+    return value
+
+
+class TestLogger(unittest.TestCase):
+    def setUp(self):
+        super().setUp()
+        self.tmp = tempfile.TemporaryDirectory()
+        self.loggers = []
+
+    def tearDown(self):
+        for logger in self.loggers:
+            for handler in list(logger.handlers):
+                handler.close()
+                logger.removeHandler(handler)
+        self.tmp.cleanup()
+
+    def create_logger(self, name, **kwargs):
+        filepath = os.path.join(self.tmp.name, 'logs', name + '.log')
+        logger = create_logger(filepath, name, **kwargs)
+        self.loggers.append(logger)
+        return logger, filepath
+
+    def read(self, filepath):
+        with open(filepath) as file:
+            return file.read().splitlines()
+
+    def test_create_logger(self):
+        logger, filepath = self.create_logger('test_sync', format='%(levelname)s %(message)s')
+        logger.info('hello %s', 'world')
+        logger.debug('hidden')
+        self.assertEqual(self.read(filepath), ['INFO hello world'])
+
+    def test_async_mode(self):
+        logger, filepath = self.create_logger('test_async', async_mode=True,
+                                              format='%(message)s')
+        for i in range(100):
+            logger.info('record %d', i)
+        logger.handlers[0].close()
+        self.assertEqual(self.read(filepath), ['record {}'.format(i) for i in range(100)])
+
+    def test_overflow(self):
+        for overflow, expected in [('drop_newest', ['0', '1']), ('drop_oldest', ['0', '3'])]:
+            slow = _SlowHandler()
+            handler = BoundedQueueHandler(slow, queue_size=1, overflow=overflow)
+            logger = logging.getLogger('test_overflow_' + overflow)
+            logger.addHandler(handler)
+            self.loggers.append(logger)
+            logger.warning('0')
+            # wait for the listener to be blocked on the first record
+            while not handler.queue.empty():
+                pass
+            for i in range(1, 4):
+                logger.warning(str(i))
+            self.assertEqual(handler.dropped, 2)
+            slow.event.set()
+            handler.close()
+            self.assertEqual(slow.messages, expected)
+        with self.assertRaises(ValueError):
+            BoundedQueueHandler(overflow='wait')
+
+    def test_buffered(self):
+        logger, filepath = self.create_logger('test_buffered', buffered=True, format='%(message)s',
+                                              buffer_size=100, flush_interval=None)
+        handler = logger.handlers[0]
+        logger.info('a' * 10)
+        self.assertEqual(self.read(filepath), [])
+        logger.error('b' * 10)
+        self.assertEqual(self.read(filepath), ['a' * 10, 'b' * 10])
+        for _ in range(10):
+            logger.info('c' * 9)
+        self.assertEqual(handler.flushes, 2)
+        self.assertEqual((handler.records_written, handler.bytes_written), (12, 122))
+
+        logger, filepath = self.create_logger('test_interval', buffered=True, flush_interval=0.01)
+        logger.info('flushed by the background thread')
+        for _ in range(100):
+            if self.read(filepath):
+                break
+            time.sleep(0.01)
+        self.assertEqual(len(self.read(filepath)), 1)
+
+    def test_rotation(self):
+        filepath = os.path.join(self.tmp.name, 'rotated.log')
+        handler = BufferedRotatingFileHandler(filepath, buffer_size=0, max_bytes=25,
+                                              backup_count=2, compress=True)
+        handler.setFormatter(logging.Formatter('%(message)s'))
+        logger = logging.getLogger('test_rotation')
+        logger.addHandler(handler)
+        self.loggers.append(logger)
+        for i in range(4):
+            logger.warning('record {} 0123456789'.format(i))
+        handler.close()
+        self.assertEqual(handler.rotations, 3)
+        self.assertEqual(self.read(filepath), ['record 3 0123456789'])
+        with gzip.open(filepath + '.1.gz', 'rt') as file:
+            self.assertEqual(file.read(), 'record 2 0123456789\n')
+        with gzip.open(filepath + '.2.gz', 'rt') as file:
+            self.assertEqual(file.read(), 'record 1 0123456789\n')
+        self.assertFalse(os.path.exists(filepath + '.3.gz'))
+
+    def test_idempotent(self):
+        fmt = '%(name)s %(message)s'
+        logger, filepath = self.create_logger('test_idempotent', format=fmt)
+        self.assertIs(create_logger(filepath, 'test_idempotent', format=fmt), logger)
+        self.assertEqual(len(logger.handlers), 1)
+        other = create_logger(filepath, 'test_idempotent_other', format=fmt)
+        self.loggers.append(other)
+        self.assertIs(other.handlers[0], logger.handlers[0])
+        logger.info('first')
+        other.info('second')
+        self.assertEqual(self.read(filepath), ['test_idempotent first', 'test_idempotent_other second'])
+
+        # The handler is reused with its own options
+        for kwargs in ({}, {'format': 'json'}, {'format': fmt, 'async_mode': True},
+                       {'format': fmt, 'buffered': True}, {'format': fmt, 'queue_size': 10}):
+            with self.assertWarns(RuntimeWarning):
+                create_logger(filepath, 'test_idempotent', **kwargs)
+        self.assertEqual(len(logger.handlers), 1)
+
+        # A closed handler is replaced
+        logger.handlers[0].close()
+        logger.removeHandler(logger.handlers[0])
+        create_logger(filepath, 'test_idempotent')
+        self.assertIsNot(logger.handlers[0], other.handlers[0])
+
+    def test_json_format(self):
+        logger, filepath = self.create_logger('test_json', format='json', async_mode=True)
+        logger.info('value %d', 1)
+        try:
+            raise ValueError('bad')
+        except ValueError:
+            logger.exception('failed')
+        logger.handlers[0].close()
+        records = [json.loads(line) for line in self.read(filepath)]
+        self.assertEqual([(r['levelname'], r['name'], r['message']) for r in records],
+                         [('INFO', 'test_json', 'value 1'), ('ERROR', 'test_json', 'failed')])
+        self.assertIn('ValueError: bad', records[1]['exc_info'])
+
+    def test_log_sink(self):
+        logger, filepath = self.create_logger('test_sink', format='%(name)s %(message)s')
+        start_log_sink()
+        try:
+            logger.info('parent')
+            self.assertEqual(run_in_process(_log_from_child)(-1, filepath).result(), -1)
+            self.assertEqual(parallel(_log_from_child, 3)(range(10), filepath), list(range(10)))
+            # the pools passed to the decorators too
+            with SharedPool(2) as pool:
+                self.assertEqual(scheduled(_log_from_child, pool=pool)(range(10, 12), filepath),
+                                 [10, 11])
+                self.assertEqual(parallel(_handler_types, pool=pool)(['test_sink']),
+                                 [{'_SinkHandler'}])
+        finally:
+            stop_log_sink()
+        lines = self.read(filepath)
+        self.assertEqual(lines[0], 'test_sink parent')
+        self.assertEqual(sorted(lines[1:]), sorted('test_sink_child value {}'.format(i) for i in range(-1, 12)))
+
+    def test_log_sink_restarts(self):
+        logger, filepath = self.create_logger('test_sink_restarts', format='%(name)s %(message)s')
+        shutdown_pools()
+        try:
+            for i in range(3):
+                start_log_sink()
+                try:
+                    self.assertEqual(parallel(_log_from_child, 2)([i], filepath), [i])
+                finally:
+                    stop_log_sink()
+            # the processes of the previous sinks stop, only the pool's remain
+            self.assertEqual(parallel(_log_from_child, 2)([3], filepath), [3])
+            deadline = time.monotonic() + 5
+            while len(multiprocessing.active_children()) > 2 and time.monotonic() < deadline:
+                time.sleep(0.01)
+            self.assertEqual(len(multiprocessing.active_children()), 2)
+        finally:
+            shutdown_pools()
+        self.assertEqual(sorted(self.read(filepath)),
+                         ['test_sink_child value {}'.format(i) for i in range(4)])
+
+
+if __name__ == '__main__':
+    unittest.main()
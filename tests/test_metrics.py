@@ -0,0 +1,54 @@
+import unittest
+import json
+import threading
+from code_utils.metrics import TimingStats, MetricsRegistry
+
+
+class TestMetrics(unittest.TestCase):
+    def test_timing_stats(self):
+        stats = TimingStats()
+        self.assertIsNone(stats.percentile(0.5))
+        for duration in range(1, 100001):
+            stats.record(duration)
+        snapshot = stats.snapshot()
+        self.assertEqual(snapshot['count'], 100000)
+        self.assertEqual((snapshot['min'], snapshot['max']), (1e-9, 1e-4))
+        self.assertAlmostEqual(snapshot['mean'], 50000.5e-9)
+        for quantile in (0.5, 0.9, 0.99):
+            self.assertAlmostEqual(stats.percentile(quantile) / (quantile * 100000), 1, delta=0.03)
+        self.assertIn('p99', snapshot)
+        # the memory used does not grow with the number of durations
+        self.assertLess(len(stats._buckets), 500)
+
+        threads = [threading.Thread(target=lambda: [stats.record(5) for _ in range(1000)])
+                   for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(stats.count, 104000)
+
+    def test_registry_exports(self):
+        registry = MetricsRegistry(prefix='app_')
+        stats = registry.timing('module.work')
+        self.assertIs(registry.timing('module.work'), stats)
+        stats.record(2000000)
+        registry.timing('module.other "quoted"')
+        self.assertEqual(registry.snapshot()['module.work']['count'], 1)
+        self.assertEqual(json.loads(registry.to_json())['function_duration_seconds']['module.work']['max'],
+                         0.002)
+        lines = registry.to_prometheus().splitlines()
+        self.assertEqual(lines[0], '# TYPE app_function_duration_seconds summary')
+        self.assertIn('app_function_duration_seconds{function="module.work",quantile="0.5"} 0.002',
+                      lines)
+        self.assertIn('app_function_duration_seconds_count{function="module.work"} 1.0', lines)
+        self.assertIn('app_function_duration_seconds{function="module.other \\"quoted\\"",quantile="0.9"} NaN',
+                      lines)
+
+        registry.reset()
+        self.assertEqual(stats.count, 0)
+        self.assertIs(registry.timing('module.work'), stats)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,237 @@
+
+import unittest
+import asyncio
+import os
+import shutil
+import tempfile
+import time
+from unittest import mock
+from code_utils import os_utils
+
+
+class TestOsUtils(unittest.TestCase):
+    def setUp(self):
+        super().setUp()
+        self.tmp = tempfile.TemporaryDirectory()
+        self.root = self.tmp.name
+        # root/
+        #   a_file.txt, b_file.log
+        #   sub_a/ -> c_file.txt, sub_b/ -> d_file.txt
+        for folder in ['sub_a', os.path.join('sub_a', 'sub_b')]:
+            os.makedirs(os.path.join(self.root, folder))
+        for f in ['a_file.txt', 'b_file.log',
+                  os.path.join('sub_a', 'c_file.txt'),
+                  os.path.join('sub_a', 'sub_b', 'd_file.txt')]:
+            with open(os.path.join(self.root, f), 'w') as file:
+                file.write(f)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def path(self, *parts):
+        return os.path.join(self.root, *parts)
+
+    def test_list_directory(self):
+        self.assertEqual(sorted(os_utils.list_directory(self.root)),
+                         sorted([self.path('a_file.txt'), self.path('b_file.log'), self.path('sub_a')]))
+        self.assertEqual(os_utils.list_files(self.root, '.log'), [self.path('b_file.log')])
+        self.assertEqual(os_utils.list_folders(self.root), [self.path('sub_a')])
+        self.assertEqual(sorted(os_utils.list_files(self.root, ['a_', 'txt'], mode='all')),
+                         [self.path('a_file.txt')])
+        # The options following mode are passed by keyword
+        for function in (os_utils.iter_directory, os_utils.list_directory, os_utils.snapshot):
+            with self.assertRaises(TypeError):
+                function(self.root, '', 'any', True)
+
+    def test_iter_directory_recursive(self):
+        files = sorted(os_utils.iter_directory(self.root, '.txt', kind='file', recursive=True))
+        self.assertEqual(files, sorted([self.path('a_file.txt'),
+                                        self.path('sub_a', 'c_file.txt'),
+                                        self.path('sub_a', 'sub_b', 'd_file.txt')]))
+        folders = list(os_utils.iter_directory(self.root, kind='dir', recursive=True, max_depth=0))
+        self.assertEqual(folders, [self.path('sub_a')])
+        self.assertEqual(len(os_utils.list_files(self.root, recursive=True)), 4)
+
+    def test_iter_directory_errors(self):
+        with self.assertRaises(OSError):
+            list(os_utils.iter_directory(self.path('missing')))
+        with self.assertRaises(ValueError):
+            list(os_utils.iter_directory(self.root, kind='link'))
+
+    def test_name_matcher(self):
+        NameMatcher = os_utils.NameMatcher
+        names = ['abc.txt', 'abd.log', 'xabcd.jpg', 'thumb_abc.jpg', 'other']
+        self.assertEqual(list(NameMatcher(['ab', 'abc', 'jpg']).filter(names)), names[:4])
+        self.assertEqual(list(NameMatcher(['abc', 'bc', 'jpg'], mode='all').filter(names)),
+                         ['xabcd.jpg', 'thumb_abc.jpg'])
+        self.assertEqual(list(NameMatcher(['abc', 'd', 'cd'], mode='all').filter(names)),
+                         ['xabcd.jpg'])
+        self.assertEqual(list(NameMatcher('*.jpg', pattern_type='glob', exclude='thumb*').filter(names)),
+                         ['xabcd.jpg'])
+        self.assertEqual(list(NameMatcher(r'^ab.\.', pattern_type='regex').filter(names)),
+                         ['abc.txt', 'abd.log'])
+        # inline global flags only apply to their own pattern
+        self.assertEqual(list(NameMatcher('(?i)ABC', pattern_type='regex').filter(names)),
+                         ['abc.txt', 'xabcd.jpg', 'thumb_abc.jpg'])
+        self.assertEqual(list(NameMatcher(['(?i)^ABC', 'LOG$'], pattern_type='regex').filter(names)),
+                         ['abc.txt'])
+        self.assertEqual(list(NameMatcher(['(?i:^ABC)', 'log$'], pattern_type='regex').filter(names)),
+                         ['abc.txt', 'abd.log'])
+        self.assertTrue(NameMatcher().matches_everything)
+        self.assertFalse(NameMatcher([])('abc'))
+        with self.assertRaises(ValueError):
+            NameMatcher(mode='some')
+
+    def test_list_with_matcher(self):
+        matcher = os_utils.NameMatcher('*.txt', pattern_type='glob', exclude='c_*')
+        self.assertEqual(sorted(os_utils.list_files(self.root, matcher, recursive=True)),
+                         sorted([self.path('a_file.txt'), self.path('sub_a', 'sub_b', 'd_file.txt')]))
+        self.assertEqual(os_utils.list_files(self.root, exclude=['.txt']), [self.path('b_file.log')])
+
+    def test_iter_directory_parallel(self):
+        for i in range(20):
+            os.makedirs(self.path('sub_a', 'many', str(i), 'deep'))
+            open(self.path('sub_a', 'many', str(i), 'deep', 'e_file.txt'), 'w').close()
+        expected = list(os_utils.iter_directory(self.root, recursive=True))
+        self.assertEqual(list(os_utils.iter_directory(self.root, recursive=True, workers=4)),
+                         expected)
+        unordered = os_utils.iter_directory(self.root, recursive=True, workers=4, ordered=False)
+        self.assertEqual(sorted(unordered), sorted(expected))
+        self.assertEqual(len(os_utils.list_files(self.root, 'e_file', recursive=True, workers=3)), 20)
+
+        # Stopping early shuts the pool down
+        walker = os_utils.iter_directory(self.root, recursive=True, workers=4)
+        next(walker)
+        walker.close()
+
+    def test_iter_directory_parallel_lazy(self):
+        for i in range(30):
+            for j in range(20):
+                os.makedirs(self.path('wide', str(i), str(j)))
+        scandir = os.scandir
+        listed = []
+
+        def counting_scandir(path):
+            listed.append(path)
+            return scandir(path)
+
+        for ordered in (True, False):
+            with self.subTest(ordered=ordered), \
+                    mock.patch('code_utils.os_utils.os.scandir', counting_scandir):
+                del listed[:]
+                walker = os_utils.iter_directory(self.root, recursive=True, workers=4,
+                                                 ordered=ordered)
+                next(walker)
+                time.sleep(0.2)
+                # Only a few folders are listed ahead of the caller
+                self.assertLessEqual(len(listed), 2 * 4 + 1)
+                walker.close()
+
+    def test_listing_cache(self):
+        # Listings of recently modified folders are not cached
+        old = 1000000000
+        for folder in [self.root, self.path('sub_a'), self.path('sub_a', 'sub_b')]:
+            os.utime(folder, (old, old))
+        cache = os_utils.ListingCache()
+        expected = sorted(os_utils.list_files(self.root, '.txt', recursive=True))
+        self.assertEqual(sorted(os_utils.list_files(self.root, '.txt', recursive=True, cache=cache)),
+                         expected)
+        self.assertEqual((cache.hits, cache.misses, len(cache)), (0, 3, 3))
+        self.assertEqual(sorted(os_utils.list_files(self.root, '.txt', recursive=True, cache=cache)),
+                         expected)
+        self.assertEqual(cache.hits, 3)
+        self.assertEqual(os_utils.list_folders(self.root, cache=cache), [self.path('sub_a')])
+
+        # A modified folder is listed again
+        open(self.path('e_file.txt'), 'w').close()
+        self.assertIn(self.path('e_file.txt'), os_utils.list_files(self.root, cache=cache))
+        self.assertEqual(cache.misses, 4)
+
+        # Least recently used listings are evicted
+        small_cache = os_utils.ListingCache(max_entries=2)
+        os_utils.list_files(self.root, recursive=True, cache=small_cache)
+        self.assertEqual(len(small_cache), 1)
+
+    def test_listing_cache_persistence(self):
+        old = 1000000000
+        os.utime(self.root, (old, old))
+        db_tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(db_tmp.cleanup)
+        db_path = os.path.join(db_tmp.name, 'cache', 'listings.sqlite')
+        with os_utils.ListingCache(path=db_path) as cache:
+            files = os_utils.list_files(self.root, cache=cache)
+        with os_utils.ListingCache(path=db_path) as cache:
+            self.assertEqual(os_utils.list_files(self.root, cache=cache), files)
+            self.assertEqual((cache.hits, cache.misses), (1, 0))
+
+    def test_snapshot_diff(self):
+        state = os_utils.snapshot(self.root, '.txt', kind='file')
+        self.assertEqual(sorted(state.paths()), sorted(os_utils.list_files(self.root, '.txt', recursive=True)))
+        self.assertEqual(list(os_utils.diff(state)), [])
+
+        with open(self.path('sub_a', 'c_file.txt'), 'a') as file:
+            file.write('more')
+        open(self.path('sub_a', 'sub_b', 'e_file.txt'), 'w').close()
+        os.remove(self.path('a_file.txt'))
+        changes = sorted(os_utils.diff(state, update=True))
+        self.assertEqual(changes, sorted([
+            ('added', self.path('sub_a', 'sub_b', 'e_file.txt')),
+            ('modified', self.path('sub_a', 'c_file.txt')),
+            ('removed', self.path('a_file.txt')),
+        ]))
+        self.assertIn(self.path('sub_a', 'sub_b', 'e_file.txt'), state)
+        self.assertNotIn(self.path('a_file.txt'), state)
+
+        # Unchanged folders are pruned, their files are only checked with check_files
+        old = 1000000000
+        for folder in state.folders:
+            os.utime(folder, (old, old))
+        state = os_utils.snapshot(self.root, '.txt', kind='file')
+        with open(self.path('sub_a', 'c_file.txt'), 'a') as file:
+            file.write('more')
+        self.assertEqual(list(os_utils.diff(state)), [])
+        self.assertEqual(list(os_utils.diff(state, check_files=True)),
+                         [('modified', self.path('sub_a', 'c_file.txt'))])
+
+        # Removed sub folders
+        shutil.rmtree(self.path('sub_a'))
+        self.assertEqual(sorted(os_utils.diff(state, update=True)), sorted([
+            ('removed', self.path('sub_a', 'c_file.txt')),
+            ('removed', self.path('sub_a', 'sub_b', 'd_file.txt')),
+            ('removed', self.path('sub_a', 'sub_b', 'e_file.txt')),
+        ]))
+        self.assertEqual(list(state.folders), [self.root])
+
+    def test_async_listing(self):
+        async def walk():
+            paths = [path async for path in os_utils.aiter_directory(
+                self.root, '.txt', kind='file', recursive=True, chunk_size=1)]
+            chunks = [chunk async for chunk in os_utils.aiter_directory(
+                self.root, recursive=True, chunk_size=2, chunked=True)]
+            files = await os_utils.alist_files(self.root, '.log')
+            folders = await os_utils.alist_folders(self.root, recursive=True, workers=2)
+            everything = await os_utils.alist_directory(self.root)
+            return paths, chunks, files, folders, everything
+
+        paths, chunks, files, folders, everything = asyncio.run(walk())
+        self.assertEqual(paths, list(os_utils.iter_directory(self.root, '.txt', kind='file', recursive=True)))
+        self.assertEqual([len(chunk) for chunk in chunks], [2, 2, 2])
+        self.assertEqual(files, [self.path('b_file.log')])
+        self.assertEqual(folders, [self.path('sub_a'), self.path('sub_a', 'sub_b')])
+        self.assertEqual(sorted(everything), sorted(os_utils.list_directory(self.root)))
+
+    def test_async_listing_cancel(self):
+        async def cancel():
+            task = asyncio.ensure_future(os_utils.alist_files(self.root, recursive=True, chunk_size=1))
+            await asyncio.sleep(0)
+            task.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await task
+
+        asyncio.run(cancel())
+        with self.assertRaises(OSError):
+            asyncio.run(os_utils.alist_files(self.path('missing')))
+
+
+if __name__ == '__main__':
+    unittest.main()
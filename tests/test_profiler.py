@@ -0,0 +1,81 @@
+import unittest
+import os
+import signal
+import tempfile
+import threading
+import time
+from code_utils.decorators.timing import timer
+from code_utils.profiler import SamplingProfiler, profile_target, install_signal_handler, get_profiler
+
+
+def busy(duration):
+    end = time.monotonic() + duration
+    while time.monotonic() < end:
+        pass
+
+
+@profile_target
+def target(duration):
+    busy(duration)
+
+
+@profile_target
+@timer
+def timed_target(duration):
+    busy(duration)
+
+
+class TestProfiler(unittest.TestCase):
+    def test_sampling_profiler(self):
+        profiler = SamplingProfiler(interval=0.002)
+        with profiler:
+            thread = threading.Thread(target=target, args=(0.2,))
+            thread.start()
+            # not marked, not kept
+            busy(0.1)
+            timed_target(0.1)
+            thread.join()
+        self.assertFalse(profiler.running)
+        targets = profiler.target_samples()
+        self.assertGreater(targets[__name__ + ':target'], 10)
+        self.assertGreater(targets[__name__ + ':timed_target'], 5)
+        self.assertEqual(set(targets), {__name__ + ':target', __name__ + ':timed_target'})
+        stacks = profiler.stacks()
+        self.assertIn((__name__ + ':target', __name__ + ':busy'), stacks)
+        self.assertEqual(profiler.samples, sum(stacks.values()))
+        self.assertTrue(all(stack[0].endswith('target') or 'with_timer' in stack[0] for stack in stacks))
+
+        with tempfile.TemporaryDirectory() as tmp:
+            filepath = os.path.join(tmp, 'profiles', 'samples.folded')
+            profiler.write(filepath)
+            with open(filepath) as file:
+                lines = file.read().splitlines()
+        self.assertEqual(len(lines), len(stacks))
+        self.assertTrue(all(int(line.rsplit(' ', 1)[1]) > 0 for line in lines))
+
+        everything = SamplingProfiler(interval=0.002, targets_only=False)
+        with everything:
+            busy(0.05)
+        self.assertTrue(any(stack[-1] == __name__ + ':busy' for stack in everything.stacks()))
+
+    @unittest.skipUnless(hasattr(signal, 'SIGUSR2'), 'SIGUSR2 is required')
+    def test_signal_handler(self):
+        previous = signal.getsignal(signal.SIGUSR2)
+        self.addCleanup(signal.signal, signal.SIGUSR2, previous)
+        with tempfile.TemporaryDirectory() as tmp:
+            filepath = os.path.join(tmp, 'profile-{pid}.folded')
+            install_signal_handler(filepath)
+            os.kill(os.getpid(), signal.SIGUSR2)
+            self.assertTrue(get_profiler().running)
+            target(0.05)
+            os.kill(os.getpid(), signal.SIGUSR2)
+            for thread in threading.enumerate():
+                if thread.name == 'sampling-profiler-writer':
+                    thread.join()
+            self.assertFalse(get_profiler().running)
+            with open(filepath.format(pid=os.getpid())) as file:
+                self.assertIn(__name__ + ':target', file.read())
+
+
+if __name__ == '__main__':
+    unittest.main()